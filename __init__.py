@@ -39,7 +39,7 @@ from .operators.render import STRATUS_OT_render_animation
 from .operators.bake import STRATUS_OT_bake_env_img
 from .operators.bake_seq import STRATUS_OT_bake_seq
 from .operators.viewport_editor import STRATUS_OT_viewport_editor, STRATUS_OT_kill_viewport_editor
-from .operators.prop_observer import STRATUS_OT_prop_observer
+from .operators.headless import bake_headless
 from .operators.presets import (STRATUS_OT_daytime_1, STRATUS_OT_daytime_2, STRATUS_OT_daytime_3, STRATUS_OT_sunset_1, STRATUS_OT_sunset_2, STRATUS_OT_sunset_3, STRATUS_OT_storm, STRATUS_OT_alien, STRATUS_OT_hell, STRATUS_OT_full_moon, STRATUS_OT_blood_moon)
 
 from .panels.main_panel import (
@@ -112,7 +112,6 @@ classes = (
     STRATUS_OT_render_animation, 
     STRATUS_OT_viewport_editor,
     STRATUS_OT_kill_viewport_editor, 
-    STRATUS_OT_prop_observer,
 
     STRATUS_OT_daytime_1,
     STRATUS_OT_daytime_2,
@@ -203,5 +202,11 @@ def unregister():
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
+    if globals.FBO_POOL is not None:
+        globals.FBO_POOL.clear()
+
+    if globals.EDIT_SCHEDULER is not None:
+        globals.EDIT_SCHEDULER.cancel()
+
 if __name__ == "__main__":
     register()
\ No newline at end of file
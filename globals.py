@@ -41,15 +41,22 @@ NOISE_TEXTURES = bgl.Buffer(bgl.GL_INT, [NMB_NOISE_TEXTURES])
 global MOON_TEXTURES
 MOON_TEXTURES = bgl.Buffer(bgl.GL_INT, [NMB_MOON_TEXTURES])
 
+def gl_get_integer(name, default):
+    # Runs at import, when there might be no GL context (blender -b on a node
+    # without a GPU). The default stands in then, bake_headless checks for a
+    # GPU itself before drawing anything.
+    value = bgl.Buffer(bgl.GL_INT, [1])
+    try:
+        bgl.glGetIntegerv(name, value)
+    except Exception:
+        return default
+    return value[0] if value[0] > 0 else default
+
 global MAX_TEXTURE_IMAGE_UNITS
-max_tex_img_units = bgl.Buffer(bgl.GL_INT, [1])
-bgl.glGetIntegerv(bgl.GL_MAX_TEXTURE_IMAGE_UNITS, max_tex_img_units)
-MAX_TEXTURE_IMAGE_UNITS = max_tex_img_units[0] - 1
+MAX_TEXTURE_IMAGE_UNITS = gl_get_integer(bgl.GL_MAX_TEXTURE_IMAGE_UNITS, 16) - 1
 
 global MAX_TEXTURE_SIZE
-max_tex_size = bgl.Buffer(bgl.GL_INT, [1])
-bgl.glGetIntegerv(bgl.GL_MAX_TEXTURE_SIZE, max_tex_size)
-MAX_TEXTURE_SIZE = max_tex_size[0]
+MAX_TEXTURE_SIZE = gl_get_integer(bgl.GL_MAX_TEXTURE_SIZE, 16384)
 
 global ENV_IMG_SIZE
 ENV_IMG_SIZE = []
@@ -61,14 +68,33 @@ env_img_size = [
     ('8',   "8K",   '8192 x 4096',   '', 8),
     ('16',  "16K",  '16384 x 8192',  '', 16),
     ('24',  "24K",  '24576 x 12288', '', 24),
+    ('32',  "32K",  '32768 x 16384', '', 32),
+    ('64',  "64K",  '65536 x 32768', '', 64),
 ]
 
+def is_out_of_core(width, height):
+    # Images this large are baked a tile at a time into a disk canvas. An
+    # offscreen right at the limit is already several GB, so the limit itself
+    # counts as out-of-core.
+    return width >= MAX_TEXTURE_SIZE or height >= MAX_TEXTURE_SIZE
+
+def env_img_dim(size):
+    return (int(1024.0 * float(size)), int(512.0 * float(size)))
+
+# The viewport only uses sizes that fit in one offscreen.
 for size in env_img_size:
-    if (int(size[4])*1024) >= MAX_TEXTURE_SIZE:
-        break
-    else:
+    if not is_out_of_core(*env_img_dim(size[4])):
         ENV_IMG_SIZE.append(size)
 
+# Baked images can be larger than a texture, those are baked out-of-core.
+global ENV_IMG_RENDER_SIZE
+ENV_IMG_RENDER_SIZE = []
+
+for size in env_img_size:
+    if is_out_of_core(*env_img_dim(size[4])):
+        size = (size[0], size[1], size[2]+' (out-of-core)', size[3], size[4])
+    ENV_IMG_RENDER_SIZE.append(size)
+
 global TILE_SIZE
 TILE_SIZE = []
 
@@ -87,6 +113,8 @@ for size in tile_size:
     else:
         TILE_SIZE.append(size)
 
+global SHADER_SOURCE
+SHADER_SOURCE = {}
 global SHADER
 SHADER = {}
 global BATCH
@@ -98,6 +126,27 @@ LAST_FRAME = 0
 global CURRENT_FRAME
 CURRENT_FRAME = 0
 
+global SKY_STATE_VERSION
+SKY_STATE_VERSION = 0
+
+global ATMO_LUT
+ATMO_LUT = None
+
+global WEATHER_MAP
+WEATHER_MAP = None
+
+global SHADOW_VOLUME
+SHADOW_VOLUME = None
+
+global CPU_TEXTURES
+CPU_TEXTURES = None
+
+global FBO_POOL
+FBO_POOL = None
+
+global EDIT_SCHEDULER
+EDIT_SCHEDULER = None
+
 # ----------------------------------- Flags ---------------------------------- #
 
 global INITIALIZED_SHADERS 
@@ -109,9 +158,6 @@ INITIALIZED_TEXTURES = False
 global INITIALIZED_NODE_TREE
 INITIALIZED_NODE_TREE = False
 
-global EDITING_PROP
-EDITING_PROP = False
-
 global DRAW_ENV_IMG
 DRAW_ENV_IMG = False
 
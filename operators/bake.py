@@ -23,8 +23,10 @@ from datetime import datetime
 from .. import globals
 from .utils.env_img_utils import ENVImage
 from .utils.init_utils import init_shaders, init_textures, init_world_node_tree
-from .utils.general_utils import new_offscreen_fbo, refresh_viewers
-from .utils.draw_utils import draw_env_img, draw_irra_map
+from .utils.general_utils import refresh_viewers
+from .utils.fbo_pool import acquire_offscreen, release_offscreen
+from .utils.draw_utils import draw_env_img_tiles, draw_irra_map
+from .utils.tile_utils import TileScheduler
 
 class STRATUS_OT_bake_env_img(bpy.types.Operator):
     bl_idname = "stratus.bake_env_img"
@@ -34,6 +36,7 @@ class STRATUS_OT_bake_env_img(bpy.types.Operator):
     _offscreen_irra = None
 
     _env_img = None
+    _scheduler = None
 
     _start_time = 0
 
@@ -50,7 +53,7 @@ class STRATUS_OT_bake_env_img(bpy.types.Operator):
 
         draw_irra_map(self._offscreen_sky, self._offscreen_irra, 'RENDER')
         irra_tex = self._offscreen_irra.color_texture
-        draw_env_img(self._env_img, irra_tex, 'RENDER')
+        draw_env_img_tiles(self._env_img, irra_tex, 'RENDER', self._scheduler)
         self._bake_done = self._env_img.completed()
 
     @staticmethod
@@ -88,6 +91,7 @@ class STRATUS_OT_bake_env_img(bpy.types.Operator):
             size = float(prop.env_img_render_size)
 
             self._env_img = ENVImage(globals.IMG_NAME)
+            self._env_img.use_disk_canvas(prop.use_disk_canvas)
             self._env_img.set_size(size)
             
             # Initialize, if you havent already
@@ -103,8 +107,17 @@ class STRATUS_OT_bake_env_img(bpy.types.Operator):
             else:
                 self._env_img.disable_tiling()
 
-            self._offscreen_sky = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
-            self._offscreen_irra = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            # Out-of-core images don't fit in a Blender image, they are written
+            # to the output path instead of being loaded into the world.
+            if self._env_img.is_out_of_core() and not self._env_img.can_save_to_disk(prop.file_format, prop.exr_codec):
+                globals.BAKE_ENV_IMG = False
+                self.report({'ERROR'}, "STRATUS: "+prop.env_img_render_size+"K textures can only be baked to OpenEXR (None, ZIPS or ZIP codec) or Radiance HDR.")
+                return {'CANCELLED'}
+
+            self._scheduler = TileScheduler(prop.tile_time_budget)
+
+            self._offscreen_sky = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            self._offscreen_irra = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
 
             if not (self._offscreen_sky and self._offscreen_irra):
                 self.report({'ERROR'}, "STRATUS: error initializing offscreen buffer. More details in the console")
@@ -134,11 +147,18 @@ class STRATUS_OT_bake_env_img(bpy.types.Operator):
             return {'FINISHED'}
 
         if self._bake_done:
-            self._env_img.save()
+            if self._env_img.is_out_of_core():
+                try:
+                    self._env_img.save_to_disk(context, globals.IMG_NAME)
+                except Exception as e:
+                    self.report({'ERROR'}, "STRATUS: failed to write texture. "+str(e))
+                    self.clean_up(context)
+                    return {'CANCELLED'}
+            else:
+                self._env_img.save()
+                refresh_viewers(context)
             self._env_img.reset()
 
-            refresh_viewers(context)
-
             end_time = datetime.now()
             duration = end_time - self._start_time
             s = duration.total_seconds()
@@ -155,5 +175,5 @@ class STRATUS_OT_bake_env_img(bpy.types.Operator):
 
         STRATUS_OT_bake_env_img._is_enabled = False
 
-        self._offscreen_sky.free()
-        self._offscreen_irra.free()
\ No newline at end of file
+        release_offscreen(self._offscreen_sky)
+        release_offscreen(self._offscreen_irra)
\ No newline at end of file
@@ -22,9 +22,11 @@ from datetime import datetime
 
 from .. import globals
 from .utils.env_img_utils import ENVImage
+from .utils.writer_utils import AsyncImageWriter
 from .utils.init_utils import init_shaders, init_textures, init_world_node_tree
-from .utils.general_utils import new_offscreen_fbo
-from .utils.draw_utils import draw_env_img, draw_irra_map
+from .utils.fbo_pool import acquire_offscreen, release_offscreen
+from .utils.draw_utils import draw_env_img_tiles, draw_irra_map
+from .utils.tile_utils import TileScheduler
 
 class STRATUS_OT_bake_seq (bpy.types.Operator):
     bl_idname = "stratus._bake_seq"
@@ -40,6 +42,8 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
     _is_enabled = False
     _render_filepath = None
     _env_img = None
+    _scheduler = None
+    _writer = None
     _draw_handles = []
 
     @staticmethod
@@ -49,7 +53,7 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
 
         draw_irra_map(self._offscreen_sky, self._offscreen_irra, 'RENDER')
         irra_tex = self._offscreen_irra.color_texture
-        draw_env_img(self._env_img, irra_tex, 'RENDER')
+        draw_env_img_tiles(self._env_img, irra_tex, 'RENDER', self._scheduler)
         self._frame_done = self._env_img.completed()
 
     @staticmethod
@@ -88,6 +92,7 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
             size = int(prop.env_img_render_size)
 
             self._env_img = ENVImage(globals.IMG_NAME)
+            self._env_img.use_disk_canvas(prop.use_disk_canvas)
             self._env_img.set_size(size)
             
             # Initialize, if you havent already
@@ -103,11 +108,8 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
             else:
                 self._env_img.disable_tiling()
 
-            self._offscreen_sky = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
-            self._offscreen_irra = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
-
-            if not (self._offscreen_sky and self._offscreen_irra):
-                self.report({'ERROR'}, "STRATUS: error initializing offscreen buffer. More details in the console")
+            if not self._env_img.can_save_to_disk(prop.file_format, prop.exr_codec):
+                self.report({'ERROR'}, "STRATUS: "+prop.env_img_render_size+"K textures can only be baked to OpenEXR (None, ZIPS or ZIP codec) or Radiance HDR.")
                 return {'CANCELLED'}
 
             file_format = context.scene.render.image_settings.file_format
@@ -115,6 +117,20 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
                 self.report({'ERROR'}, "STRATUS: animation formats AVI_JPEG, AVI_RAW, FFMPEG, are not supported. Please select an image format type.")
                 return {'CANCELLED'}
 
+            # Allocated once everything is validated, the early returns above
+            # have nothing to release.
+            self._offscreen_sky = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            self._offscreen_irra = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+
+            if not (self._offscreen_sky and self._offscreen_irra):
+                release_offscreen(self._offscreen_sky)
+                release_offscreen(self._offscreen_irra)
+                self.report({'ERROR'}, "STRATUS: error initializing offscreen buffer. More details in the console")
+                return {'CANCELLED'}
+
+            self._scheduler = TileScheduler(prop.tile_time_budget)
+            self._writer = AsyncImageWriter(prop.write_queue_depth)
+
             self._render_filepath = context.scene.render.filepath
             self._current_frame = context.scene.frame_start
             self._frame_end = context.scene.frame_end + 1
@@ -138,18 +154,36 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
             self.report({'INFO'}, "STRATUS: render stopped.")
             self.clean_up(context)
             return {'FINISHED'}
-        
+
+        # Anything a writer thread raised comes out of poll, not just I/O
+        # errors. The bake is stopped either way, so the offscreens and the
+        # writer don't outlive it.
+        try:
+            self._report_writes(self._writer.poll())
+        except Exception as e:
+            self.report({'ERROR'}, "STRATUS: failed to write frame. "+str(e))
+            self.clean_up(context)
+            return {'CANCELLED'}
+
         if self._frame_done:
             scene = context.scene
 
-            self._env_img.save_to_disk(context, str(self._current_frame).zfill(4))
+            try:
+                write_seconds = self._env_img.save_to_disk(context, str(self._current_frame).zfill(4), self._writer)
+            except Exception as e:
+                self.report({'ERROR'}, "STRATUS: failed to write frame. "+str(e))
+                self.clean_up(context)
+                return {'CANCELLED'}
             self._env_img.reset()
 
             end_time = datetime.now()
             duration = end_time - self._start_time
             s = duration.total_seconds()
 
-            self.report({'INFO'}, "STRATUS: Frame took "+'{:02.0f}:{:05.2f}'.format(s % 3600 // 60, s % 60)+"\n")
+            if write_seconds is None:
+                self.report({'INFO'}, "STRATUS: Frame took "+'{:02.0f}:{:05.2f}'.format(s % 3600 // 60, s % 60)+"\n")
+            else:
+                self.report({'INFO'}, "STRATUS: Frame took "+'{:02.0f}:{:05.2f}'.format(s % 3600 // 60, s % 60)+", writing took "+'{:.2f}'.format(write_seconds)+"s\n")
 
             self._current_frame += 1
             scene.frame_set(self._current_frame)
@@ -163,10 +197,20 @@ class STRATUS_OT_bake_seq (bpy.types.Operator):
 
         return {'PASS_THROUGH'}
 
+    def _report_writes(self, writes):
+        for filepath, seconds in writes:
+            self.report({'INFO'}, "STRATUS: Wrote "+filepath+", took "+'{:.2f}'.format(seconds)+"s")
+
     def clean_up(self, context):
         STRATUS_OT_bake_seq._is_enabled = False
 
+        # Blocks until the queued frames are on disk.
+        try:
+            self._report_writes(self._writer.close())
+        except Exception as e:
+            self.report({'ERROR'}, "STRATUS: failed to write frame. "+str(e))
+
         context.scene.render.filepath = self._render_filepath
 
-        self._offscreen_sky.free()
-        self._offscreen_irra.free()
\ No newline at end of file
+        release_offscreen(self._offscreen_sky)
+        release_offscreen(self._offscreen_irra)
\ No newline at end of file
@@ -0,0 +1,205 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import os
+import bpy
+import gpu
+from datetime import datetime
+
+from .. import globals
+from .utils.env_img_utils import ENVImage, write_pixels_to_file
+from .utils.writer_utils import can_write_directly
+from .utils.init_utils import init_shaders, init_textures, init_cpu_textures
+from .utils.fbo_pool import acquire_offscreen, release_offscreen
+from .utils.draw_utils import draw_env_img, draw_irra_map
+from .utils.sky_state import get_sky_state
+from .utils.cpu_renderer import params_from_state, render_irradiance_map
+from .utils.cpu_worker_init import import_module
+
+# Usage, e.g. on a render node without a display:
+#
+#   blender -b scene.blend --python-expr "import Stratus; Stratus.bake_headless('/tmp/sky_', frame_start=1, frame_end=24)"
+#
+# Unlike the bake operators this does not rely on a VIEW_3D draw handler, all
+# tiles are drawn back-to-back from the calling thread. With device='CPU' the
+# frames are rendered by cpu_renderer instead, for nodes without a GPU. The
+# tiles are spread over `workers` processes (all cores by default).
+#
+# The CPU workers are spawned and re-run the __main__ script, so start CPU
+# bakes with --python-expr as above, or from a script that only imports bpy
+# inside its `if __name__ == "__main__":` block.
+
+class HeadlessReporter:
+    # Stand-in for the operator passed to the init_* functions.
+    def report(self, type, message):
+        print(message)
+
+def _require_gpu():
+    # Under blender -b there may be no GPU context at all, drawing would then
+    # fail deep inside the first GL call.
+    try:
+        gpu.types.GPUOffScreen(1, 1).free()
+    except Exception as e:
+        mode = " in background mode" if bpy.app.background else ""
+        raise RuntimeError("STRATUS: no GPU available"+mode+" ("+str(e)+"). Run Blender with a GPU or bake with device='CPU'.")
+
+def _format_duration(duration):
+    s = duration.total_seconds()
+    return '{:02.0f}:{:05.2f}'.format(s % 3600 // 60, s % 60)
+
+def bake_headless(filepath=None, scene=None, size=None, frame_start=None, frame_end=None, file_format=None, color_mode=None, exr_codec=None, color_depth=None, device='GPU', workers=None):
+    # Bakes the environment image for every frame in [frame_start, frame_end]
+    # and writes it to filepath+frame+extension. Settings not passed in are
+    # taken from the scene's render properties. Returns the written files.
+    if scene is None:
+        scene = bpy.context.scene
+
+    prop = scene.render_props
+
+    filepath = bpy.path.abspath(prop.file_path if filepath is None else filepath)
+    size = float(prop.env_img_render_size if size is None else size)
+    frame_start = scene.frame_current if frame_start is None else frame_start
+    frame_end = frame_start if frame_end is None else frame_end
+    file_format = prop.file_format if file_format is None else file_format
+    color_mode = prop.color_mode if color_mode is None else color_mode
+    exr_codec = prop.exr_codec if exr_codec is None else exr_codec
+    color_depth = prop.color_depth if color_depth is None else color_depth
+
+    if file_format not in {'OPEN_EXR', 'OPEN_EXR_MULTILAYER', 'HDR'}:
+        raise ValueError("STRATUS: unsupported file format "+str(file_format)+", expected OPEN_EXR, OPEN_EXR_MULTILAYER or HDR.")
+
+    if device not in {'GPU', 'CPU'}:
+        raise ValueError("STRATUS: unsupported device "+str(device)+", expected GPU or CPU.")
+
+    extension = '.exr' if (file_format in {'OPEN_EXR', 'OPEN_EXR_MULTILAYER'}) else '.hdr'
+
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    reporter = HeadlessReporter()
+
+    if device == 'CPU':
+        return _bake_headless_cpu(reporter, filepath, scene, size, frame_start, frame_end, file_format, color_mode, exr_codec, color_depth, extension, workers)
+
+    _require_gpu()
+
+    init_textures(reporter)
+    init_shaders(reporter)
+
+    env_img = ENVImage(globals.IMG_NAME)
+    env_img.use_disk_canvas(prop.use_disk_canvas)
+    env_img.set_size(size)
+
+    if prop.enable_tiling:
+        i = int(prop.render_tile_size)
+        env_img.enable_tiling()
+        env_img.set_tile_size(globals.TILE_SIZE[i][4])
+    else:
+        env_img.disable_tiling()
+
+    if not env_img.can_save_to_disk(file_format, exr_codec):
+        raise RuntimeError("STRATUS: out-of-core images can only be written as OpenEXR (None, ZIPS or ZIP codec) or Radiance HDR.")
+
+    offscreen_sky = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+    offscreen_irra = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+
+    if not (offscreen_sky and offscreen_irra):
+        raise RuntimeError("STRATUS: error initializing offscreen buffer. More details in the console")
+
+    width, height = env_img.get_size()
+    print("STRATUS: headless bake of "+str(width)+"x"+str(height)+", frames "+str(frame_start)+"-"+str(frame_end)+".")
+
+    globals.BAKE_ENV_IMG = True
+
+    written = []
+    current_frame = scene.frame_current
+    bake_start_time = datetime.now()
+
+    try:
+        for frame in range(frame_start, frame_end + 1):
+            start_time = datetime.now()
+
+            scene.frame_set(frame)
+            state = get_sky_state(scene)
+
+            draw_irra_map(offscreen_sky, offscreen_irra, 'RENDER', state)
+            irra_tex = offscreen_irra.color_texture
+
+            env_img.reset()
+            while True:
+                draw_env_img(env_img, irra_tex, 'RENDER', state)
+                if env_img.completed():
+                    break
+
+            frame_filepath = filepath+str(frame).zfill(4)+extension
+            write_seconds = env_img.write_to_file(frame_filepath, file_format, color_mode, exr_codec, color_depth)
+            written.append(frame_filepath)
+
+            print("STRATUS: Frame "+str(frame)+" took "+_format_duration(datetime.now() - start_time)+", writing took "+'{:.2f}'.format(write_seconds)+"s")
+    finally:
+        globals.BAKE_ENV_IMG = False
+
+        scene.frame_set(current_frame)
+
+        release_offscreen(offscreen_sky)
+        release_offscreen(offscreen_irra)
+
+    print("STRATUS: headless bake completed. Took "+_format_duration(datetime.now() - bake_start_time))
+
+    return written
+
+def _bake_headless_cpu(reporter, filepath, scene, size, frame_start, frame_end, file_format, color_mode, exr_codec, color_depth, extension, workers):
+    textures = init_cpu_textures(reporter)
+
+    width, height = globals.env_img_dim(size)
+
+    # Same rule as the GPU bake, Blender's image writer would need the whole
+    # image copied into a Blender image.
+    if globals.is_out_of_core(width, height) and not can_write_directly(file_format, exr_codec):
+        raise RuntimeError("STRATUS: out-of-core images can only be written as OpenEXR (None, ZIPS or ZIP codec) or Radiance HDR.")
+
+    cpu_bake = import_module("cpu_bake").CPUBake(width, height, textures, workers)
+    print("STRATUS: headless CPU bake of "+str(width)+"x"+str(height)+", frames "+str(frame_start)+"-"+str(frame_end)+", "+str(cpu_bake.get_workers())+" workers.")
+
+    written = []
+    current_frame = scene.frame_current
+    bake_start_time = datetime.now()
+
+    try:
+        for frame in range(frame_start, frame_end + 1):
+            start_time = datetime.now()
+
+            scene.frame_set(frame)
+            params = params_from_state(get_sky_state(scene), 'RENDER')
+
+            cpu_bake.render(params, render_irradiance_map(params))
+
+            frame_filepath = filepath+str(frame).zfill(4)+extension
+            write_seconds = write_pixels_to_file(globals.IMG_NAME, cpu_bake.get_pixels().ravel(), width, height, frame_filepath, file_format, color_mode, exr_codec, color_depth)
+            written.append(frame_filepath)
+
+            print("STRATUS: Frame "+str(frame)+" took "+_format_duration(datetime.now() - start_time)+", writing took "+'{:.2f}'.format(write_seconds)+"s")
+    finally:
+        scene.frame_set(current_frame)
+        cpu_bake.close()
+
+    print("STRATUS: headless CPU bake completed. Took "+_format_duration(datetime.now() - bake_start_time))
+
+    return written
@@ -23,8 +23,9 @@ from datetime import datetime
 from .. import globals
 from .utils.env_img_utils import ENVImage
 from .utils.init_utils import init_shaders, init_textures, init_world_node_tree
-from .utils.general_utils import new_offscreen_fbo
-from .utils.draw_utils import draw_env_img, draw_irra_map
+from .utils.fbo_pool import acquire_offscreen, release_offscreen
+from .utils.draw_utils import draw_env_img_tiles, draw_irra_map
+from .utils.tile_utils import TileScheduler
 
 class STRATUS_OT_render_animation (bpy.types.Operator):
     bl_idname = "stratus.render_animation"
@@ -40,6 +41,7 @@ class STRATUS_OT_render_animation (bpy.types.Operator):
     _is_enabled = False
     _render_filepath = None
     _env_img = None
+    _scheduler = None
     _draw_handles = []
 
     @staticmethod
@@ -49,7 +51,7 @@ class STRATUS_OT_render_animation (bpy.types.Operator):
 
         draw_irra_map(self._offscreen_sky, self._offscreen_irra, 'RENDER')
         irra_tex = self._offscreen_irra.color_texture
-        draw_env_img(self._env_img, irra_tex, 'RENDER')
+        draw_env_img_tiles(self._env_img, irra_tex, 'RENDER', self._scheduler)
         self._frame_done = self._env_img.completed()
 
     @staticmethod
@@ -88,6 +90,7 @@ class STRATUS_OT_render_animation (bpy.types.Operator):
             size = int(prop.env_img_render_size)
 
             self._env_img = ENVImage(globals.IMG_NAME)
+            self._env_img.use_disk_canvas(prop.use_disk_canvas)
             self._env_img.set_size(size)
             
             # Initialize, if you haven't already
@@ -103,8 +106,16 @@ class STRATUS_OT_render_animation (bpy.types.Operator):
             else:
                 self._env_img.disable_tiling()
 
-            self._offscreen_sky = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
-            self._offscreen_irra = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            # The render reads the env image through the world's Blender image,
+            # which out-of-core images can't be loaded into.
+            if self._env_img.is_out_of_core():
+                self.report({'ERROR'}, "STRATUS: "+prop.env_img_render_size+"K textures are larger than the GPU's texture limit and can't be rendered with. Bake them to disk instead.")
+                return {'CANCELLED'}
+
+            self._scheduler = TileScheduler(prop.tile_time_budget)
+
+            self._offscreen_sky = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            self._offscreen_irra = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
 
             if not (self._offscreen_sky and self._offscreen_irra):
                 self.report({'ERROR'}, "STRATUS: error initializing offscreen buffer. More details in the console")
@@ -171,5 +182,5 @@ class STRATUS_OT_render_animation (bpy.types.Operator):
 
         context.scene.render.filepath = self._render_filepath
 
-        self._offscreen_sky.free()
-        self._offscreen_irra.free()
\ No newline at end of file
+        release_offscreen(self._offscreen_sky)
+        release_offscreen(self._offscreen_irra)
\ No newline at end of file
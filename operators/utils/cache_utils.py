@@ -0,0 +1,125 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import bpy
+import os
+import glob
+import json
+import struct
+import hashlib
+import numpy as np
+
+# Bump whenever the blob layout or the quantization changes.
+CACHE_VERSION = 1
+CACHE_MAGIC = b'STRC'
+
+# magic, version, width, height, depth, channels
+_HEADER = struct.Struct('<4sIIIII')
+
+_INDEX_NAME = "index.json"
+
+def get_cache_dir():
+    return bpy.utils.user_resource('DATAFILES', path="stratus_cache", create=True)
+
+def _load_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _INDEX_NAME), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _save_index(cache_dir, index):
+    tmp_path = os.path.join(cache_dir, _INDEX_NAME+".tmp")
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file)
+    os.replace(tmp_path, os.path.join(cache_dir, _INDEX_NAME))
+
+def _source_key(cache_dir, filepath):
+    # The content hash is only recomputed when the source's mtime or size changed.
+    stat = os.stat(filepath)
+    index = _load_index(cache_dir)
+    entry = index.get(filepath)
+
+    if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        return entry["hash"], stat.st_mtime_ns
+
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+
+    index[filepath] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": sha1.hexdigest()}
+    _save_index(cache_dir, index)
+
+    return index[filepath]["hash"], stat.st_mtime_ns
+
+def _blob_prefix(filepath):
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+def _blob_path(cache_dir, filepath):
+    source_hash, mtime = _source_key(cache_dir, filepath)
+    name = _blob_prefix(filepath)+"-"+source_hash[:16]+"-"+str(mtime)+".v"+str(CACHE_VERSION)+".bin"
+    return os.path.join(cache_dir, name)
+
+def load_cached_texture(filepath):
+    # Returns (pixels, dim) with pixels a read-only uint8 memmap, or None on a miss.
+    try:
+        cache_dir = get_cache_dir()
+        blob_path = _blob_path(cache_dir, filepath)
+
+        with open(blob_path, 'rb') as file:
+            magic, version, width, height, depth, channels = _HEADER.unpack(file.read(_HEADER.size))
+    except (OSError, struct.error):
+        return None
+
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        return None
+
+    dim = (width, height, depth) if depth > 0 else (width, height)
+    size = width * height * max(depth, 1) * channels
+
+    try:
+        pixels = np.memmap(blob_path, dtype=np.uint8, mode='r', offset=_HEADER.size, shape=(size,))
+    except (OSError, ValueError):
+        return None
+
+    return pixels, dim
+
+def store_cached_texture(filepath, pixels, dim, channels):
+    # Textures are uploaded as GL_RGBA8, so quantizing to uint8 here loses nothing.
+    try:
+        cache_dir = get_cache_dir()
+        blob_path = _blob_path(cache_dir, filepath)
+
+        for stale in glob.glob(os.path.join(cache_dir, glob.escape(_blob_prefix(filepath))+"-*.bin")):
+            if stale != blob_path:
+                os.remove(stale)
+
+        depth = dim[2] if len(dim) == 3 else 0
+        header = _HEADER.pack(CACHE_MAGIC, CACHE_VERSION, dim[0], dim[1], depth, channels)
+
+        data = np.rint(np.clip(pixels, 0.0, 1.0) * 255.0).astype('<u1')
+
+        tmp_path = blob_path+".tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(header)
+            data.tofile(file)
+        os.replace(tmp_path, blob_path)
+    except OSError as e:
+        print("STRATUS: could not write texture cache for "+filepath+": "+str(e))
@@ -0,0 +1,190 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+# Multiprocess tiled bake with cpu_renderer.
+#
+# The image lives in one shared memory block that every worker writes its
+# tiles into, the textures are shared the same way (or as the texture cache
+# memmaps), so no pixel data is ever pickled. A task only carries the scene
+# params, the irradiance map and the tile rectangle.
+#
+# Workers are spawned, not forked, Blender's process state isn't fork safe.
+# They can't import bpy, see cpu_worker_init.py for how this module gets to
+# them. Import it through cpu_worker_init.import_module("cpu_bake").
+
+import os
+import time
+import runpy
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+
+from .cpu_renderer import CPUTextures, render_env_img, render_irradiance_map
+
+# Smaller than the GPU tiles, the tiles are the unit of load balancing here.
+CPU_TILE_SIZE = 256
+
+def tile_rects(width, height, tile_size):
+    # (x, y, w, h) of every tile, in ENVImage's order: tile_id % grid_width
+    # along x, tile_id / grid_width along y. Unlike ENVImage the last row and
+    # column are partial tiles if the size isn't a multiple of tile_size.
+    grid_width = -(-width // tile_size)
+    grid_height = -(-height // tile_size)
+
+    rects = []
+    for tile_id in range(grid_width * grid_height):
+        x = (tile_id % grid_width) * tile_size
+        y = (tile_id // grid_width) * tile_size
+        rects.append((x, y, min(tile_size, width - x), min(tile_size, height - y)))
+    return rects
+
+# ------------------------------ Shared arrays ------------------------------ #
+
+def _share_array(array):
+    # Returns (descriptor, shared memory block or None). Memmaps are passed by
+    # file name, everything else is copied into a new shared memory block.
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return ("memmap", array.filename, array.offset, array.dtype.str, array.shape), None
+
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return ("shm", shm.name, array.dtype.str, array.shape), shm
+
+# Arrays attached by this worker, by descriptor, and the shared memory blocks
+# they are views of.
+_attached = {}
+_attached_blocks = []
+
+def _attach(descriptor):
+    array = _attached.get(descriptor)
+    if array is not None:
+        return array
+
+    if descriptor[0] == "memmap":
+        _, filename, offset, dtype, shape = descriptor
+        array = np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape)
+    else:
+        _, name, dtype, shape = descriptor
+        shm = shared_memory.SharedMemory(name=name)
+        _attached_blocks.append(shm)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    _attached[descriptor] = array
+    return array
+
+# --------------------------------- Worker ---------------------------------- #
+
+def render_tile(image_descriptor, texture_descriptors, params, irra, rect):
+    start_time = time.perf_counter()
+
+    pixels = _attach(image_descriptor)
+    textures = CPUTextures(*(_attach(d) for d in texture_descriptors))
+
+    height, width = pixels.shape[:2]
+    x, y, w, h = rect
+
+    render_env_img(params, textures, width, height, irra=irra, rows=(y, y + h), cols=(x, x + w), out=pixels[y:y+h, x:x+w])
+
+    return rect, time.perf_counter() - start_time
+
+# --------------------------------- Parent ---------------------------------- #
+
+class CPUBake:
+    # Owns the worker pool and the shared image. The pool is kept alive
+    # between frames, so workers only attach the textures once.
+
+    def __init__(self, width, height, textures, workers=None, tile_size=CPU_TILE_SIZE):
+        self._executor = None
+        self._blocks = []
+
+        self._width = width
+        self._height = height
+        self._tile_size = tile_size
+        self._workers = workers or os.cpu_count() or 1
+
+        self._image_shm = shared_memory.SharedMemory(create=True, size=width * height * 4 * 4)
+        self._blocks.append(self._image_shm)
+        self._pixels = np.ndarray((height, width, 4), dtype=np.float32, buffer=self._image_shm.buf)
+        self._image_descriptor = ("shm", self._image_shm.name, self._pixels.dtype.str, self._pixels.shape)
+
+        self._texture_descriptors = []
+        for array in textures:
+            descriptor, shm = _share_array(array)
+            self._texture_descriptors.append(descriptor)
+            if shm is not None:
+                self._blocks.append(shm)
+
+        bootstrap = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cpu_worker_init.py")
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=get_context('spawn'),
+            initializer=runpy.run_path,
+            initargs=(bootstrap,))
+
+    def __del__(self):
+        self.close()
+
+    def get_workers(self):
+        return self._workers
+
+    def get_pixels(self):
+        # View into the shared image, only valid until close(). Views must be
+        # dropped before closing, the block can't be closed while exported.
+        return self._pixels
+
+    def render(self, params, irra=None, progress=None):
+        # Renders all tiles and returns the image, rows bottom to top.
+        # progress(done, total) is called as tiles complete.
+        if irra is None:
+            irra = render_irradiance_map(params)
+        irra = np.ascontiguousarray(irra, dtype=np.float32)
+
+        rects = tile_rects(self._width, self._height, self._tile_size)
+
+        futures = [
+            self._executor.submit(render_tile, self._image_descriptor, self._texture_descriptors, params, irra, rect)
+            for rect in rects
+        ]
+
+        done = 0
+        try:
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress is not None:
+                    progress(done, len(rects))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        return self._pixels
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+        self._pixels = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
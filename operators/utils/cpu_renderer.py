@@ -0,0 +1,950 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+# NumPy port of stratus_env_img.frag, vectorized over batches of pixels.
+#
+# The atmosphere is the brute force spectral integration the shaders did
+# before the lookup tables (stratus_sky.frag still does), so this doubles as
+# the reference for the LUT and RGB approximations. Everything else follows
+# the shader line by line, including its quirks, so the two can be diffed.
+# Known differences:
+#
+#   - Math is done in double precision.
+#   - The irradiance map is convolved with a coarser step (see
+#     render_irradiance_map), it is smooth enough that this doesn't show.
+#   - The clouds use the view ray of the pixel, the shader uses the last
+#     moon SSAA sample for pixels that hit the moon.
+#
+# Rows are bottom to top like the GPU image. Nothing in here needs bpy, the
+# scene values come in through params_from_state.
+
+import math
+import numpy as np
+
+from collections import namedtuple
+
+from .spectral import (
+    IRRADIANCE,
+    MIE_COEFF,
+    OZONE_COEFF,
+    RAYLEIGH_COEFF,
+    SPEC_TO_RGB,
+)
+
+# Noise and moon textures as (height, width, 4) or (depth, height, width, 4)
+# arrays, uint8 (e.g. the texture cache memmaps) or float.
+CPUTextures = namedtuple("CPUTextures", (
+    "noise_3d_64",
+    "noise_3d_128",
+    "noise_2d_2048",
+    "blue_noise",
+    "moon_albedo",
+    "moon_normal",
+))
+
+EARTH_RADIUS = 6360e3
+ATMOSPHERE_RADIUS = 6420e3
+
+RAYLEIGH_SCALE_HEIGHT = 8.0e3
+MIE_SCALE_HEIGHT = 1.2e3
+
+ATMO_CAMERA_OFFSET = 1000.0
+
+MIE_G = 0.75
+
+MAX_RADIATION = 2e31
+RATIO = 3.066257e-22
+
+MOON_DIST = 500.0
+MOON_LIGHT_SCALE = 0.000025
+
+ATMO_STEPS = 64
+
+# Floor for denominators the panels let reach zero (sun size, roundness,
+# density height). The shader divides by zero to inf and carries on, Python
+# floats raise instead.
+MIN_DENOM = 1e-6
+
+# Gauss-Laguerre style nodes for the optical depth towards the atmosphere
+# boundary, same as stratus_sky.frag.
+QUADRATURE_NODES = np.array((
+    0.006811185292, 0.03614807107, 0.09004346519, 0.1706680068,
+    0.2818362161, 0.4303406404, 0.6296271457, 0.9145252695))
+QUADRATURE_WEIGHTS = np.array((
+    0.01750893642, 0.04135477391, 0.06678839063, 0.09507698807,
+    0.1283416365, 0.1707430204, 0.2327233347, 0.3562490486))
+
+CAMERA_POS = np.array((0.0, 0.0, EARTH_RADIUS + ATMO_CAMERA_OFFSET))
+
+# --------------------------------- Params ---------------------------------- #
+
+def _cloud_params(state, layer, max_steps, max_light_steps):
+    cloud = {}
+    for name, value in state.cloud_params(layer).items():
+        if name == "transform":
+            cloud[name] = np.array(value, dtype=np.float64)
+        elif hasattr(value, "__len__"):
+            cloud[name] = np.array(value[:], dtype=np.float64)
+        else:
+            cloud[name] = value
+
+    cloud["max_steps"] = int(max_steps)
+    cloud["max_light_steps"] = int(max_light_steps)
+    return cloud
+
+def params_from_state(state, render_context='RENDER'):
+    # Flattens a SkyState into plain floats and arrays, the same values
+    # pack_sky_params puts into the uniform buffer.
+    atmo_prop = state.atmo_props
+    sun_prop = state.sun_props
+    moon_prop = state.moon_props
+    stars_prop = state.stars_props
+
+    flags = state.enable_flags(render_context)
+    max_steps = state.max_steps(render_context)
+
+    _, cld_domain_center = state.cld_domain()
+    moon_rot_mat, moon_phase_dir = state.moon_params()
+
+    return {
+        "enable_atm":           flags["enable_atm"],
+        "enable_sun":           flags["enable_sun"],
+        "enable_moon":          flags["enable_moon"],
+        "enable_stars":         flags["enable_stars"],
+        "enable_cld_0":         flags["enable_cld_0"],
+        "enable_cld_1":         flags["enable_cld_1"],
+        "enable_sun_as_light":  sun_prop.sun_enable_light,
+        "enable_moon_as_light": moon_prop.moon_enable_light,
+
+        "sun_dir":              np.array(state.sun_dir()[:]),
+        "sun_intsty":           sun_prop.sun_intsty,
+        "sun_half_angular":     sun_prop.sun_size / 2.0,
+
+        "moon_dir":             np.array(state.moon_dir()[:]),
+        "moon_intsty":          moon_prop.moon_intsty,
+        "moon_half_angular":    moon_prop.moon_size / 2.0,
+        "moon_ambient_intsty":  moon_prop.moon_ambient_intsty,
+        "moon_rot_mat":         np.array(moon_rot_mat, dtype=np.float64),
+        "moon_phase_dir":       np.array(moon_phase_dir[:]),
+
+        "stars_rot_mat":        np.array(state.stars_rot_mat(), dtype=np.float64),
+        "stars_intsty":         stars_prop.stars_intsty,
+
+        "altitude":             atmo_prop.prop_sky_altitude,
+        "rayleigh_density":     atmo_prop.prop_air,
+        "mie_density":          atmo_prop.prop_dust,
+        "ozone_density":        atmo_prop.prop_ozone,
+
+        "cld_domain_center":    np.array(cld_domain_center[:]),
+
+        "clouds": (
+            _cloud_params(state, 0, max_steps[0], max_steps[2]),
+            _cloud_params(state, 1, max_steps[1], max_steps[3]),
+        ),
+    }
+
+# --------------------------------- Utility --------------------------------- #
+
+def _dot(a, b):
+    return np.einsum('...i,...i->...', a, b)
+
+def _normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+def _saturate(x):
+    return np.clip(x, 0.0, 1.0)
+
+def _remap(v, l1, h1, l2, h2):
+    return l2 + (v - l1) * (h2 - l2) / (h1 - l1)
+
+def _mix(a, b, t):
+    return a + (b - a) * t
+
+def _smoothstep(e0, e1, x):
+    t = _saturate((x - e0) / (e1 - e0))
+    return t * t * (3.0 - 2.0 * t)
+
+def _clamped_mix(a, b, t):
+    # _mix in the shader.
+    return _saturate(1.0 - t)[..., None] * a + _saturate(t)[..., None] * b
+
+def _transform_dir(mat, v):
+    return v @ mat[:3, :3].T
+
+def _transform_point(mat, p):
+    return p @ mat[:3, :3].T + mat[:3, 3]
+
+def sample_spherical_direction(uv):
+    phi = 2.0 * math.pi * (uv[..., 0] - 0.5)
+    theta = math.pi * uv[..., 1]
+
+    return np.stack((
+        np.cos(phi) * np.sin(theta),
+        -np.sin(phi) * np.sin(theta),
+        -np.cos(theta)), axis=-1)
+
+def sample_spherical_map(d):
+    return np.stack((
+        0.5 - np.arctan2(d[..., 2], d[..., 0]) / (2.0 * math.pi),
+        0.5 + np.arcsin(np.clip(d[..., 1], -1.0, 1.0)) / math.pi), axis=-1)
+
+def sample_spherical_map2(d):
+    return np.stack((
+        0.5 - np.arctan2(d[..., 1], d[..., 0]) / (2.0 * math.pi),
+        0.5 + np.arcsin(np.clip(d[..., 2], -1.0, 1.0)) / math.pi), axis=-1)
+
+# -------------------------------- Textures --------------------------------- #
+
+def _texel_scale(tex):
+    return 1.0 / 255.0 if tex.dtype == np.uint8 else 1.0
+
+def texture_2d(tex, uv):
+    # Bilinear filtering with GL_REPEAT, uv in texture space.
+    height, width = tex.shape[:2]
+
+    x = uv[..., 0] * width - 0.5
+    y = uv[..., 1] * height - 0.5
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = (x - x0)[..., None]
+    fy = (y - y0)[..., None]
+
+    x0 = x0.astype(np.int64) % width
+    y0 = y0.astype(np.int64) % height
+    x1 = (x0 + 1) % width
+    y1 = (y0 + 1) % height
+
+    c = ((tex[y0, x0] * (1.0 - fx) + tex[y0, x1] * fx) * (1.0 - fy) +
+         (tex[y1, x0] * (1.0 - fx) + tex[y1, x1] * fx) * fy)
+    return c * _texel_scale(tex)
+
+def texture_3d(tex, uvw):
+    # Trilinear filtering with GL_REPEAT, the array is indexed [z, y, x].
+    depth, height, width = tex.shape[:3]
+
+    coords = []
+    for i, size in enumerate((width, height, depth)):
+        x = uvw[..., i] * size - 0.5
+        x0 = np.floor(x)
+        f = (x - x0)[..., None]
+        x0 = x0.astype(np.int64) % size
+        coords.append((x0, (x0 + 1) % size, f))
+
+    (x0, x1, fx), (y0, y1, fy), (z0, z1, fz) = coords
+
+    c = 0.0
+    for z, wz in ((z0, 1.0 - fz), (z1, fz)):
+        for y, wy in ((y0, 1.0 - fy), (y1, fy)):
+            c = c + (tex[z, y, x0] * (1.0 - fx) + tex[z, y, x1] * fx) * (wy * wz)
+    return c * _texel_scale(tex)
+
+# ------------------------------- Intersection ------------------------------ #
+
+def sphere_intersect(pos, dir, center, radius):
+    l = pos - center
+    b = _dot(dir, l)
+    qc = l - b[..., None] * dir
+    h = radius * radius - _dot(qc, qc)
+
+    miss = h < 0.0
+    h = np.sqrt(np.maximum(h, 0.0))
+
+    t0 = np.where(miss, -1.0, -b - h)
+    t1 = np.where(miss, -1.0, -b + h)
+
+    behind = (t0 < 0.0) & (t1 < 0.0)
+    return ~miss & ~behind, t0, t1
+
+def surface_intersection(pos, dir):
+    hit, t0, t1 = sphere_intersect(pos, dir, 0.0, EARTH_RADIUS)
+    return hit & (t0 >= 0.0) & (t1 >= 0.0)
+
+def atmosphere_intersection(pos, dir, ignore_earth=False):
+    _, _, t1 = sphere_intersect(pos, dir, 0.0, ATMOSPHERE_RADIUS)
+
+    t = t1
+    if not ignore_earth:
+        hit_earth, s0, s1 = sphere_intersect(pos, dir, 0.0, EARTH_RADIUS)
+        t = np.where(hit_earth & (s0 > 0.0) & (s1 > 0.0), s0, t1)
+
+    return pos + dir * t[..., None]
+
+# -------------------------------- Atmosphere ------------------------------- #
+
+def get_height(params, p):
+    height = np.linalg.norm(p, axis=-1) - ATMO_CAMERA_OFFSET + params["altitude"] - EARTH_RADIUS
+    return np.clip(height, 0.0, ATMOSPHERE_RADIUS - EARTH_RADIUS)
+
+def phase_rayleigh(mu):
+    return 3.0 / (16.0 * math.pi) * (1.0 + mu * mu)
+
+def phase_mie(mu, G):
+    sqr_G = G * G
+    return (3.0 * (1.0 - sqr_G) * (1.0 + mu * mu)) / (8.0 * math.pi * (2.0 + sqr_G) * np.power(1.0 + sqr_G - 2.0 * G * mu, 1.5))
+
+def phase_hg(mu, G):
+    sqr_G = G * G
+    return (1.0 / (4.0 * math.pi)) * ((1.0 - sqr_G) / np.power(1.0 + sqr_G - 2.0 * G * mu, 1.5))
+
+def atmo_density(height):
+    # Unscaled (rayleigh, mie, ozone) density.
+    ozone = np.where((height >= 10000.0) & (height < 25000.0), height / 15000.0 - 2.0 / 3.0,
+            np.where((height >= 25000.0) & (height < 40000.0), -(height / 15000.0 - 8.0 / 3.0), 0.0))
+
+    return np.stack((
+        np.exp(-height / RAYLEIGH_SCALE_HEIGHT),
+        np.exp(-height / MIE_SCALE_HEIGHT),
+        ozone), axis=-1)
+
+def _density_scale(params):
+    return np.array((params["rayleigh_density"], params["mie_density"], params["ozone_density"]))
+
+def ray_optical_depth(params, pos, dir, ignore_earth=False):
+    ray_end = atmosphere_intersection(pos, dir, ignore_earth)
+    ray_length = np.linalg.norm(ray_end - pos, axis=-1)
+
+    segment = ray_length[..., None] * dir
+
+    samples = pos[..., None, :] + QUADRATURE_NODES[:, None] * segment[..., None, :]
+    density = atmo_density(get_height(params, samples))
+
+    return np.einsum('...ij,i->...j', density, QUADRATURE_WEIGHTS) * ray_length[..., None]
+
+def atmo_raymarch(params, pos, dir, light_dir, ray_end=None):
+    # Single in-scattering along the view rays, integrated over the spectrum.
+    if ray_end is None:
+        ray_end = atmosphere_intersection(pos, dir)
+
+    n = len(dir)
+    light_dirs = np.broadcast_to(light_dir, (n, 3))
+
+    segment_length = np.linalg.norm(ray_end - pos, axis=-1) / ATMO_STEPS
+
+    mu = _dot(dir, light_dirs)
+    rayleigh_scatter = phase_rayleigh(mu)[:, None] * RAYLEIGH_COEFF
+    mie_scatter = phase_mie(mu, MIE_G)[:, None] * MIE_COEFF
+
+    density_scale = _density_scale(params)
+
+    optical_depth = np.zeros((n, 3))
+    spectrum = np.zeros((n, len(IRRADIANCE)))
+
+    march_dst = np.zeros(n)
+    for _ in range(ATMO_STEPS):
+        p = pos + march_dst[:, None] * dir
+
+        density = density_scale * atmo_density(get_height(params, p))
+        optical_depth += segment_length[:, None] * density
+
+        lit = ~surface_intersection(p, light_dirs)
+        if np.any(lit):
+            light_optical_depth = density_scale * ray_optical_depth(params, p[lit], light_dirs[lit])
+            t = optical_depth[lit] + light_optical_depth
+
+            attenuation = np.exp(-(t[:, 0:1] * RAYLEIGH_COEFF + t[:, 1:2] * MIE_COEFF + t[:, 2:3] * OZONE_COEFF))
+            scattering = density[lit, 0:1] * rayleigh_scatter[lit] + density[lit, 1:2] * mie_scatter[lit]
+
+            spectrum[lit] += attenuation * scattering * IRRADIANCE * segment_length[lit, None]
+
+        march_dst += segment_length
+
+    return spectrum @ SPEC_TO_RGB.T
+
+def sun_radiation(params, pos, dir, solid_angle, ignore_earth=False):
+    optical_depth = ray_optical_depth(params, pos, dir, ignore_earth)
+
+    transmittance = (RAYLEIGH_COEFF * optical_depth[:, 0:1] * params["rayleigh_density"] +
+                     1.11 * MIE_COEFF * optical_depth[:, 1:2] * params["mie_density"])
+    L = (np.exp(-transmittance) * IRRADIANCE / max(MIN_DENOM, solid_angle)) @ SPEC_TO_RGB.T
+
+    if not ignore_earth:
+        L[surface_intersection(pos, dir)] = 0.0
+    return L
+
+# ---------------------------- Celestial Objects ---------------------------- #
+
+def _moon_radius(params, scale):
+    moon_solid_angle = 2.0 * math.pi * (1.0 - math.cos(params["moon_half_angular"] * scale))
+    return moon_solid_angle, math.sqrt(moon_solid_angle * MOON_DIST * MOON_DIST / math.pi)
+
+def hit_moon(params, dir):
+    _, moon_radius = _moon_radius(params, 1.05)
+    hit, _, _ = sphere_intersect(np.zeros(3), dir, params["moon_dir"] * MOON_DIST, moon_radius)
+    return hit
+
+def _tangent(n):
+    l = np.sqrt(n[:, 0] * n[:, 0] + n[:, 2] * n[:, 2])
+    l = np.where(l > 0.0, l, 1.0)
+    flat = (n[:, 2] == 0.0)[:, None]
+    return np.where(flat, np.array((0.0, 0.0, -1.0)), np.stack((n[:, 2] / l, np.zeros(len(n)), -n[:, 0] / l), axis=-1))
+
+def draw_moon(params, textures, dir):
+    n = len(dir)
+    color = np.zeros((n, 3))
+    opacity = np.zeros(n)
+
+    moon_pos = params["moon_dir"] * MOON_DIST
+    moon_solid_angle, moon_radius = _moon_radius(params, 1.0)
+
+    hit, t0, _ = sphere_intersect(np.zeros(3), dir, moon_pos, moon_radius)
+    hit &= ~surface_intersection(np.broadcast_to(CAMERA_POS, (n, 3)), dir)
+    if not np.any(hit):
+        return color, opacity
+
+    d = dir[hit]
+    moon_rot_mat = params["moon_rot_mat"]
+
+    sphere_norm = _normalize(d * t0[hit, None] - moon_pos)
+
+    sp = _normalize(_transform_dir(moon_rot_mat, sphere_norm))
+    uv = sample_spherical_map(sp)
+
+    norm = texture_2d(textures.moon_normal, uv)[:, :3] * 2.0 - 1.0
+
+    T = _normalize(_tangent(sp))
+    B = _normalize(np.cross(sp, T))
+    norm = T * norm[:, 0:1] + B * norm[:, 1:2] + sp * norm[:, 2:3]
+
+    L = sun_radiation(params, np.broadcast_to(CAMERA_POS, d.shape), d, moon_solid_angle)
+    L = np.minimum(L * MOON_LIGHT_SCALE * params["moon_intsty"], MAX_RADIATION)
+
+    phase_dir = _normalize(_transform_dir(moon_rot_mat, params["moon_phase_dir"]))
+    diff = np.maximum(_dot(norm, np.broadcast_to(phase_dir, norm.shape)), 0.0)
+
+    albedo = texture_2d(textures.moon_albedo, uv)[:, :3]
+
+    color[hit] = L * (diff + params["moon_ambient_intsty"])[:, None] * albedo
+    opacity[hit] = 1.0
+    return color, opacity
+
+def draw_sun(params, dir):
+    n = len(dir)
+    sun_half_angular = params["sun_half_angular"]
+
+    min_cos_theta = math.cos(sun_half_angular)
+    cos_theta = _dot(dir, np.broadcast_to(params["sun_dir"], (n, 3)))
+
+    scale_factor = 3000.0 / max(MIN_DENOM, sun_half_angular * 2.0)
+    opacity = np.where(cos_theta >= min_cos_theta, 1.0, np.exp(-(min_cos_theta - cos_theta) * scale_factor))
+    opacity[surface_intersection(np.broadcast_to(CAMERA_POS, (n, 3)), dir)] = 0.0
+
+    color = np.repeat(opacity[:, None], 3, axis=1)
+
+    lit = np.sqrt(3.0) * opacity > 0.00001
+    if np.any(lit):
+        sun_solid_angle = 2.0 * math.pi * (1.0 - math.cos(sun_half_angular))
+        L = sun_radiation(params, np.broadcast_to(CAMERA_POS, (int(lit.sum()), 3)), dir[lit], sun_solid_angle)
+        color[lit] *= np.minimum(L * params["sun_intsty"], MAX_RADIATION)
+
+    return color, opacity
+
+# Same constants as the shader's hash33.
+_UI3 = np.array((1597334673, 3812015801, 2798796415), dtype=np.uint32)
+_UIF = 1.0 / float(0xffffffff)
+
+def hash33(p):
+    q = p.astype(np.int64).astype(np.uint32) * _UI3
+    q = (q[..., 0] ^ q[..., 1] ^ q[..., 2])[..., None] * _UI3
+    return q.astype(np.float64) * _UIF
+
+def worley(uv):
+    id = np.floor(uv)
+    p = uv - id
+
+    v = np.zeros(uv.shape[:-1] + (4,))
+    v[..., 0] = 10000.0
+
+    for x in (-1.0, 0.0, 1.0):
+        for y in (-1.0, 0.0, 1.0):
+            for z in (-1.0, 0.0, 1.0):
+                offset = np.array((x, y, z))
+                h = hash33(id + offset)
+                length = np.linalg.norm(p - (h + offset), axis=-1)
+
+                s = _smoothstep(-1.0, 1.0, (v[..., 0] - length) / 0.3)
+                v[..., 1:] = _mix(v[..., 1:], h, s[..., None])
+                v[..., 0] = np.minimum(v[..., 0], length)
+    return v
+
+def star_color(temp):
+    pt = np.power(temp, -1.5) * 1e5
+    lt = np.log(temp)
+    return np.clip(np.stack((
+        561.0 * pt + 148.0,
+        np.where(temp > 6500.0, 352.0 * pt + 184.0, 100.04 * lt - 623.6),
+        194.18 * lt - 1448.6), axis=-1) / 255.0, 0.0, 1.0)
+
+def draw_stars(params, dir):
+    n = len(dir)
+
+    rd = _normalize(_transform_dir(params["stars_rot_mat"], dir))
+    nw = worley(rd * 150.0)
+
+    L = np.zeros((n, 3))
+
+    # Blue and red stars sample the same cells.
+    for t_range, d_range, r_range, sharpness in (
+            ((8000.0, 10000.0), (1.0, 50.0), (1.0, 50.0), (20.0, 40.0)),
+            ((2000.0, 6000.0), (1.0, 10.0), (1000.0, 1800.0), (20.0, 35.0))):
+        t = _mix(t_range[0], t_range[1], nw[:, 1])
+        d = _mix(d_range[0], d_range[1], nw[:, 2])
+        r = _mix(r_range[0], r_range[1], nw[:, 3])
+
+        I = (t * t * t * t) * (r * r) * RATIO / (d * d)
+        L += np.exp(-nw[:, 0] * _mix(sharpness[0], sharpness[1], nw[:, 1]))[:, None] * star_color(t) * I[:, None]
+
+    opacity = np.exp(-nw[:, 0] * _mix(20.0, 40.0, nw[:, 1]))
+    opacity[dir[:, 2] < 0.0] = 0.0
+
+    hidden = surface_intersection(np.broadcast_to(CAMERA_POS, (n, 3)), dir)
+    L[hidden] = 0.0
+    opacity[hidden] = 0.0
+
+    return L * params["stars_intsty"], opacity
+
+# ---------------------------------- Clouds --------------------------------- #
+
+def curl_noise(textures, pos, octaves):
+    e = 0.15
+    direction = np.full(pos.shape, 0.70710678118)
+    pos = pos.copy()
+
+    for _ in range(octaves):
+        p = texture_2d(textures.noise_2d_2048, pos)[:, 2]
+        dx = (texture_2d(textures.noise_2d_2048, pos + (e, 0.0))[:, 2] - p) / e
+        dy = (texture_2d(textures.noise_2d_2048, pos + (0.0, e))[:, 2] - p) / e
+
+        new_pos = np.stack((-dy, dx), axis=-1) * 0.00625
+        pos += new_pos
+        direction += new_pos
+    return direction
+
+def shell_intersection(pos, dir, center, radius_inner, radius_outer):
+    hit_outer, _, t1 = sphere_intersect(pos, dir, center, radius_outer)
+    hit_inner, _, s1 = sphere_intersect(pos, dir, center, radius_inner)
+
+    return np.where(hit_inner, s1, 0.0), np.where(hit_outer, t1, 0.0)
+
+def cld_sample(cloud, textures, pos):
+    # Returns (hit, ds, dist, h_p) like the shader's out parameters.
+    n = len(pos)
+    hit = np.zeros(n, dtype=bool)
+    ds = np.zeros(n)
+    h_p = np.zeros(n)
+
+    length = np.linalg.norm(pos, axis=-1)
+    radius = cloud["radius"]
+    shell_thickness = cloud["shell_thickness"]
+
+    inner_shell = length - radius
+    outer_shell = length - (radius + shell_thickness)
+    cld_shell = np.maximum(-inner_shell, outer_shell)
+
+    dist = np.zeros(n)
+
+    inside = cld_shell < 0.0
+    if not np.any(inside):
+        return hit, ds, dist, h_p
+
+    p = pos[inside]
+    shell = cld_shell[inside]
+
+    hp = _saturate(np.clip(length[inside] - radius, 0.0, shell_thickness) / shell_thickness)
+
+    # ---------------------------- Sample Noise Textures ---------------------------- #
+
+    pos_offset = cloud["pos_offset"]
+    coverage_offset = cloud["coverage_offset"]
+    coverage_scale = cloud["coverage_scale"]
+
+    curl_scale = 0.75
+    pos_curl = p.copy()
+    pos_curl[:, :2] += curl_noise(textures, (p[:, :2] + pos_offset) * coverage_scale * curl_scale, cloud["curl_octaves"]) * 100000.0
+
+    cns = texture_2d(textures.noise_2d_2048, (pos_curl[:, :2] + pos_offset + coverage_offset) * coverage_scale)
+
+    shape_offset = np.append(pos_offset + coverage_offset + cloud["shape_offset"], 0.0)
+    sns = texture_3d(textures.noise_3d_128, (pos_curl + shape_offset) * cloud["shape_scale"])
+
+    detail_offset = np.append(pos_offset + coverage_offset + cloud["detail_offset"], 0.0)
+    dns = texture_3d(textures.noise_3d_64, (p + detail_offset) * cloud["detail_scale"])
+
+    coverage_area = texture_2d(textures.noise_2d_2048, (pos_curl[:, :2] + pos_offset) * 0.000001)[:, 1] * cloud["coverage_intsty"]
+
+    CN = _mix(cns[:, 0], cns[:, 1], cloud["coverage_shape"])
+    wh = CN * cloud["thickness"]
+
+    # --------------------------- Shape/Density-Height ------------------------------ #
+
+    SR_t = _saturate(1.0 - np.power(hp, (wh - hp) / (wh - wh * cloud["top_roundness"])))
+    SR_b = _saturate(1.0 - np.power(1.0 - hp, 1.0 / max(MIN_DENOM, cloud["btm_roundness"])))
+    SA = SR_t * SR_b
+
+    DA = _saturate(np.power(hp, 1.0 / max(MIN_DENOM, 1.0 - cloud["density_height"])))
+
+    # ------------------------------------------------------------------------------- #
+
+    cld_coverage = _remap(CN * coverage_area * SA * 1.33, 0.0, 1.0, -1.0, 1.0)
+    detailed = np.maximum(-cld_coverage, shell) < 0.0
+
+    shape_intsty = cloud["shape_intsty"]
+    detail_intsty = cloud["detail_intsty"]
+
+    if cloud["layer"] == 0:
+        shape_inverse = cloud["shape_inverse"]
+        detail_inverse = cloud["detail_inverse"]
+        detail_shape = cloud["detail_shape"]
+
+        c = min(max(1.66667 * shape_intsty, 0.0), 1.0)
+        d = min(max(1.66667 * detail_intsty, 0.0), 1.0)
+
+        tst_0 = _mix(1.0, _mix(0.8, 0.7, shape_inverse), c)
+
+        a = _mix(0.9, 0.6, detail_shape)
+        b = _mix(0.7, 0.75, detail_shape)
+        tst_1 = _mix(1.0, _mix(a, b, detail_inverse), d)
+
+        SN = _mix(_mix(1.0 - sns[:, 0], sns[:, 0], shape_inverse), _mix(1.0 - sns[:, 1], sns[:, 1], shape_inverse), cloud["shape_shape"])
+        DN = _mix(_mix(1.0 - dns[:, 0], dns[:, 0], detail_inverse), _mix(1.0 - dns[:, 3], dns[:, 3], detail_inverse), detail_shape)
+    else:
+        h1 = _saturate(hp * 7.0)
+        h2 = _saturate(hp * 4.0)
+
+        tst_0 = _mix(1.0, 0.35, shape_intsty)
+        tst_1 = _mix(1.0, _mix(0.4, 0.12, h2), detail_intsty)
+
+        SN = _mix(1.0 - sns[:, 1], sns[:, 0], h1)
+        DN = _mix(1.0 - dns[:, 3], dns[:, 0], h2)
+
+    cld_shape = SN * -abs(shape_intsty) * tst_1
+    cld_detail = DN * -abs(detail_intsty)
+
+    detailed_coverage = _remap(CN * coverage_area * SA * tst_0 * tst_1, 0.0, 1.0, -1.0, 1.0)
+    detailed_shell = np.clip(cld_detail + cld_shape, -1.0, 1.0) + np.maximum(-detailed_coverage, shell)
+
+    coarse_coverage = _remap(CN * coverage_area * SA, 0.0, 1.0, -1.0, 1.0)
+    coarse_shell = np.maximum(-coarse_coverage, shell)
+
+    shell = np.where(detailed, detailed_shell, coarse_shell)
+
+    in_cloud = shell < 0.0
+
+    hit[inside] = in_cloud
+    ds[inside] = np.where(in_cloud, cloud["density"] * np.minimum(np.abs(shell), 1.0) * DA, 0.0)
+    dist[inside] = shell
+    h_p[inside] = hp
+
+    return hit, ds, dist, h_p
+
+def cloud_density(cloud, textures, pos):
+    hit, ds, dist, h_p = cld_sample(cloud, textures, _transform_point(cloud["transform"], pos))
+    return hit, np.maximum(ds, 0.000000001), dist, h_p
+
+def _cloud_center(params):
+    return params["cld_domain_center"] + np.array((0.0, 0.0, EARTH_RADIUS))
+
+def cloud_optical_depth(params, cloud, textures, pos, dir, noise):
+    _, t_end = shell_intersection(pos, dir, _cloud_center(params), cloud["radius"], cloud["radius"] + cloud["shell_thickness"])
+
+    ray_length = np.minimum(np.linalg.norm(dir * t_end[:, None], axis=-1), 5000.0)
+
+    max_light_steps = cloud["max_light_steps"]
+    segment_length = ray_length / max_light_steps
+    segment = segment_length.copy()
+
+    optical_depth = np.zeros(len(pos))
+
+    march_dst = noise * segment
+    for _ in range(max_light_steps):
+        in_cloud, ds, dist, _ = cloud_density(cloud, textures, pos + dir * march_dst[:, None])
+        optical_depth += np.where(in_cloud, ds * segment, 0.0)
+
+        segment = np.where(in_cloud, segment_length, np.maximum(dist, segment_length))
+        march_dst += segment
+    return optical_depth
+
+def ambient_light_sample(cloud, irra, h_p, dir):
+    remap_hp = _saturate(_remap(h_p, cloud["btm_roundness"], 1.0, 0.0, 1.0))
+
+    top_color = texture_2d(irra, sample_spherical_map2(dir))[:, :3]
+    bottom_uv = np.clip(np.stack((np.full(len(h_p), 0.5), remap_hp), axis=-1), 0.01, 0.1)
+    bottom_color = texture_2d(irra, bottom_uv)[:, :3]
+
+    t = 1.0 - np.power(1.0 - remap_hp, 5.0)
+    return _mix(bottom_color, top_color, t[:, None]) * cloud["ambient_intsty"]
+
+def multi_scatter(cloud, optical_depth, mu):
+    # Multiple scattering approximation: Oz: the great and volumetric
+    # DOI: 10.1145/2504459.2504518
+    a = 1.0
+    b = 1.0
+    c = 1.0
+
+    L = np.zeros((len(mu), 3))
+    for _ in range(8):
+        phase = _mix(phase_hg(mu, -0.1 * c), phase_hg(mu, 0.8 * c), 0.5)
+        L += (b * phase)[:, None] * np.exp(-a * optical_depth[:, None] * cloud["sigma_t"])
+
+        a *= cloud["atten"]
+        b *= cloud["contr"]
+        c *= cloud["eccen"]
+    return L
+
+def direct_light_sample(params, cloud, textures, pos, dir, light_dir, noise):
+    n = len(pos)
+    light_dirs = np.broadcast_to(light_dir, (n, 3))
+
+    L = np.zeros((n, 3))
+
+    L_light = sun_radiation(params, pos, light_dirs, 0.1, ignore_earth=True)
+    lit = np.linalg.norm(L_light, axis=-1) > 1e-3
+    if not np.any(lit):
+        return L
+
+    mu = _dot(light_dirs[lit], dir[lit])
+    phase = _mix(phase_hg(mu, -0.1), phase_hg(mu, 0.8), 0.5)
+
+    optical_depth = cloud_optical_depth(params, cloud, textures, pos[lit], light_dirs[lit], noise[lit])
+    L_scatter = multi_scatter(cloud, optical_depth, mu)
+
+    powder = 2.0 * (1.0 - np.exp(-optical_depth[:, None] * 2.0 * cloud["sigma_t"]))
+
+    L[lit] = _mix(L_scatter, L_scatter * powder, (0.5 + 0.5 * mu)[:, None]) * L_light[lit] * phase[:, None]
+    return L
+
+def cloud_raymarch(params, cloud, textures, irra, pos, dir, noise):
+    # Returns (scattered light, opacity, depth) per ray.
+    n = len(dir)
+
+    scattered_light = np.zeros((n, 3))
+    transmittance = np.ones((n, 3))
+    tt = np.ones(n)
+
+    t_start, t_end = shell_intersection(pos, dir, _cloud_center(params), cloud["radius"], cloud["radius"] + cloud["shell_thickness"])
+
+    start_pos = pos + dir * t_start[:, None]
+    ray_length = np.abs(t_end - t_start)
+
+    hidden = surface_intersection(pos, dir)
+    depth = np.where(hidden, 0.0, t_start)
+
+    segment_length = ray_length / float(cloud["max_steps"])
+    segment = segment_length.copy()
+
+    sun_light = params["enable_sun"] and params["enable_sun_as_light"]
+    moon_light = params["enable_moon"] and params["enable_moon_as_light"]
+
+    march_dst = noise * segment
+    active = ~hidden
+    for _ in range(cloud["max_steps"]):
+        idx = np.nonzero(active)[0]
+        if len(idx) == 0:
+            break
+
+        p = start_pos[idx] + march_dst[idx, None] * dir[idx]
+        in_cloud, ds, dist, h_p = cloud_density(cloud, textures, p)
+
+        lit = idx[in_cloud]
+        if len(lit):
+            p_lit = p[in_cloud]
+            ds_lit = ds[in_cloud]
+            seg = segment[lit, None]
+
+            direct_light = np.zeros((len(lit), 3))
+            if sun_light:
+                direct_light += direct_light_sample(params, cloud, textures, p_lit, dir[lit], params["sun_dir"], noise[lit])
+            if moon_light:
+                direct_light += direct_light_sample(params, cloud, textures, p_lit, dir[lit], params["moon_dir"], noise[lit]) * MOON_LIGHT_SCALE
+            ambient_light = ambient_light_sample(cloud, irra, h_p[in_cloud], dir[lit])
+
+            s_sigma_s = cloud["sigma_s"] * ds_lit[:, None]
+            s_sigma_t = cloud["sigma_t"] * ds_lit[:, None]
+
+            Li = (direct_light + ambient_light) * s_sigma_s
+            extinction = np.exp(-s_sigma_t * seg)
+
+            scattered_light[lit] += transmittance[lit] * (Li - Li * extinction) / s_sigma_t
+            transmittance[lit] *= extinction
+            tt[lit] *= np.exp(-seg[:, 0] * ds_lit)
+
+        opaque = tt[idx] < 0.0001
+        tt[idx[opaque]] = 0.0
+        active[idx[opaque]] = False
+
+        segment[idx] = np.where(in_cloud, segment_length[idx], np.maximum(dist, segment_length[idx]))
+        march_dst[idx] += segment[idx]
+
+    return scattered_light, 1.0 - tt, depth
+
+def compute_cld(params, cloud, textures, irra, pos, dir, noise):
+    color, opacity, depth = cloud_raymarch(params, cloud, textures, irra, pos, dir, noise)
+
+    cld_point = pos + dir * depth[:, None]
+
+    cld_ap = np.zeros(color.shape)
+    if params["enable_atm"] and params["enable_sun"] and params["enable_sun_as_light"]:
+        cld_ap += atmo_raymarch(params, pos, dir, params["sun_dir"], cld_point)
+    if params["enable_atm"] and params["enable_moon"] and params["enable_moon_as_light"]:
+        cld_ap += atmo_raymarch(params, pos, dir, params["moon_dir"], cld_point) * MOON_LIGHT_SCALE
+
+    ap_clouds = np.exp(-depth / cloud["ap_intsty"])
+    color = _clamped_mix(cld_ap * opacity[:, None], color, ap_clouds)
+
+    return np.concatenate((color, opacity[:, None]), axis=-1)
+
+# ---------------------------------- Main ----------------------------------- #
+
+def sample_blue_noise(textures, frag_coord, img_size):
+    uv = frag_coord / img_size
+    return 2.0 * texture_2d(textures.blue_noise, uv * 128.0)[:, 0] - 1.0
+
+def _moon_ssaa(params, textures, uv, img_size, aa_level=8):
+    pixel_size = 1.0 / (0.5 * img_size)
+    filter_step = pixel_size / aa_level
+
+    color = np.zeros((len(uv), 4))
+    for i in range(aa_level + 1):
+        for j in range(aa_level + 1):
+            _uv = uv - pixel_size * 0.5 + filter_step * np.array((i, j))
+            c, a = draw_moon(params, textures, sample_spherical_direction(_uv))
+            color[:, :3] += c
+            color[:, 3] += a
+    return color / float((aa_level + 1) * (aa_level + 1))
+
+def render_pixels(params, textures, irra, frag_coord, img_size):
+    # Shades the pixels at frag_coord (gl_FragCoord.xy, pixel centers) of an
+    # image of img_size. Returns RGBA, shape (n, 4).
+    n = len(frag_coord)
+    uv = frag_coord / img_size
+
+    pos = np.broadcast_to(CAMERA_POS, (n, 3))
+    dir = _normalize(sample_spherical_direction(uv))
+
+    # ------------------------------ Atmosphere ----------------------------- #
+
+    atmo_color = np.zeros((n, 4))
+    if params["enable_atm"] and params["enable_sun"] and params["enable_sun_as_light"]:
+        atmo_color[:, :3] += atmo_raymarch(params, pos, dir, params["sun_dir"])
+        atmo_color[:, 3] += 1.0
+    if params["enable_atm"] and params["enable_moon"] and params["enable_moon_as_light"]:
+        atmo_color[:, :3] += atmo_raymarch(params, pos, dir, params["moon_dir"]) * MOON_LIGHT_SCALE
+        atmo_color[:, 3] += MOON_LIGHT_SCALE
+
+    stars_color = np.zeros((n, 4))
+    if params["enable_stars"]:
+        stars_color[:, :3], stars_color[:, 3] = draw_stars(params, dir)
+
+    sun_color = np.zeros((n, 4))
+    if params["enable_sun"]:
+        sun_color[:, :3], sun_color[:, 3] = draw_sun(params, dir)
+
+    sun_color = _clamped_mix(stars_color, sun_color, sun_color[:, 3])
+
+    moon_color = np.zeros((n, 4))
+    if params["enable_moon"]:
+        moon = hit_moon(params, dir)
+        if np.any(moon):
+            moon_color[moon] = _moon_ssaa(params, textures, uv[moon], img_size)
+
+    moon_sun_color = _clamped_mix(sun_color, moon_color, moon_color[:, 3])
+
+    # -------------------------------- Clouds ------------------------------- #
+
+    if params["enable_cld_0"] or params["enable_cld_1"]:
+        noise = sample_blue_noise(textures, frag_coord, img_size)
+
+        sky_color = atmo_color + moon_sun_color
+        sky_color[:, 3] = np.clip(sky_color[:, 3], 0.0, 1.0)
+
+        for layer, cloud in enumerate(params["clouds"]):
+            if params["enable_cld_"+str(layer)]:
+                cld_color = compute_cld(params, cloud, textures, irra, pos, dir, noise)
+                sky_color = sky_color * (1.0 - cld_color[:, 3:4]) + cld_color
+    else:
+        sky_color = atmo_color + moon_sun_color
+        sky_color[:, 3] = np.clip(sky_color[:, 3], 0.0, 1.0)
+
+    return sky_color
+
+def render_irradiance_map(params, width=128, height=64, sample_delta=0.1):
+    # stratus_sky.frag followed by stratus_irra.frag. The shader convolves with
+    # a step of 0.025 rad, 0.1 is 16x fewer samples for the same result on a
+    # map this smooth.
+    x, y = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+    uv = np.stack((x.ravel() / width, y.ravel() / height), axis=-1)
+
+    dir = sample_spherical_direction(uv)
+    pos = np.broadcast_to(CAMERA_POS, dir.shape)
+
+    sky = np.zeros((len(dir), 4))
+    if params["enable_sun"] and params["enable_sun_as_light"]:
+        sky[:, :3] += atmo_raymarch(params, pos, dir, params["sun_dir"])
+        sky[:, 3] += 1.0
+    if params["enable_moon"] and params["enable_moon_as_light"]:
+        sky[:, :3] += atmo_raymarch(params, pos, dir, params["moon_dir"]) * MOON_LIGHT_SCALE
+        sky[:, 3] += MOON_LIGHT_SCALE
+    sky = sky.reshape(height, width, 4)
+
+    normal = dir
+    up = np.broadcast_to((0.0, 1.0, 0.0), normal.shape)
+    right = _normalize(np.cross(up, normal))
+    up = _normalize(np.cross(normal, right))
+
+    phi = np.arange(0.0, 2.0 * math.pi, sample_delta)
+    theta = np.arange(0.0, 0.5 * math.pi, sample_delta)
+    phi, theta = (a.ravel() for a in np.meshgrid(phi, theta))
+    weight = np.cos(theta) * np.sin(theta)
+
+    irradiance = np.zeros((len(normal), 3))
+    for p, t, w in zip(phi, theta, weight):
+        sample_vec = (math.sin(t) * math.cos(p)) * right + (math.sin(t) * math.sin(p)) * up + math.cos(t) * normal
+        irradiance += texture_2d(sky, sample_spherical_map2(sample_vec))[:, :3] * w
+    irradiance *= math.pi / len(phi)
+
+    irra = np.ones((len(normal), 4))
+    irra[:, :3] = irradiance
+    return irra.reshape(height, width, 4)
+
+def render_env_img(params, textures, width, height, irra=None, rows=None, cols=None, batch_size=8192, out=None):
+    # Renders rows [start, end) and columns [start, end) of a width x height
+    # equirectangular image, float32 of shape (rows, cols, 4). out may be a
+    # view into a larger image, e.g. a tile of a shared canvas.
+    if irra is None:
+        irra = render_irradiance_map(params)
+
+    row_start, row_end = (0, height) if rows is None else rows
+    col_start, col_end = (0, width) if cols is None else cols
+
+    pixels = np.empty((row_end - row_start, col_end - col_start, 4), dtype=np.float32)
+
+    img_size = np.array((float(width), float(height)))
+
+    x, y = np.meshgrid(np.arange(col_start, col_end) + 0.5, np.arange(row_start, row_end) + 0.5)
+    frag_coord = np.stack((x.ravel(), y.ravel()), axis=-1)
+
+    flat = pixels.reshape(-1, 4)
+    with np.errstate(all='ignore'):
+        for i in range(0, len(frag_coord), batch_size):
+            flat[i:i+batch_size] = render_pixels(params, textures, irra, frag_coord[i:i+batch_size], img_size)
+
+    if out is None:
+        return pixels
+
+    out[...] = pixels
+    return out
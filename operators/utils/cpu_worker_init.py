@@ -17,29 +17,28 @@
 #
 # ------------------------------------------------------------------------- #
 
-import bpy
-from .. import globals
+# The CPU bake workers are plain Python processes without bpy, so they can't
+# import the add-on package. This registers this directory as a stand-alone
+# package instead, the bpy-free modules in here (cpu_bake, cpu_renderer,
+# spectral) import fine through it. The pool runs this file with runpy in every
+# worker before anything is unpickled, the parent imports cpu_bake through
+# import_module so its functions are pickled under the same name.
 
-class STRATUS_OT_prop_observer(bpy.types.Operator):
-    bl_idname = "stratus.prop_observer"
-    bl_label  = ""
+import os
+import sys
+import types
+import importlib
 
-    _timer = None
-    _stop = False
-    def invoke(self, context, event):
-            wm = context.window_manager
-            self._timer = wm.event_timer_add(0.016, window=context.window)
+PACKAGE = "_stratus_cpu"
 
-            context.window_manager.modal_handler_add(self)
-            return {'RUNNING_MODAL'}
+def register_package():
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+        sys.modules[PACKAGE] = package
 
-    def modal(self, context, event):
-        if self._stop:
-            globals.EDITING_PROP = False
-            globals.DRAW_ENV_IMG = True
-            return {'FINISHED'}
-        
-        if event.value == 'RELEASE':
-            self._stop = True
+def import_module(name):
+    register_package()
+    return importlib.import_module(PACKAGE+"."+name)
 
-        return {'PASS_THROUGH'}
\ No newline at end of file
+register_package()
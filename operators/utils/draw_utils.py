@@ -21,430 +21,340 @@ import bpy
 import gpu
 import math
 
-from mathutils import Matrix, Vector, Color
-from bl_math import lerp
+from mathutils import Matrix
 
 from ... import globals
-from .general_utils import compute_dir, bgl_uniform_sampler, get_clip_end, look_at, new_offscreen_fbo
-
-def stars_uniforms(shader):
-    prop = bpy.context.scene.stars_props
-
-    shader.uniform_float("stars_intsty", prop.stars_intsty)
-
-    pole_dir = compute_dir(prop.stars_pole_elevation, prop.stars_pole_rotation)
-    rot_mat = Matrix.Rotation(prop.stars_rotation, 4, pole_dir)
-    shader.uniform_float("stars_rot_mat", rot_mat)
-
-def sun_uniforms(shader):
-    prop = bpy.context.scene.sun_props
-
-    shader.uniform_bool("enable_sun_as_light", prop.sun_enable_light)
-
-    shader.uniform_float("sun_half_angular", prop.sun_size / 2.0)
-    shader.uniform_float("sun.dir", compute_dir(prop.sun_elevation, prop.sun_rotation))
-    shader.uniform_float("sun.intsty", prop.sun_intsty)
-
-def moon_uniforms(shader):
-    moon_prop = bpy.context.scene.moon_props
-    sun_prop = bpy.context.scene.sun_props
-
-    moon_dir = compute_dir(moon_prop.moon_elevation, moon_prop.moon_rotation)
-
-    # Rotate Moon so that it always faces the origin 
-    inv_lookat_mat = look_at(moon_dir, Vector((0,0,0)), Vector((0,0,1)))
-    inv_lookat_mat.invert()
-
-    # Flip the x,y values when Moon goes over the zenith i.e theta > 90d
-    if (math.cos(moon_prop.moon_elevation) < 0.0):
-        a = -inv_lookat_mat.row[0]
-        b = -inv_lookat_mat.row[1]
-        c =  inv_lookat_mat.row[2]
-        d =  inv_lookat_mat.row[3]
-
-        inv_lookat_mat = Matrix((a,b,c,d))
-        moon_up = Vector((moon_dir[1],-moon_dir[0],0))
-    else:
-        moon_up = Vector((-moon_dir[1],moon_dir[0],0))
-
-    moon_up.normalize()
-
-    # Offset Moon rotation s.t. it has proper orientation 
-    rot_offset_mat = Matrix((
-        (0.0000, 0.0000, -1.0000, 0.0000),
-        (0.0000, 1.0000,  0.0000, 0.0000),
-        (1.0000, 0.0000,  0.0000, 0.0000),
-        (0.0000, 0.0000,  0.0000, 1.0000)
-    ))
-
-    # Rotate Moon face
-    rot_moon_face_mat = Matrix.Rotation(moon_prop.moon_face_rotation, 4, moon_dir)
-
-    # Combine rotations
-    rot_mat = rot_offset_mat @ inv_lookat_mat @ rot_moon_face_mat
-    shader.uniform_float("moon_rot_mat", rot_mat)  
-
-    if (moon_prop.moon_use_sun_dir):
-        moon_phase_dir = compute_dir(sun_prop.sun_elevation, sun_prop.sun_rotation)
-    else:
-        inv_moon_dir = -moon_dir
-        rot_mat = Matrix.Rotation(moon_prop.moon_phase_rotation, 4, inv_moon_dir)
-
-        moon_up = rot_mat @ moon_up
-        moon_up.normalize()
-
-        rot_mat = Matrix.Rotation(moon_prop.moon_phase, 4, moon_up)
-        moon_phase_dir = rot_mat @ inv_moon_dir
-        moon_phase_dir.normalize()
-
-    shader.uniform_bool("enable_moon_as_light", moon_prop.moon_enable_light)
-    shader.uniform_float("moon_phase_dir", moon_phase_dir)
-    shader.uniform_float("moon_half_angular", moon_prop.moon_size/2.0)
-
-    shader.uniform_float("moon_ambient_intsty", moon_prop.moon_ambient_intsty)
-
-    shader.uniform_float("moon.dir", moon_dir)
-    shader.uniform_float("moon.intsty", moon_prop.moon_intsty)
-
-def atmo_uniforms(shader):
-    prop = bpy.context.scene.atmo_props
-    
+from .general_utils import bgl_uniform_sampler, get_clip_end
+from .fbo_pool import acquire_offscreen, release_offscreen
+from .sky_state import get_sky_state
+from .lut_utils import scatter_uniforms, update_atmo_lut
+from .weather_utils import update_weather_map
+from .shadow_utils import SHADOW_VOLUME_SIZE, ShadowVolume
+from .ubo_utils import get_sky_params_ubo
+from .shader_utils import CLOUD_QUALITY, get_shader, get_batch, set_optional_uniform
+
+def light_uniforms(shader, state):
+    set_optional_uniform(shader, "uniform_bool", "enable_sun_as_light", state.sun_props.sun_enable_light)
+    set_optional_uniform(shader, "uniform_bool", "enable_moon_as_light", state.moon_props.moon_enable_light)
+
+def atmo_uniforms(shader, state):
+    prop = state.atmo_props
+
+    shader.uniform_float("altitude", prop.prop_sky_altitude)
     shader.uniform_float("rayleigh_density", prop.prop_air)
     shader.uniform_float("mie_density", prop.prop_dust)
     shader.uniform_float("ozone_density", prop.prop_ozone)
 
-def cloud_uniforms(shader):
-    prop = bpy.context.scene.cloud_props
-    render_prop = bpy.context.scene.render_props
-
-    d = 60000.0#prop.scale_0#60000.0 # (m) # 10000.0
-    h = 1000.0#prop.scale_1#1000.0 # (m)  # 100.0
-    cld_domain_radius = math.pow((2.0*d),2.0) / (8.0 * h) + h * 0.5
-    cld_domain_center = Vector((0.0, 0.0, h-cld_domain_radius))
-    cld_domain_thickness = 15000.0 # (m)
-
-    cld_0_ap_intsty = 500000.0 * lerp(0.5, 0.04175, prop.cld_0_ap_intsty)
-    cld_1_ap_intsty = 500000.0 * lerp(0.5, 0.04175, prop.cld_1_ap_intsty)
-
-    cld_0_powder_intsty = lerp(3.0, 0.5, prop.cld_0_powder_intsty)
-    cld_1_powder_intsty = lerp(3.0, 0.5, prop.cld_1_powder_intsty)
-
-    shader.uniform_float("cld_domain_center", cld_domain_center)
+def sky_params_uniforms(shader, state, render_context, atmo_lut, weather_map, shadow_volume=None):
+    shader.uniform_block("sky_params", get_sky_params_ubo(state, render_context))
 
-    # ---------------------------------------------------------------------------- #
+    light_uniforms(shader, state)
 
-    scale = lerp(0.1, 7.5, prop.cld_0_size);
-
-    detail_scale = (0.0003 * prop.cld_0_detail_scale)
-    shape_scale = (0.00013 * prop.cld_0_shape_scale) / scale
-    coverage_scale = (0.00001 * prop.cld_0_coverage_scale) / scale
-
-    shell_thickness = 500.0 * scale;
-
-    sigma_a = Vector((0.0, 0.0, 0.0))
-    cld_0_sigma_t = max(Vector(prop.cld_0_sigma_s) + sigma_a, Vector((0.000000001,0.000000001,0.000000001)))
-
-    shader.uniform_int("cloud_0.layer",                 0)
-
-    shader.uniform_float("cloud_0.btm_roundness",       prop.cld_0_bottom_roundness)
-    shader.uniform_float("cloud_0.top_roundness",       prop.cld_0_top_roundness)
-
-    shader.uniform_float("cloud_0.radius",              prop.cld_0_height + cld_domain_radius)
-    shader.uniform_float("cloud_0.density",             prop.cld_0_density)
-    shader.uniform_float("cloud_0.density_height",      prop.cld_0_density_height)
-    shader.uniform_float("cloud_0.thickness",           prop.cld_0_thickness)
-    shader.uniform_float("cloud_0.shell_thickness",     shell_thickness)
-
-    shader.uniform_float("cloud_0.sigma_s",             prop.cld_0_sigma_s)
-    shader.uniform_float("cloud_0.sigma_t",             cld_0_sigma_t)
-
-    shader.uniform_float("cloud_0.ap_intsty",           cld_0_ap_intsty)
-    shader.uniform_float("cloud_0.ambient_intsty",      prop.cld_0_ambient_intsty)
-
-    shader.uniform_float("cloud_0.coverage_shape",      prop.cld_0_coverage_shape)
-    shader.uniform_float("cloud_0.shape_shape",         prop.cld_0_shape_shape)
-    shader.uniform_float("cloud_0.detail_shape",        prop.cld_0_detail_shape)
-
-    shader.uniform_float("cloud_0.shape_inverse",       prop.cld_0_shape_inverse)
-    shader.uniform_float("cloud_0.detail_inverse",      prop.cld_0_detail_inverse)
-
-    shader.uniform_float("cloud_0.atten",               prop.cld_0_atten)
-    shader.uniform_float("cloud_0.contr",               prop.cld_0_contr)
-    shader.uniform_float("cloud_0.eccen",               prop.cld_0_eccen)
-
-    shader.uniform_float("cloud_0.coverage_scale",      coverage_scale)
-    shader.uniform_float("cloud_0.shape_scale",         shape_scale)
-    shader.uniform_float("cloud_0.detail_scale",        detail_scale)
-
-    shader.uniform_int("cloud_0.curl_octaves",          prop.cld_0_curl_octaves)
-
-    shader.uniform_float("cloud_0.coverage_intsty",     prop.cld_0_coverage_intsty)
-    shader.uniform_float("cloud_0.shape_intsty",        0.6 * prop.cld_0_shape_intsty)
-    shader.uniform_float("cloud_0.detail_intsty",       0.6 * prop.cld_0_detail_intsty)
-
-    shader.uniform_float("cloud_0.pos_offset",          prop.cld_0_pos_offset * 100.0)
-    shader.uniform_float("cloud_0.coverage_offset",     prop.cld_0_coverage_offset * 100.0)
-    shader.uniform_float("cloud_0.shape_offset",        prop.cld_0_shape_offset * 100.0)
-    shader.uniform_float("cloud_0.detail_offset",       prop.cld_0_detail_offset * 100.0)
-
-    cld_0_trans = Matrix.Translation(cld_domain_center + Vector((0,0,6360e3)))
-    cld_0_rot = Matrix.Rotation(prop.cld_0_rotation, 4, 'Z')
-
-    cld_0_transform = cld_0_rot @ cld_0_trans
-    cld_0_transform.invert()
-    
-    shader.uniform_float("cloud_0.transform", cld_0_transform)
-    # ---------------------------------------------------------------------------- #
-
-    scale = lerp(0.1, 7.5, prop.cld_1_size);
-
-    detail_scale = (0.0019 * prop.cld_1_detail_scale)
-    shape_scale = (0.0015 * prop.cld_1_shape_scale) / scale
-    coverage_scale = (0.000035 * prop.cld_1_coverage_scale) / scale
-
-    shell_thickness = 1000 * scale;
+    bgl_uniform_sampler(shader,     "noise_tex_3D_64",      globals.NOISE_TEXTURES[0],  dim=3, wrap='REPEAT', filter='LINEAR', slot=0)
+    bgl_uniform_sampler(shader,     "noise_tex_3D_128",     globals.NOISE_TEXTURES[1],  dim=3, wrap='REPEAT', filter='LINEAR', slot=1)
+    bgl_uniform_sampler(shader,     "noise_tex_2D_2048",    globals.NOISE_TEXTURES[2],  dim=2, wrap='REPEAT', filter='LINEAR', slot=2)
+    bgl_uniform_sampler(shader,     "blue_noise",           globals.NOISE_TEXTURES[3],  dim=2, wrap='REPEAT', filter='LINEAR', slot=3)
 
-    sigma_a = Vector((0.0, 0.0, 0.0))
-    cld_1_sigma_t = max(Vector(prop.cld_1_sigma_s) + sigma_a, Vector((0.000000001,0.000000001,0.000000001)))
+    bgl_uniform_sampler(shader,     "moon_albedo_tex",      globals.MOON_TEXTURES[0],   dim=2, wrap='REPEAT', filter='LINEAR', slot=4)
+    bgl_uniform_sampler(shader,     "moon_normal_tex",      globals.MOON_TEXTURES[1],   dim=2, wrap='REPEAT', filter='LINEAR', slot=5)
 
-    shader.uniform_int("cloud_1.layer",                 1)
+    # Without the lookup tables (allocation failed) the atmosphere is left
+    # out, the rest of the sky still draws.
+    if atmo_lut is not None:
+        bgl_uniform_sampler(shader, "optical_depth_lut",        atmo_lut.get_optical_depth_texture(),       dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=7)
+        bgl_uniform_sampler(shader, "sky_view_lut",             atmo_lut.get_sky_view_texture(),            dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=8)
+        bgl_uniform_sampler(shader, "aerial_perspective_lut",   atmo_lut.get_aerial_perspective_texture(),  dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=9)
 
-    shader.uniform_float("cloud_1.btm_roundness",       prop.cld_1_bottom_roundness)
-    shader.uniform_float("cloud_1.top_roundness",       prop.cld_1_top_roundness)
+    # Same for the weather maps and the clouds.
+    if weather_map is not None:
+        bgl_uniform_sampler(shader, "weather_map_0",    weather_map.get_texture(0),     dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=10)
+        bgl_uniform_sampler(shader, "weather_map_1",    weather_map.get_texture(1),     dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=11)
+        bgl_uniform_sampler(shader, "curl_map",         weather_map.get_curl_texture(), dim=2, wrap='REPEAT', filter='LINEAR', slot=15)
 
-    shader.uniform_float("cloud_1.radius",              prop.cld_1_height + cld_domain_radius)
-    shader.uniform_float("cloud_1.density",             prop.cld_1_density)
-    shader.uniform_float("cloud_1.density_height",      prop.cld_1_density_height)
-    shader.uniform_float("cloud_1.thickness",           prop.cld_1_thickness)
-    shader.uniform_float("cloud_1.shell_thickness",     shell_thickness)
+    if shadow_volume is not None:
+        bgl_uniform_sampler(shader, "shadow_volume_0",  shadow_volume.get_texture(0), dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=12)
+        bgl_uniform_sampler(shader, "shadow_volume_1",  shadow_volume.get_texture(1), dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=13)
 
-    shader.uniform_float("cloud_1.sigma_s",             prop.cld_1_sigma_s)
-    shader.uniform_float("cloud_1.sigma_t",             cld_1_sigma_t)
+def update_shadow_volume(state, render_context, atmo_lut, weather_map):
+    # Re-bakes the shadow volume of every shown layer whose clouds, light
+    # steps or light directions changed. None if the volume isn't used.
+    if not state.use_shadow_volume(render_context):
+        return None
 
-    shader.uniform_float("cloud_1.ap_intsty",           cld_1_ap_intsty)
-    shader.uniform_float("cloud_1.ambient_intsty",      prop.cld_1_ambient_intsty)
+    # The volume is baked from the weather maps.
+    if weather_map is None:
+        return None
 
-    shader.uniform_float("cloud_1.coverage_shape",      prop.cld_1_coverage_shape)
+    if globals.SHADOW_VOLUME is None or not globals.SHADOW_VOLUME.is_valid():
+        globals.SHADOW_VOLUME = ShadowVolume()
+        if not globals.SHADOW_VOLUME.is_valid():
+            print("STRATUS: error initializing the cloud shadow volume.")
+            return None
 
-    shader.uniform_float("cloud_1.atten",               prop.cld_1_atten)
-    shader.uniform_float("cloud_1.contr",               prop.cld_1_contr)
-    shader.uniform_float("cloud_1.eccen",               prop.cld_1_eccen)
+    shadow_volume = globals.SHADOW_VOLUME
+    flags = state.enable_flags(render_context)
 
-    shader.uniform_float("cloud_1.coverage_scale",      coverage_scale)
-    shader.uniform_float("cloud_1.shape_scale",         shape_scale)
-    shader.uniform_float("cloud_1.detail_scale",        detail_scale)
+    for layer in range(2):
+        if not flags["enable_cld_"+str(layer)]:
+            continue
 
-    shader.uniform_int("cloud_1.curl_octaves",          prop.cld_1_curl_octaves)
+        key = state.shadow_volume_key(layer, render_context)
+        if not shadow_volume.needs_update(layer, key):
+            continue
 
-    shader.uniform_float("cloud_1.coverage_intsty",     prop.cld_1_coverage_intsty)
-    shader.uniform_float("cloud_1.shape_intsty",        0.6 * prop.cld_1_shape_intsty)
-    shader.uniform_float("cloud_1.detail_intsty",       prop.cld_1_detail_intsty)
+        with shadow_volume.get_offscreen(layer).bind():
+            gpu.state.depth_test_set('NONE')
 
-    shader.uniform_float("cloud_1.pos_offset",          prop.cld_1_pos_offset * 100.0)
-    shader.uniform_float("cloud_1.coverage_offset",     prop.cld_1_coverage_offset * 100.0)
-    shader.uniform_float("cloud_1.shape_offset",        prop.cld_1_shape_offset * 100.0)
-    shader.uniform_float("cloud_1.detail_offset",       prop.cld_1_detail_offset * 100.0)
+            _shader = get_shader("cloud_shadow")
+            _shader.bind()
 
-    cld_1_trans = Matrix.Translation(cld_domain_center + Vector((0,0,6360e3)))
-    cld_1_rot = Matrix.Rotation(prop.cld_1_rotation, 4, 'Z')
+            _shader.uniform_float("img_size", (SHADOW_VOLUME_SIZE[2] * SHADOW_VOLUME_SIZE[0], SHADOW_VOLUME_SIZE[1]))
+            _shader.uniform_int("shadow_layer", layer)
 
-    cld_1_transform = cld_1_rot @ cld_1_trans
-    cld_1_transform.invert()
-    
-    shader.uniform_float("cloud_1.transform", cld_1_transform)
+            sky_params_uniforms(_shader, state, render_context, atmo_lut, weather_map)
 
-    # ---------------------------------------------------------------------------- #
+            get_batch("cloud_shadow").draw(_shader)
 
-    bgl_uniform_sampler(shader,     "noise_tex_3D_64",      globals.NOISE_TEXTURES[0],  dim=3, wrap='REPEAT', filter='LINEAR', slot=0)
-    bgl_uniform_sampler(shader,     "noise_tex_3D_128",     globals.NOISE_TEXTURES[1],  dim=3, wrap='REPEAT', filter='LINEAR', slot=1)
-    bgl_uniform_sampler(shader,     "noise_tex_2D_2048",    globals.NOISE_TEXTURES[2],  dim=2, wrap='REPEAT', filter='LINEAR', slot=2)
-    bgl_uniform_sampler(shader,     "blue_noise",           globals.NOISE_TEXTURES[3],  dim=2, wrap='REPEAT', filter='LINEAR', slot=3)
+        shadow_volume.set_key(layer, key)
 
-    bgl_uniform_sampler(shader,     "moon_albedo_tex",      globals.MOON_TEXTURES[0],   dim=2, wrap='REPEAT', filter='LINEAR', slot=4)
-    bgl_uniform_sampler(shader,     "moon_normal_tex",      globals.MOON_TEXTURES[1],   dim=2, wrap='REPEAT', filter='LINEAR', slot=5)
+    return shadow_volume
 
-def draw_irra_map(fbo_0, fbo_1, render_context):
-    sun_prop = bpy.context.scene.sun_props
-    moon_prop = bpy.context.scene.moon_props
+def draw_irra_map(fbo_0, fbo_1, render_context, state=None):
+    if state is None:
+        state = get_sky_state()
 
     irra_dim = (globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
 
-    if render_context == 'VIEWPORT':
-        enable_moon = moon_prop.moon_show_viewport
-        enable_sun = sun_prop.sun_show_viewport
-    elif render_context == 'RENDER':
-        enable_moon = moon_prop.moon_show_render
-        enable_sun = sun_prop.sun_show_render
+    flags = state.enable_flags(render_context)
+    enable_moon = flags["enable_moon"]
+    enable_sun = flags["enable_sun"]
+
+    # The sky is marched with the same lookup tables as the env image.
+    use_spectral = state.use_spectral(render_context)
+    atmo_lut = update_atmo_lut(state, use_spectral)
 
     with fbo_0.bind():
         gpu.state.depth_test_set('NONE')
 
-        _shader = globals.SHADER["sky"]
+        _shader = get_shader("sky")
 
         _shader.bind()
         _shader.uniform_float("img_size", irra_dim)
 
-        atmo_uniforms(_shader)
+        atmo_uniforms(_shader, state)
+        scatter_uniforms(_shader, state, use_spectral)
+
+        # Without the lookup tables the sky doesn't light the scene.
+        _shader.uniform_bool("enable_atm", atmo_lut is not None)
+        if atmo_lut is not None:
+            bgl_uniform_sampler(_shader, "optical_depth_lut", atmo_lut.get_optical_depth_texture(), dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=0)
 
         _shader.uniform_bool("enable_moon", enable_moon)
         _shader.uniform_bool("enable_sun", enable_sun)
 
-        _shader.uniform_float("sun.dir", compute_dir(sun_prop.sun_elevation, sun_prop.sun_rotation))
-        _shader.uniform_bool("enable_sun_as_light", sun_prop.sun_enable_light)
+        _shader.uniform_float("sun.dir", state.sun_dir())
+        _shader.uniform_float("moon.dir", state.moon_dir())
 
-        _shader.uniform_float("moon.dir", compute_dir(moon_prop.moon_elevation, moon_prop.moon_rotation))
-        _shader.uniform_bool("enable_moon_as_light", moon_prop.moon_enable_light)
+        light_uniforms(_shader, state)
         
-        globals.BATCH["sky"].draw(_shader)
+        get_batch("sky").draw(_shader)
     
     with fbo_1.bind():
         gpu.state.depth_test_set('NONE')
-        _shader = globals.SHADER["sky_irra"]
+        _shader = get_shader("sky_irra")
         _shader.bind()
         _shader.uniform_float("img_size", irra_dim)
         bgl_uniform_sampler(_shader, "env_tex", fbo_0.color_texture, dim=2, wrap='REPEAT', filter='LINEAR', slot=0)
-        globals.BATCH["sky_irra"].draw(_shader)
-
-def draw_env_img(env_img, irra_tex, render_context):
-    cloud_prop = bpy.context.scene.cloud_props
-    atmo_prop = bpy.context.scene.atmo_props
-    sun_prop = bpy.context.scene.sun_props
-    stars_prop = bpy.context.scene.stars_props
-    moon_prop = bpy.context.scene.moon_props
-    render_prop = bpy.context.scene.render_props
-
-    if render_context == 'VIEWPORT':   
-        if (render_prop.enable_separate_steps_viewport):
-            cld_0_max_steps = render_prop.cld_0_max_steps_viewport
-            cld_1_max_steps = render_prop.cld_1_max_steps_viewport
-        else:
-            cld_0_max_steps = render_prop.max_steps_viewport
-            cld_1_max_steps = render_prop.max_steps_viewport
-
-        if (render_prop.enable_separate_light_steps_viewport):
-            cld_0_max_light_steps = render_prop.cld_0_max_light_steps_viewport
-            cld_1_max_light_steps = render_prop.cld_1_max_light_steps_viewport
-        else:
-            cld_0_max_light_steps = render_prop.max_light_steps_viewport
-            cld_1_max_light_steps = render_prop.max_light_steps_viewport
-
-        enable_atm = atmo_prop.atm_show_viewport
-        enable_cld_0 = cloud_prop.cld_0_show_viewport
-        enable_cld_1 = cloud_prop.cld_1_show_viewport
-        enable_moon = moon_prop.moon_show_viewport
-        enable_sun = sun_prop.sun_show_viewport
-        enable_stars = stars_prop.stars_show_viewport
-        enable_bicubic = False
-        
-    elif render_context == 'RENDER':
-        if (render_prop.enable_separate_steps_render):
-            cld_0_max_steps = render_prop.cld_0_max_steps_render
-            cld_1_max_steps = render_prop.cld_1_max_steps_render
-        else:
-            cld_0_max_steps = render_prop.max_steps_render
-            cld_1_max_steps = render_prop.max_steps_render
-
-        if (render_prop.enable_separate_light_steps_render):
-            cld_0_max_light_steps = render_prop.cld_0_max_light_steps_render
-            cld_1_max_light_steps = render_prop.cld_1_max_light_steps_render
-        else:
-            cld_0_max_light_steps = render_prop.max_light_steps_render
-            cld_1_max_light_steps = render_prop.max_light_steps_render
-
-        enable_atm = atmo_prop.atm_show_render
-        enable_cld_0 = cloud_prop.cld_0_show_render
-        enable_cld_1 = cloud_prop.cld_1_show_render
-        enable_moon = moon_prop.moon_show_render
-        enable_sun = sun_prop.sun_show_render
-        enable_stars = stars_prop.stars_show_render
-        enable_bicubic = render_prop.enable_bicubic
+        get_batch("sky_irra").draw(_shader)
+
+def draw_env_img(env_img, irra_tex, render_context, state=None):
+    if state is None:
+        state = get_sky_state()
+
+    atmo_lut = update_atmo_lut(state, state.use_spectral(render_context))
+    weather_map = update_weather_map(state)
+    shadow_volume = update_shadow_volume(state, render_context, atmo_lut, weather_map)
 
     tile_pos = env_img.get_tile_pos()
     tile_size = env_img.get_tile_size()
     img_size = env_img.get_size()
     offscreen = env_img.get_offscreen()
 
+    tile_offset = env_img.get_tile_offset()
+
     with offscreen.bind():
         if env_img.use_tiling():
-            gpu.state.viewport_set(tile_pos[0]*tile_size, tile_pos[1]*tile_size, tile_size, tile_size)
+            gpu.state.viewport_set(tile_pos[0]*tile_size - tile_offset[0], tile_pos[1]*tile_size - tile_offset[1], tile_size, tile_size)
 
         gpu.state.depth_test_set('NONE')
 
-        _shader = globals.SHADER["env_img"]
+        _shader = get_shader("env_img", state.shader_defines(render_context))
 
         _shader.bind()
         
         _shader.uniform_float("img_size", img_size)
+        _shader.uniform_float("tile_offset", tile_offset)
 
-        _shader.uniform_int("cloud_0.max_steps", cld_0_max_steps)
-        _shader.uniform_int("cloud_1.max_steps", cld_1_max_steps)
+        sky_params_uniforms(_shader, state, render_context, atmo_lut, weather_map, shadow_volume)
 
-        _shader.uniform_int("cloud_0.max_light_steps", cld_0_max_light_steps)
-        _shader.uniform_int("cloud_1.max_light_steps", cld_1_max_light_steps)
+        bgl_uniform_sampler(_shader, "irra_tex", irra_tex, dim=2, wrap='REPEAT', filter='LINEAR', slot=6)
 
-        _shader.uniform_float("altitude", atmo_prop.prop_sky_altitude)
+        get_batch("env_img").draw(_shader)
 
-        _shader.uniform_bool("enable_atm", enable_atm)
-        _shader.uniform_bool("enable_cld_0", enable_cld_0)
-        _shader.uniform_bool("enable_cld_1", enable_cld_1)
-        _shader.uniform_bool("enable_moon", enable_moon)
-        _shader.uniform_bool("enable_sun", enable_sun)
-        _shader.uniform_bool("enable_stars", enable_stars)
+        env_img.read_tile()
+
+    env_img.increment_tile()
+
+def draw_env_img_preview(env_img, irra_tex, render_context, state=None):
+    # Draws the env image's next preview pass in one go and shows it, see
+    # PREVIEW_PASSES. The pass's cloud quality is capped at the context's.
+    if state is None:
+        state = get_sky_state()
+
+    width, height, cld_quality = env_img.get_preview()
+
+    quality_order = list(CLOUD_QUALITY)
+    cld_quality = min(cld_quality, state.cld_quality(render_context), key=quality_order.index)
+
+    atmo_lut = update_atmo_lut(state, state.use_spectral(render_context))
+    weather_map = update_weather_map(state)
+    shadow_volume = update_shadow_volume(state, render_context, atmo_lut, weather_map)
+
+    offscreen = acquire_offscreen(width, height)
+    if offscreen is None:
+        print("STRATUS: error initializing the env image preview offscreen.")
+        env_img.disable_previews()
+        return
+
+    read_buff = gpu.types.Buffer('FLOAT', width * height * 4)
+
+    with offscreen.bind():
+        gpu.state.depth_test_set('NONE')
+
+        _shader = get_shader("env_img", state.shader_defines(render_context, cld_quality))
+
+        _shader.bind()
 
-        atmo_uniforms(_shader)
-        cloud_uniforms(_shader)
-        moon_uniforms(_shader)
-        sun_uniforms(_shader)
-        stars_uniforms(_shader)
+        _shader.uniform_float("img_size", (width, height))
+        _shader.uniform_float("tile_offset", (0.0, 0.0))
+
+        sky_params_uniforms(_shader, state, render_context, atmo_lut, weather_map, shadow_volume)
 
         bgl_uniform_sampler(_shader, "irra_tex", irra_tex, dim=2, wrap='REPEAT', filter='LINEAR', slot=6)
 
-        globals.BATCH["env_img"].draw(_shader)
+        get_batch("env_img").draw(_shader)
 
-    env_img.increment_tile()
+        fb = gpu.state.active_framebuffer_get()
+        fb.read_color(0, 0, width, height, 4, 0, 'FLOAT', data=read_buff)
+
+    release_offscreen(offscreen)
+
+    env_img.save_preview(read_buff)
+
+def draw_env_img_tiles(env_img, irra_tex, render_context, scheduler, state=None):
+    # Draws as many tiles as the scheduler's time budget allows, at least one.
+    # The budget is read every redraw, it can be changed mid bake.
+    if state is None:
+        state = get_sky_state()
+
+    scheduler.set_budget(state.render_props.tile_time_budget)
+    scheduler.begin()
+    while True:
+        draw_env_img(env_img, irra_tex, render_context, state)
+        if env_img.completed() or not scheduler.tile_done():
+            break
+
+# Samples per pixel a still viewport accumulates before it stops redrawing.
+TEMPORAL_MAX_SAMPLES = 64
+
+def r2_sequence(n):
+    # Low discrepancy points in [0, 1)^2, for the per redraw jitter.
+    return ((0.5 + 0.7548776662466927 * n) % 1.0, (0.5 + 0.5698402909980532 * n) % 1.0)
+
+def viewport_dir_matrix(region_data):
+    # Projection of view directions: the view matrix without the translation,
+    # the sky is at infinity and only moves when the view turns.
+    return (region_data.window_matrix @ region_data.view_matrix.to_3x3().to_4x4()).freeze()
 
 def update_viewport_offscreen(self, context):
+    # The viewport is rendered at 1/viewport_pixel_size of the screen
+    # resolution and upsampled when it's drawn, see stratus_screen.frag. The
+    # last redraw is kept in a second offscreen for the temporal accumulation.
     scr_width = context.region.width
     scr_height = context.region.height
 
-    if (self._scr_width != scr_width) or (self._scr_height != scr_height):
-        self._scr_width = scr_width
-        self._scr_height = scr_height
+    pixel_size = int(context.scene.render_props.viewport_pixel_size)
+    tex_width = max(1, scr_width // pixel_size)
+    tex_height = max(1, scr_height // pixel_size)
+
+    self._scr_width = scr_width
+    self._scr_height = scr_height
+
+    if (self._tex_width != tex_width) or (self._tex_height != tex_height):
+        self._tex_width = tex_width
+        self._tex_height = tex_height
 
-        if self._offscreen_viewport != None:
-            self._offscreen_viewport.free()
-        self._offscreen_viewport = new_offscreen_fbo(self._scr_width, self._scr_height)
+        release_offscreen(self._offscreen_viewport)
+        release_offscreen(self._offscreen_history)
+        self._offscreen_viewport = acquire_offscreen(self._tex_width, self._tex_height)
+        self._offscreen_history = acquire_offscreen(self._tex_width, self._tex_height)
+        self._history_state = None
 
 def pre_draw_viewport(self, context, irra_tex):
-    cloud_prop = context.scene.cloud_props
-    atmo_prop = context.scene.atmo_props 
-    sun_prop = context.scene.sun_props  
-    stars_prop = context.scene.stars_props  
-    moon_prop = context.scene.moon_props
-    render_prop = context.scene.render_props
+    # Returns True while a still view is still accumulating samples, the
+    # caller keeps redrawing until then.
+    state = get_sky_state(context.scene)
+    render_prop = state.render_props
+    region_data = context.region_data
     
     update_viewport_offscreen(self, context)
 
-    tex_width = int(float(self._scr_width)/float(render_prop.viewport_pixel_size))       
-    tex_height = int(float(self._scr_height)/float(render_prop.viewport_pixel_size))
+    # Once the view and the sky stop changing and the accumulation is done,
+    # post_draw_viewport keeps showing the last result.
+    viewport_key = (state, self._tex_width, self._tex_height, region_data.perspective_matrix.copy())
+    if viewport_key == self._viewport_key and not self._accumulating:
+        return False
 
-    if (render_prop.enable_separate_steps_viewport):
-        cld_0_max_steps = render_prop.cld_0_max_steps_viewport
-        cld_1_max_steps = render_prop.cld_1_max_steps_viewport
-    else:
-        cld_0_max_steps = render_prop.max_steps_viewport
-        cld_1_max_steps = render_prop.max_steps_viewport
+    # ------------------------- Temporal Accumulation ------------------------- #
+
+    dir_mat = viewport_dir_matrix(region_data)
+
+    # Orthographic views have no reprojection, they are drawn once without
+    # jitter like with accumulation off.
+    can_accumulate = render_prop.enable_viewport_accumulation and region_data.is_perspective
 
-    if (render_prop.enable_separate_light_steps_viewport):
-        cld_0_max_light_steps = render_prop.cld_0_max_light_steps_viewport
-        cld_1_max_light_steps = render_prop.cld_1_max_light_steps_viewport
+    history_valid = (can_accumulate
+        and self._history_state == state
+        and self._history_dir_mat is not None)
+
+    if not history_valid or dir_mat != self._history_dir_mat:
+        self._accum_frames = 0
+
+    # Every pixel is rendered when there's nothing to fill in the others.
+    interleave = int(render_prop.viewport_interleave) if history_valid else 1
+    samples = min(1 + math.ceil(self._accum_frames / interleave), TEMPORAL_MAX_SAMPLES)
+
+    if can_accumulate:
+        jitter = r2_sequence(self._frame_index)
+        pixel_jitter = (jitter[0] - 0.5, jitter[1] - 0.5)
+        noise_offset = (jitter[0] * self._tex_width / 128.0, jitter[1] * self._tex_height / 128.0)
     else:
-        cld_0_max_light_steps = render_prop.max_light_steps_viewport
-        cld_1_max_light_steps = render_prop.max_light_steps_viewport
-    
+        pixel_jitter = (0.0, 0.0)
+        noise_offset = (0.0, 0.0)
+
+    # Renders into the history offscreen, reading the last redraw from the
+    # viewport one, then swaps them.
+    history = self._offscreen_viewport
+    self._offscreen_viewport = self._offscreen_history
+    self._offscreen_history = history
+
+    atmo_lut = update_atmo_lut(state, state.use_spectral('VIEWPORT'))
+    weather_map = update_weather_map(state)
+    shadow_volume = update_shadow_volume(state, 'VIEWPORT', atmo_lut, weather_map)
+
     with self._offscreen_viewport.bind():
         gpu.state.depth_test_set('NONE')
-        _shader = globals.SHADER["viewport"]
+        _shader = get_shader("viewport", state.shader_defines('VIEWPORT'))
 
         _shader.bind()
 
@@ -453,37 +363,39 @@ def pre_draw_viewport(self, context, irra_tex):
         inv_vp_mat = proj_mat
         inv_vp_mat = inv_vp_mat.inverted()
         
-        _shader.uniform_float("img_size", (tex_width, tex_height))
+        _shader.uniform_float("img_size", (self._tex_width, self._tex_height))
         
         _shader.uniform_float("inv_vp_mat", inv_vp_mat)
 
-        _shader.uniform_int("cloud_0.max_steps", cld_0_max_steps)
-        _shader.uniform_int("cloud_1.max_steps", cld_1_max_steps)
+        _shader.uniform_bool("history_valid", history_valid)
+        _shader.uniform_float("prev_dir_mat", self._history_dir_mat if history_valid else dir_mat)
+        _shader.uniform_float("history_weight", 1.0 - 1.0 / samples)
+        _shader.uniform_int("interleave", interleave)
+        _shader.uniform_int("frame_index", self._frame_index)
+        _shader.uniform_float("pixel_jitter", pixel_jitter)
+        _shader.uniform_float("noise_offset", noise_offset)
 
-        _shader.uniform_int("cloud_0.max_light_steps", cld_0_max_light_steps)
-        _shader.uniform_int("cloud_1.max_light_steps", cld_1_max_light_steps)
-
-        _shader.uniform_float("altitude", atmo_prop.prop_sky_altitude)
-
-        _shader.uniform_bool("enable_atm", atmo_prop.atm_show_viewport)
-        _shader.uniform_bool("enable_cld_0", cloud_prop.cld_0_show_viewport)
-        _shader.uniform_bool("enable_cld_1", cloud_prop.cld_1_show_viewport)
-        _shader.uniform_bool("enable_moon", moon_prop.moon_show_viewport)
-        _shader.uniform_bool("enable_sun", sun_prop.sun_show_viewport)
-        _shader.uniform_bool("enable_stars", stars_prop.stars_show_viewport)
-        _shader.uniform_bool("enable_pole_visualizer", stars_prop.stars_show_pole)
+        set_optional_uniform(_shader, "uniform_bool", "enable_pole_visualizer", state.stars_props.stars_show_pole)
         
-        _shader.uniform_float("pole_dir", compute_dir(stars_prop.stars_pole_elevation, stars_prop.stars_pole_rotation))
+        set_optional_uniform(_shader, "uniform_float", "pole_dir", state.pole_dir())
 
-        atmo_uniforms(_shader)
-        cloud_uniforms(_shader)
-        moon_uniforms(_shader)
-        sun_uniforms(_shader)
-        stars_uniforms(_shader)
+        sky_params_uniforms(_shader, state, 'VIEWPORT', atmo_lut, weather_map, shadow_volume)
 
         bgl_uniform_sampler(_shader, "irra_tex", irra_tex, dim=2, wrap='REPEAT', filter='LINEAR', slot=6)
+
+        bgl_uniform_sampler(_shader, "history_tex", self._offscreen_history.color_texture, dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=14)
  
-        globals.BATCH["viewport"].draw(_shader)
+        get_batch("viewport").draw(_shader)
+
+    self._history_state = state
+    self._history_dir_mat = dir_mat
+    self._accum_frames += 1
+    self._frame_index += 1
+
+    self._viewport_key = viewport_key
+    self._accumulating = can_accumulate and samples < TEMPORAL_MAX_SAMPLES
+
+    return self._accumulating
 
 def post_draw_viewport(self, context):
     scene = context.scene
@@ -499,23 +411,20 @@ def post_draw_viewport(self, context):
 
     proj_view_mat = bpy.context.region_data.perspective_matrix
 
-    tex_width = int(float(self._scr_width)/float(prop.viewport_pixel_size))       
-    tex_height = int(float(self._scr_height)/float(prop.viewport_pixel_size))
-
     gpu.state.depth_test_set('LESS')
 
-    _shader = globals.SHADER["screen"]
+    _shader = get_shader("screen")
     _shader.bind()
 
     _shader.uniform_float("projection", proj_view_mat @ obj_mat)
 
     _shader.uniform_float("scr_size", (self._scr_width, self._scr_height))
-    _shader.uniform_float("tex_size", (tex_width, tex_height))
+    _shader.uniform_float("tex_size", (self._tex_width, self._tex_height))
     _shader.uniform_float("gamma", scene.view_settings.gamma)
     _shader.uniform_float("env_img_strength", prop.env_img_strength)
 
     bgl_uniform_sampler(_shader, "tex", self._offscreen_viewport.color_texture, dim=2, wrap='REPEAT', filter='NEAREST', slot=0)
 
-    globals.BATCH["screen"].draw(_shader)
+    get_batch("screen").draw(_shader)
 
     gpu.state.depth_test_set('NONE')
@@ -0,0 +1,78 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import bpy
+import time
+
+from ... import globals
+
+class EditScheduler:
+    # Debounces edits to the sky. Every edit cancels the env image being drawn,
+    # it's only drawn again once no edit came in for the delay, so a slider
+    # drag, a script setting many props or a scrubbed timeline end up as one
+    # redraw. Runs on a bpy.app.timers timer that unregisters itself once it
+    # fires.
+
+    def __init__(self):
+        self._last_edit = 0.0
+        self._delay = 0.0
+        # The same bound method has to be passed to register and unregister.
+        self._timer = self._tick
+
+    def notify(self, delay):
+        globals.DRAW_ENV_IMG = False
+        globals.RESET_ENV_IMG = True
+
+        self._last_edit = time.perf_counter()
+        self._delay = max(0.0, delay)
+
+        # Checked on the timers themselves, loading a file drops them.
+        if not self.is_scheduled():
+            bpy.app.timers.register(self._timer, first_interval=self._delay)
+
+    def is_scheduled(self):
+        return bpy.app.timers.is_registered(self._timer)
+
+    def _tick(self):
+        # Returns the seconds until the next check, None unregisters the timer.
+        remaining = self._delay - (time.perf_counter() - self._last_edit)
+        if remaining > 0.0:
+            return remaining
+
+        globals.DRAW_ENV_IMG = True
+        tag_view_3d_redraw()
+        return None
+
+    def cancel(self):
+        if self.is_scheduled():
+            bpy.app.timers.unregister(self._timer)
+
+def tag_view_3d_redraw():
+    # The viewport editor draws the env image, it has to be woken up since
+    # there might not be an event to redraw on.
+    for wm in bpy.data.window_managers:
+        for win in wm.windows:
+            for area in win.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+
+def get_edit_scheduler():
+    if globals.EDIT_SCHEDULER is None:
+        globals.EDIT_SCHEDULER = EditScheduler()
+    return globals.EDIT_SCHEDULER
@@ -17,16 +17,31 @@
 #
 # ------------------------------------------------------------------------- #
 
+import os
 import bpy
+import gpu
+import time
+import tempfile
+import numpy as np
 
 from ... import globals
-from .general_utils import new_offscreen_fbo
+from .fbo_pool import acquire_offscreen, release_offscreen
+from .writer_utils import can_write_directly, write_image
+
+# Passes drawn before the full image when previews are enabled, as (fraction
+# of the full resolution, cloud quality). Each is drawn in one go and shown
+# right away, so a change is visible long before the last tile is done.
+PREVIEW_PASSES = (
+    (8, 'LOW'),
+    (4, 'LOW'),
+    (2, 'MEDIUM'),
+)
 
 class ENVImage:
     _width = 1024
     _height = 512
 
-    _max_img_size = 24
+    _max_img_size = 64
 
     _grid_width = 0
     _grid_height = 0
@@ -37,10 +52,27 @@ class ENVImage:
 
     _tiling_enabled = True
 
+    # Images at or above GL_MAX_TEXTURE_SIZE (globals.is_out_of_core) are
+    # baked out-of-core: the offscreen only holds one tile, which is drawn
+    # with its offset in the image and then read back into a canvas on disk.
+    _out_of_core = False
+
     _offscreen = None
     _name = None
 
-    _img_buff = []
+    # The image is read back tile by tile as the tiles are drawn, into this
+    # (height, width, 4) array. Untiled images are read back in bands of
+    # _band_rows rows, so there is never a second full copy of the image.
+    _pixels = None
+    _use_disk_canvas = False
+    _canvas_file = None
+    _read_buff = None
+    _read_shape = None
+
+    _band_rows = 256
+
+    _previews_enabled = False
+    _preview_id = 0
 
     def __init__(self, name):
         self._name = name
@@ -51,14 +83,56 @@ class ENVImage:
                 self._height, 
                 alpha=True, 
                 float_buffer=True)
-        self._offscreen = new_offscreen_fbo(self._width, self._height)
         self.set_tile_size(512)
 
-        self._max_img_size = int(float(globals.MAX_TEXTURE_SIZE) / 1024.0) 
-
     def __del__(self):
-        self._offscreen.free()
-    
+        self._release_offscreen()
+        self._free_canvas()
+
+    def _release_offscreen(self):
+        release_offscreen(self._offscreen)
+        self._offscreen = None
+
+    def _get_canvas(self):
+        if self._pixels is None:
+            self._init_canvas()
+        return self._pixels
+
+    def _init_canvas(self):
+        shape = (self._height, self._width, 4)
+        if self._use_disk_canvas or self._out_of_core:
+            # A new file per canvas, a detached one may still be being written.
+            fd, self._canvas_file = tempfile.mkstemp(prefix=self._name+"_", suffix=".canvas", dir=bpy.app.tempdir or None)
+            os.close(fd)
+            self._pixels = np.memmap(self._canvas_file, dtype=np.float32, mode='w+', shape=shape)
+        else:
+            self._pixels = np.zeros(shape, dtype=np.float32)
+
+    def _free_canvas(self):
+        self._pixels = None
+        self._read_buff = None
+        self._read_shape = None
+        if self._canvas_file is not None and os.path.exists(self._canvas_file):
+            try:
+                os.remove(self._canvas_file)
+            except OSError:
+                pass
+        self._canvas_file = None
+
+    def _detach_canvas(self):
+        # Gives up the disk canvas, the caller deletes its file.
+        pixels, canvas_file = self._pixels, self._canvas_file
+        self._pixels = None
+        self._canvas_file = None
+        return pixels, canvas_file
+
+    def use_disk_canvas(self, enable):
+        # Keeps the image in a memory mapped temporary file instead of RAM.
+        # Out-of-core images always are.
+        if enable != self._use_disk_canvas:
+            self._use_disk_canvas = enable
+            self._free_canvas()
+
     def _init_tile_props(self):
         self._grid_width = int(self._width / self._tile_size)
         self._grid_height = int(self._height / self._tile_size) 
@@ -66,17 +140,14 @@ class ENVImage:
 
     def set_size(self, size):
         assert type(size) == int or float, "size should be a number, i.e. int or float."
-        assert (size >= 0.25 and size <= 24.0), "size should be between the values 0.25 and 24.0"
-        
-        if (size >= self._max_img_size): 
-            size = self._max_img_size
+        assert (size >= 0.25 and size <= self._max_img_size), "size should be between the values 0.25 and "+str(self._max_img_size)
+
+        self._width, self._height = globals.env_img_dim(size)
 
-        self._width = int(1024.0 * float(size))
-        self._height = int(512.0 * float(size))
+        self._out_of_core = globals.is_out_of_core(self._width, self._height)
 
-        if self._offscreen is not None:
-            self._offscreen.free()
-        self._offscreen = new_offscreen_fbo(self._width, self._height)
+        self._release_offscreen()
+        self._free_canvas()
 
         self._init_tile_props()
 
@@ -89,11 +160,46 @@ class ENVImage:
     def disable_tiling(self):
         self._tiling_enabled = False
 
+    def enable_previews(self):
+        self._previews_enabled = True
+
+    def disable_previews(self):
+        self._previews_enabled = False
+
+    def _get_preview_passes(self):
+        # Passes too large for one offscreen are left out.
+        return [(self._width // div, self._height // div, quality) for div, quality in PREVIEW_PASSES
+            if self._height // div > 0 and not globals.is_out_of_core(self._width // div, self._height // div)]
+
+    def in_preview(self):
+        return self._previews_enabled and self._preview_id < len(self._get_preview_passes())
+
+    def get_preview(self):
+        # (width, height, cloud quality) of the next preview pass.
+        return self._get_preview_passes()[self._preview_id]
+
+    def save_preview(self, pixels):
+        # Shows the preview pass that was just drawn until the next one, or the
+        # full image, replaces it. pixels is flat RGBA, bottom row first.
+        width, height, _ = self.get_preview()
+
+        bpy.data.images[self._name].scale(width, height)
+        bpy.data.images[self._name].pixels.foreach_set(np.asarray(pixels, dtype=np.float32).reshape(-1))
+
+        self._preview_id += 1
+
+    def is_out_of_core(self):
+        return self._out_of_core
+
     def use_tiling(self):
+        if self._out_of_core:
+            return True
         valid_tile_size = (self._tile_size <= self._width and self._tile_size <= self._height)
         return valid_tile_size and self._tiling_enabled
 
     def set_tile_size(self, tile_size):
+        if self._out_of_core and tile_size != self._tile_size:
+            self._release_offscreen()
         self._tile_size = tile_size
         self._init_tile_props()
 
@@ -108,9 +214,50 @@ class ENVImage:
         else:
             return (0,0)
 
+    def get_tile_offset(self):
+        # Position of the offscreen's origin in the image, in pixels.
+        if self._out_of_core:
+            tile_x, tile_y = self.get_tile_pos()
+            return (tile_x*self._tile_size, tile_y*self._tile_size)
+        else:
+            return (0, 0)
+
     def get_offscreen(self):
+        # Taken from the pool on first use, not when the image is sized.
+        if self._offscreen is None:
+            if self._out_of_core:
+                self._offscreen = acquire_offscreen(self._tile_size, self._tile_size)
+            else:
+                self._offscreen = acquire_offscreen(self._width, self._height)
         return self._offscreen
 
+    def read_tile(self):
+        # Copies the tile that was just drawn from the bound offscreen into the
+        # image. Has to be called before increment_tile.
+        if self.use_tiling():
+            tile_x, tile_y = self.get_tile_pos()
+            self._read_rect(tile_x*self._tile_size, tile_y*self._tile_size, self._tile_size, self._tile_size)
+        else:
+            for y in range(0, self._height, self._band_rows):
+                self._read_rect(0, y, self._width, min(self._band_rows, self._height - y))
+
+    def _read_rect(self, x, y, width, height):
+        if self._read_shape != (height, width, 4):
+            self._read_shape = (height, width, 4)
+            self._read_buff = gpu.types.Buffer('FLOAT', self._read_shape)
+
+        offset_x, offset_y = self.get_tile_offset()
+
+        fb = gpu.state.active_framebuffer_get()
+        fb.read_color(x - offset_x, y - offset_y, width, height, 4, 0, 'FLOAT', data=self._read_buff)
+
+        self._get_canvas()[y:y+height, x:x+width] = np.asarray(self._read_buff)
+
+    def get_pixels(self):
+        # Flat RGBA view of the image, bottom row first. It's overwritten as
+        # the next image is drawn.
+        return self._get_canvas().reshape(-1)
+
     def increment_tile(self):
         if not self.completed():
             self._tile_id += 1
@@ -123,41 +270,87 @@ class ENVImage:
     
     def reset(self):
         self._tile_id = 0
+        self._preview_id = 0
+
+    def can_save_to_disk(self, file_format, exr_codec):
+        # Out-of-core images only go through writer_utils, straight from the
+        # disk canvas. Blender's image writer would need a copy of the whole
+        # image in a bpy.data.images image.
+        return not self._out_of_core or can_write_directly(file_format, exr_codec)
 
     def save(self):
-        self._img_buff = self._offscreen.texture_color.read()
-        self._img_buff.dimensions = self._width * self._height * 4
+        # Into the Blender image the world uses, not possible out-of-core.
+        if self._out_of_core:
+            raise RuntimeError("STRATUS: out-of-core images can't be loaded into Blender, write them to disk instead.")
 
         bpy.data.images[self._name].scale(self._width, self._height)
-        bpy.data.images[self._name].pixels.foreach_set(self._img_buff)
+        bpy.data.images[self._name].pixels.foreach_set(self.get_pixels())
     
-    def save_to_disk(self, context, filename):
+    def save_to_disk(self, context, filename, writer=None):
+        # With an AsyncImageWriter the frame is queued on it and None is
+        # returned, otherwise it's written right away and the time it took is
+        # returned.
         prop = context.scene.render_props
 
-        scene = bpy.data.scenes.new("STRATUS_TMP_SCENE")
-        
-        settings = scene.render.image_settings
+        extension = '.exr' if (prop.file_format in {'OPEN_EXR', 'OPEN_EXR_MULTILAYER'}) else '.hdr'
+        filepath = prop.file_path+filename+extension
 
-        settings.color_management = 'FOLLOW_SCENE'
-        settings.file_format = prop.file_format
-        settings.color_mode = prop.color_mode
-        settings.exr_codec = prop.exr_codec
+        if writer is not None and can_write_directly(prop.file_format, prop.exr_codec):
+            # The image is overwritten by the next frame while this one is
+            # still waiting to be written. A disk canvas is handed over to the
+            # writer as is and the next frame gets a new one, anything else is
+            # copied.
+            if self._canvas_file is not None:
+                pixels, canvas_file = self._detach_canvas()
+                writer.submit(filepath, pixels, self._width, self._height, prop.file_format, prop.color_mode, prop.exr_codec, prop.color_depth, remove_file=canvas_file)
+            else:
+                writer.submit(filepath, self.get_pixels().copy(), self._width, self._height, prop.file_format, prop.color_mode, prop.exr_codec, prop.color_depth)
+            return None
 
-        self._img_buff = self._offscreen.texture_color.read()
-        self._img_buff.dimensions = self._width * self._height * 4
+        return self.write_to_file(filepath, prop.file_format, prop.color_mode, prop.exr_codec, prop.color_depth)
 
-        extension = '.exr' if (prop.file_format in {'OPEN_EXR', 'OPEN_EXR_MULTILAYER'}) else '.hdr'
-        
-        bpy.data.images[self._name].filepath = prop.file_path+filename+extension
-        bpy.data.images[self._name].file_format = prop.file_format
+    def write_to_file(self, filepath, file_format, color_mode, exr_codec, color_depth='32'):
+        if not self.can_save_to_disk(file_format, exr_codec):
+            raise RuntimeError("STRATUS: out-of-core images can only be written as OpenEXR (None, ZIPS or ZIP codec) or Radiance HDR.")
+        return write_pixels_to_file(self._name, self.get_pixels(), self._width, self._height, filepath, file_format, color_mode, exr_codec, color_depth)
 
-        bpy.data.images[self._name].scale(self._width, self._height)
-        bpy.data.images[self._name].pixels.foreach_set(self._img_buff)
+def write_pixels_to_file(img_name, pixels, width, height, filepath, file_format, color_mode, exr_codec, color_depth='32'):
+    # pixels is a flat RGBA float buffer, bottom row first. Returns the time
+    # the write took, in seconds.
+    start_time = time.perf_counter()
+
+    if can_write_directly(file_format, exr_codec):
+        write_image(filepath, pixels, width, height, file_format, color_mode, exr_codec, color_depth)
+    else:
+        _save_render(img_name, pixels, width, height, filepath, file_format, color_mode, exr_codec, color_depth)
+
+    seconds = time.perf_counter() - start_time
+    print(filepath+" ("+'{:.2f}'.format(seconds)+"s)")
+
+    return seconds
+
+def _save_render(img_name, pixels, width, height, filepath, file_format, color_mode, exr_codec, color_depth):
+    # Multilayer EXRs and the codecs writer_utils doesn't do still go through
+    # Blender's image writer.
+    scene = bpy.data.scenes.new("STRATUS_TMP_SCENE")
+
+    settings = scene.render.image_settings
+
+    settings.color_management = 'FOLLOW_SCENE'
+    settings.file_format = file_format
+    settings.color_mode = color_mode
+    settings.exr_codec = exr_codec
+    settings.color_depth = color_depth
+
+    if img_name not in bpy.data.images:
+        bpy.data.images.new(img_name, width, height, alpha=True, float_buffer=True)
 
-        bpy.data.images[self._name].save_render(prop.file_path+filename+extension, scene=scene)
+    bpy.data.images[img_name].filepath = filepath
+    bpy.data.images[img_name].file_format = file_format
 
-        print(prop.file_path+filename+extension)
+    bpy.data.images[img_name].scale(width, height)
+    bpy.data.images[img_name].pixels.foreach_set(pixels)
 
-        bpy.data.scenes.remove(scene)
-        
+    bpy.data.images[img_name].save_render(filepath, scene=scene)
 
+    bpy.data.scenes.remove(scene)
@@ -0,0 +1,106 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+from collections import OrderedDict
+
+from ... import globals
+from .general_utils import new_offscreen_fbo
+
+# VRAM the idle offscreens may take up, in bytes. Offscreens in use don't
+# count towards it.
+FBO_POOL_BUDGET = 512 * 1024 * 1024
+
+BYTES_PER_PIXEL = {
+    'RGBA8': 4,
+    'RGBA16F': 8,
+    'RGBA32F': 16,
+}
+
+def _fbo_bytes(key):
+    width, height, format = key
+    return width * height * BYTES_PER_PIXEL.get(format, 16)
+
+class FBOPool:
+    # Offscreens released by one operator are handed to the next one that asks
+    # for the same (width, height, format), instead of being freed and
+    # allocated again. Idle offscreens past the budget are freed, least
+    # recently released first.
+
+    def __init__(self, budget=FBO_POOL_BUDGET):
+        self._budget = budget
+        self._idle = OrderedDict()
+        self._idle_bytes = 0
+        self._in_use = {}
+
+    def acquire(self, width, height, format='RGBA32F'):
+        key = (width, height, format)
+
+        for fbo_id, (idle_key, fbo) in reversed(self._idle.items()):
+            if idle_key == key:
+                del self._idle[fbo_id]
+                self._idle_bytes -= _fbo_bytes(key)
+                self._in_use[fbo_id] = key
+                return fbo
+
+        fbo = new_offscreen_fbo(width, height, format)
+        if fbo is None and self._idle:
+            # Possibly out of VRAM, try again without the idle ones.
+            self.clear()
+            fbo = new_offscreen_fbo(width, height, format)
+
+        if fbo is not None:
+            self._in_use[id(fbo)] = key
+        return fbo
+
+    def release(self, fbo):
+        if fbo is None:
+            return
+
+        key = self._in_use.pop(id(fbo), None)
+        if key is None:
+            fbo.free()
+            return
+
+        self._idle[id(fbo)] = (key, fbo)
+        self._idle_bytes += _fbo_bytes(key)
+
+        while self._idle_bytes > self._budget:
+            _, (idle_key, idle_fbo) = self._idle.popitem(last=False)
+            self._idle_bytes -= _fbo_bytes(idle_key)
+            idle_fbo.free()
+
+    def get_idle_bytes(self):
+        return self._idle_bytes
+
+    def clear(self):
+        for key, fbo in self._idle.values():
+            fbo.free()
+        self._idle.clear()
+        self._idle_bytes = 0
+
+def get_fbo_pool():
+    if globals.FBO_POOL is None:
+        globals.FBO_POOL = FBOPool()
+    return globals.FBO_POOL
+
+def acquire_offscreen(width, height, format='RGBA32F'):
+    return get_fbo_pool().acquire(width, height, format)
+
+def release_offscreen(fbo):
+    get_fbo_pool().release(fbo)
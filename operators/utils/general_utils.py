@@ -22,6 +22,7 @@ import bgl
 import gpu
 import math
 import addon_utils
+import numpy as np
 
 from ... import globals
 
@@ -106,28 +107,30 @@ def new_env_img_image(img_name, width, height):
     bpy.data.images[img_name].scale(width, height)
     return bpy.data.images[img_name]
 
-def new_gpu_buffer(image):
+def new_pixel_array(image):
     width = image.size[0]
     height = image.size[1]
     channels = image.channels
-    return gpu.types.Buffer('FLOAT', (width * height * channels), list(image.pixels[:]))
+
+    # foreach_get copies straight into the preallocated array, no boxed floats.
+    pixels = np.empty(width * height * channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels
 
 def new_bgl_buffer(image):
-    width = image.size[0]
-    height = image.size[1]
-    channels = image.channels
-    return bgl.Buffer(bgl.GL_FLOAT, (width * height * channels), list(image.pixels[:]))
+    # bgl.Buffer wraps the array through the buffer protocol instead of copying it.
+    pixels = new_pixel_array(image)
+    return bgl.Buffer(bgl.GL_FLOAT, pixels.size, pixels)
 
-def new_offscreen_fbo(width, height):
+def new_offscreen_fbo(width, height, format='RGBA32F'):
     _offscreen_fbo = None
     try:
-        _offscreen_fbo = gpu.types.GPUOffScreen(width, height, format='RGBA32F')
+        _offscreen_fbo = gpu.types.GPUOffScreen(width, height, format=format)
     except Exception as e:
         print(e)
     return _offscreen_fbo
 
-def bgl_texture_from_image(image, dim, bindcode):
-    buffer = new_bgl_buffer(image)
+def bgl_texture_from_buffer(buffer, dim, bindcode, data_type):
     if len(dim) == 2:
         bgl.glBindTexture(bgl.GL_TEXTURE_2D, bindcode)
 
@@ -140,7 +143,7 @@ def bgl_texture_from_image(image, dim, bindcode):
         #bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_BASE_LEVEL, 16)
         #bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MAX_LEVEL, 1000)
             
-        bgl.glTexImage2D(bgl.GL_TEXTURE_2D, 0, bgl.GL_RGBA8, dim[0], dim[1], 0, bgl.GL_RGBA, bgl.GL_FLOAT, buffer)
+        bgl.glTexImage2D(bgl.GL_TEXTURE_2D, 0, bgl.GL_RGBA8, dim[0], dim[1], 0, bgl.GL_RGBA, data_type, buffer)
 
         '''
         i = 0
@@ -165,7 +168,7 @@ def bgl_texture_from_image(image, dim, bindcode):
 
         bgl.glTexParameteri(bgl.GL_TEXTURE_3D, bgl.GL_TEXTURE_BASE_LEVEL, 0)
     
-        bgl.glTexImage3D(bgl.GL_TEXTURE_3D, 0, bgl.GL_RGBA8, dim[0], dim[1], dim[2], 0, bgl.GL_RGBA, bgl.GL_FLOAT, buffer)
+        bgl.glTexImage3D(bgl.GL_TEXTURE_3D, 0, bgl.GL_RGBA8, dim[0], dim[1], dim[2], 0, bgl.GL_RGBA, data_type, buffer)
         #bgl.glTexImage3D(bgl.GL_TEXTURE_3D, 16, bgl.GL_RGBA8, dim[0], dim[1], dim[2], 0, bgl.GL_RGBA, bgl.GL_FLOAT, buffer)
         '''
         _i = 0
@@ -191,8 +194,6 @@ def bgl_texture_from_image(image, dim, bindcode):
 
         bgl.glBindTexture(bgl.GL_TEXTURE_3D, 0)
 
-    bpy.data.images.remove(image)
-
 def bgl_uniform_sampler(shader, name, texture, dim, wrap, filter, slot):
     # ---------------------------------- Target ---------------------------------- #
     if dim == 1:
@@ -19,10 +19,14 @@
 
 import bpy
 import bgl
+import time
+import tracemalloc
 
 from ... import globals
-from .shader_utils import new_shader
-from .general_utils import bgl_texture_from_image, get_dir
+from .shader_utils import load_shader_sources
+from .cache_utils import load_cached_texture, store_cached_texture
+from .cpu_renderer import CPUTextures
+from .general_utils import bgl_texture_from_buffer, new_pixel_array, get_dir
 
 def init_world_node_tree(self):
 
@@ -68,68 +72,50 @@ def init_world_node_tree(self):
         globals.INITIALIZED_NODE_TREE = True
 
 def init_shaders(self):
+    # Only reads the sources, the programs are compiled on first use, see
+    # shader_utils.get_shader.
     if globals.INITIALIZED_SHADERS is False:
-        self.report({'INFO'}, "STRATUS: building shaders.")
-        dir = get_dir()
+        load_shader_sources()
+        globals.INITIALIZED_SHADERS = True
 
-        plane_coords = (
-            (-1, +1, 0),
-            (+1, +1, 0),
-            (-1, -1, 0),
-            (+1, -1, 0))        
-        plane_indices = ((0,1,2), (1,3,2))
-
-        cube_coords = (
-            (-1, -1, -1), (+1, -1, -1),
-            (-1, +1, -1), (+1, +1, -1),
-            (-1, -1, +1), (+1, -1, +1),
-            (-1, +1, +1), (+1, +1, +1))
-        cube_indices = (
-            (0, 1, 3), (0, 2, 3), (4,5,7), (4,6,7),
-            (0,4,5), (0,1,5), (2,0,4), (2,6,4),
-            (1,3,7), (1, 5,7), (3, 2, 6), (3, 6, 7))
-
-        # -------------------------------- HRDI Shader ------------------------------- #
-
-        with open(dir+"/shaders/vertex_shaders/stratus_env_img.vert", 'r') as file:
-            vertex_shader = file.read()
-        with open(dir+"/shaders/fragment_shaders/stratus_env_img.frag", 'r') as file:
-            fragment_shader = file.read()
-        new_shader("env_img", vertex_shader, fragment_shader, plane_coords, plane_indices)
-
-        # -------------------------------- Sky Shader -------------------------------- #
-
-        with open(dir+"/shaders/vertex_shaders/stratus_sky.vert", 'r') as file:
-            vertex_shader = file.read()
-        with open(dir+"/shaders/fragment_shaders/stratus_sky.frag", 'r') as file:
-            fragment_shader = file.read()
-        new_shader("sky", vertex_shader, fragment_shader, plane_coords, plane_indices)
-
-        # ----------------------------- Irradiance Shader ---------------------------- #
-
-        with open(dir+"/shaders/vertex_shaders/stratus_irra.vert", 'r') as file:
-            vertex_shader = file.read()
-        with open(dir+"/shaders/fragment_shaders/stratus_irra.frag", 'r') as file:
-            fragment_shader = file.read()
-        new_shader("sky_irra", vertex_shader, fragment_shader, plane_coords, plane_indices)
-
-        # ------------------------------ Viewport Shader ----------------------------- #
-        
-        with open(dir+"/shaders/vertex_shaders/stratus_viewport.vert", 'r') as file:
-            vertex_shader = file.read()
-        with open(dir+"/shaders/fragment_shaders/stratus_viewport.frag", 'r') as file:
-            fragment_shader = file.read()
-        new_shader("viewport", vertex_shader, fragment_shader, plane_coords, plane_indices)
+def load_texture_pixels(filepath, dim):
+    # Returns (pixels, dim, data_type, source), pixels a flat uint8 memmap from
+    # the texture cache or a float32 array read from the image file.
+    cached = load_cached_texture(filepath)
 
-        # ------------------------------- Screen Shader ------------------------------ #
+    if cached is not None:
+        pixels, dim = cached
+        return pixels, dim, bgl.GL_UNSIGNED_BYTE, "cache"
 
-        with open(dir+"/shaders/vertex_shaders/stratus_screen.vert", 'r') as file:
-            vertex_shader = file.read()
-        with open(dir+"/shaders/fragment_shaders/stratus_screen.frag", 'r') as file:
-            fragment_shader = file.read()
-        new_shader("screen", vertex_shader, fragment_shader, cube_coords, cube_indices)
+    img = bpy.data.images.load(filepath, check_existing=True)
+    if dim is None:
+        dim = (img.size[0], img.size[1])
+    channels = img.channels
+    pixels = new_pixel_array(img)
+    bpy.data.images.remove(img)
 
-        globals.INITIALIZED_SHADERS = True
+    store_cached_texture(filepath, pixels, dim, channels)
+
+    return pixels, dim, bgl.GL_FLOAT, "file"
+
+def load_texture(filepath, dim, bindcode):
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_time = time.perf_counter()
+
+    pixels, dim, data_type, source = load_texture_pixels(filepath, dim)
+
+    buffer_type = bgl.GL_BYTE if data_type == bgl.GL_UNSIGNED_BYTE else bgl.GL_FLOAT
+    bgl_texture_from_buffer(bgl.Buffer(buffer_type, pixels.size, pixels), dim, bindcode, data_type)
+
+    duration = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+
+    print("STRATUS: loaded "+filepath.rsplit('/', 1)[-1]+" ("+"x".join(str(d) for d in dim)+") from "+source+" in "+'{:.3f}'.format(duration)+"s, peak "+'{:.1f}'.format(peak / 1048576.0)+" MB")
 
 def init_textures(self):
     if globals.INITIALIZED_TEXTURES is False:
@@ -139,25 +125,36 @@ def init_textures(self):
         bgl.glGenTextures(globals.NMB_NOISE_TEXTURES, globals.NOISE_TEXTURES)
         bgl.glGenTextures(globals.NMB_MOON_TEXTURES, globals.MOON_TEXTURES)
 
-        img = bpy.data.images.load(dir+"/textures/noise/NOISE_TEX_d.tif", check_existing=True)
-        bgl_texture_from_image(img, (64, 64, 64), globals.NOISE_TEXTURES[0])
+        load_texture(dir+"/textures/noise/NOISE_TEX_d.tif", (64, 64, 64), globals.NOISE_TEXTURES[0])
         
-        #img = bpy.data.images.load(dir+"/textures/noise/noise_tex_shape_128.tif", check_existing=True)
-        #bgl_texture_from_image(img, (128, 128, 128), globals.NOISE_TEXTURES[0])
+        #load_texture(dir+"/textures/noise/noise_tex_shape_128.tif", (128, 128, 128), globals.NOISE_TEXTURES[0])
 
-        img = bpy.data.images.load(dir+"/textures/noise/NOISE_TEX_s.tif", check_existing=True)
-        bgl_texture_from_image(img, (128, 128, 128), globals.NOISE_TEXTURES[1])
-        
-        img = bpy.data.images.load(dir+"/textures/noise/noise_tex_2048.tif", check_existing=True)
-        bgl_texture_from_image(img, (img.size[0], img.size[1]), globals.NOISE_TEXTURES[2])
+        load_texture(dir+"/textures/noise/NOISE_TEX_s.tif", (128, 128, 128), globals.NOISE_TEXTURES[1])
+        load_texture(dir+"/textures/noise/noise_tex_2048.tif", None, globals.NOISE_TEXTURES[2])
+        load_texture(dir+"/textures/noise/noise_blue_128.png", None, globals.NOISE_TEXTURES[3])
 
-        img = bpy.data.images.load(dir+"/textures/noise/noise_blue_128.png", check_existing=True)
-        bgl_texture_from_image(img, (img.size[0], img.size[1]), globals.NOISE_TEXTURES[3])
-        
-        img = bpy.data.images.load(dir+"/textures/moon/moon_albedo.png", check_existing=True)
-        bgl_texture_from_image(img, (img.size[0], img.size[1]), globals.MOON_TEXTURES[0])
-
-        img = bpy.data.images.load(dir+"/textures/moon/moon_normal.png", check_existing=True)
-        bgl_texture_from_image(img, (img.size[0], img.size[1]), globals.MOON_TEXTURES[1])
+        load_texture(dir+"/textures/moon/moon_albedo.png", None, globals.MOON_TEXTURES[0])
+        load_texture(dir+"/textures/moon/moon_normal.png", None, globals.MOON_TEXTURES[1])
 
         globals.INITIALIZED_TEXTURES = True
+
+def _cpu_texture(filepath, dim):
+    pixels, dim, _, _ = load_texture_pixels(filepath, dim)
+    # GL order: x fastest, then y, then z.
+    return pixels.reshape(tuple(reversed(dim)) + (-1,))
+
+def init_cpu_textures(self):
+    # Same textures as init_textures, as arrays for cpu_renderer. Needs no GPU.
+    if globals.CPU_TEXTURES is None:
+        self.report({'INFO'}, "STRATUS: initializing CPU textures.")
+        dir = get_dir()
+
+        globals.CPU_TEXTURES = CPUTextures(
+            noise_3d_64=_cpu_texture(dir+"/textures/noise/NOISE_TEX_d.tif", (64, 64, 64)),
+            noise_3d_128=_cpu_texture(dir+"/textures/noise/NOISE_TEX_s.tif", (128, 128, 128)),
+            noise_2d_2048=_cpu_texture(dir+"/textures/noise/noise_tex_2048.tif", None),
+            blue_noise=_cpu_texture(dir+"/textures/noise/noise_blue_128.png", None),
+            moon_albedo=_cpu_texture(dir+"/textures/moon/moon_albedo.png", None),
+            moon_normal=_cpu_texture(dir+"/textures/moon/moon_normal.png", None))
+
+    return globals.CPU_TEXTURES
@@ -0,0 +1,140 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import gpu
+
+from ... import globals
+from .general_utils import bgl_uniform_sampler, new_offscreen_fbo
+from .shader_utils import get_shader, get_batch
+
+# These have to match the sizes in the shaders, see "Atmosphere Lookup Tables".
+OPTICAL_DEPTH_LUT_SIZE = (256, 64)
+SKY_VIEW_LUT_SIZE = (192, 128)
+AERIAL_PERSPECTIVE_LUT_SIZE = (64, 64, 32)
+
+LUT_MODE_OPTICAL_DEPTH = 0
+LUT_MODE_SKY_VIEW = 1
+LUT_MODE_AERIAL_PERSPECTIVE = 2
+
+def rgb_matrix(fit):
+    # mat3 with the channel weight, rayleigh and ozone extinction as columns,
+    # flattened column by column.
+    return tuple(float(v) for column in (fit.weight, fit.rayleigh, fit.ozone) for v in column)
+
+def scatter_uniforms(shader, state, use_spectral):
+    # Uniforms of stratus_atmo_scatter.glsl.
+    rgb_coeffs = state.rgb_coefficients()
+
+    shader.uniform_bool("use_spectral", use_spectral)
+    shader.uniform_float("rgb_rayleigh_scatter", rgb_matrix(rgb_coeffs.rayleigh_scatter))
+    shader.uniform_float("rgb_mie_scatter", rgb_matrix(rgb_coeffs.mie_scatter))
+
+class AtmoLUT:
+    # Lookup tables for the atmosphere, rendered by stratus_atmo_lut.frag. They
+    # only depend on the atmosphere properties and the sun/moon directions, so
+    # they are re-rendered when those change and reused for every tile, frame
+    # and viewport redraw in between.
+
+    def __init__(self):
+        sv_width, sv_height = SKY_VIEW_LUT_SIZE
+        ap_width, ap_height, ap_slices = AERIAL_PERSPECTIVE_LUT_SIZE
+
+        self._optical_depth = new_offscreen_fbo(*OPTICAL_DEPTH_LUT_SIZE)
+        # (rayleigh, mie) x (sun, moon)
+        self._sky_view = new_offscreen_fbo(2 * sv_width, 2 * sv_height)
+        # slices along x, (sun rayleigh, sun mie, moon rayleigh, moon mie) along y
+        self._aerial_perspective = new_offscreen_fbo(ap_slices * ap_width, 4 * ap_height)
+
+        self._key = None
+
+    def __del__(self):
+        self.free()
+
+    def free(self):
+        for fbo in (self._optical_depth, self._sky_view, self._aerial_perspective):
+            if fbo is not None:
+                fbo.free()
+        self._optical_depth = None
+        self._sky_view = None
+        self._aerial_perspective = None
+        self._key = None
+
+    def is_valid(self):
+        return bool(self._optical_depth and self._sky_view and self._aerial_perspective)
+
+    def _draw_pass(self, fbo, lut_mode, state, use_spectral):
+        atmo_prop = state.atmo_props
+
+        with fbo.bind():
+            gpu.state.depth_test_set('NONE')
+
+            _shader = get_shader("atmo_lut")
+            _shader.bind()
+
+            _shader.uniform_int("lut_mode", lut_mode)
+
+            _shader.uniform_float("sun_dir", state.sun_dir())
+            _shader.uniform_float("moon_dir", state.moon_dir())
+
+            _shader.uniform_float("altitude", atmo_prop.prop_sky_altitude)
+            _shader.uniform_float("rayleigh_density", atmo_prop.prop_air)
+            _shader.uniform_float("mie_density", atmo_prop.prop_dust)
+            _shader.uniform_float("ozone_density", atmo_prop.prop_ozone)
+
+            # Not used by the optical depth pass, which is the same either way.
+            if lut_mode != LUT_MODE_OPTICAL_DEPTH:
+                scatter_uniforms(_shader, state, use_spectral)
+
+            # The optical depth pass renders into the texture it would sample.
+            if lut_mode != LUT_MODE_OPTICAL_DEPTH:
+                bgl_uniform_sampler(_shader, "optical_depth_lut", self.get_optical_depth_texture(), dim=2, wrap='CLAMP_TO_EDGE', filter='LINEAR', slot=0)
+
+            get_batch("atmo_lut").draw(_shader)
+
+    def update(self, state, use_spectral=True):
+        key = (state.atmo_lut_key(), use_spectral)
+        if key == self._key:
+            return False
+
+        self._draw_pass(self._optical_depth, LUT_MODE_OPTICAL_DEPTH, state, use_spectral)
+        self._draw_pass(self._sky_view, LUT_MODE_SKY_VIEW, state, use_spectral)
+        self._draw_pass(self._aerial_perspective, LUT_MODE_AERIAL_PERSPECTIVE, state, use_spectral)
+
+        self._key = key
+        return True
+
+    def get_optical_depth_texture(self):
+        return self._optical_depth.color_texture
+
+    def get_sky_view_texture(self):
+        return self._sky_view.color_texture
+
+    def get_aerial_perspective_texture(self):
+        return self._aerial_perspective.color_texture
+
+def update_atmo_lut(state, use_spectral=True):
+    # None if the lookup tables couldn't be allocated.
+    if globals.ATMO_LUT is None or not globals.ATMO_LUT.is_valid():
+        globals.ATMO_LUT = AtmoLUT()
+        if not globals.ATMO_LUT.is_valid():
+            print("STRATUS: error initializing the atmosphere lookup tables.")
+            return None
+
+    globals.ATMO_LUT.update(state, use_spectral)
+    return globals.ATMO_LUT
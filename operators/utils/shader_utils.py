@@ -17,12 +17,170 @@
 #
 # ------------------------------------------------------------------------- #
 
+import re
 import gpu
+import time
+import hashlib
 from gpu_extras.batch import batch_for_shader
 
 from ... import globals
+from .general_utils import get_dir
 
-def new_shader(name, vert_shader, frag_shader, coords, indices):
-    globals.SHADER[name] = gpu.types.GPUShader(vert_shader, frag_shader, )
-    globals.BATCH[name] = batch_for_shader(globals.SHADER[name], 'TRIS', {"position": coords}, indices=indices)
+# Programs are compiled lazily, the first time they're drawn with, and cached
+# by a hash of their source and defines. Drawing code asks for a program with
+# get_shader(name, defines), each set of defines is its own variant.
+#
+# Shaders are assembled from the modules in shaders/include with
+# `#include "file"` lines, which are inlined when the sources are loaded.
+
+PLANE_COORDS = (
+    (-1, +1, 0),
+    (+1, +1, 0),
+    (-1, -1, 0),
+    (+1, -1, 0))
+PLANE_INDICES = ((0,1,2), (1,3,2))
+
+CUBE_COORDS = (
+    (-1, -1, -1), (+1, -1, -1),
+    (-1, +1, -1), (+1, +1, -1),
+    (-1, -1, +1), (+1, -1, +1),
+    (-1, +1, +1), (+1, +1, +1))
+CUBE_INDICES = (
+    (0, 1, 3), (0, 2, 3), (4,5,7), (4,6,7),
+    (0,4,5), (0,1,5), (2,0,4), (2,6,4),
+    (1,3,7), (1, 5,7), (3, 2, 6), (3, 6, 7))
+
+# name: (file name, coords, indices)
+SHADER_PROGRAMS = {
+    "env_img":  ("stratus_env_img",  PLANE_COORDS, PLANE_INDICES),
+    "sky":      ("stratus_sky",      PLANE_COORDS, PLANE_INDICES),
+    "sky_irra": ("stratus_irra",     PLANE_COORDS, PLANE_INDICES),
+    "viewport": ("stratus_viewport", PLANE_COORDS, PLANE_INDICES),
+    "screen":   ("stratus_screen",   CUBE_COORDS,  CUBE_INDICES),
+    "atmo_lut": ("stratus_atmo_lut", PLANE_COORDS, PLANE_INDICES),
+    "weather":  ("stratus_weather",  PLANE_COORDS, PLANE_INDICES),
+    "curl":     ("stratus_curl",     PLANE_COORDS, PLANE_INDICES),
+    "cloud_shadow": ("stratus_cloud_shadow", PLANE_COORDS, PLANE_INDICES),
+}
+
+INCLUDE_PATTERN = re.compile(r'^[ \t]*#include[ \t]+"([^"]+)"[ \t]*$', re.MULTILINE)
+
+def preprocess(source, include_dir, modules=None, included=None):
+    # Inlines the #include lines, recursively. Every module is included once,
+    # later includes of it are dropped. modules caches the module sources.
+    if modules is None:
+        modules = {}
+    if included is None:
+        included = set()
+
+    def include(match):
+        module_name = match.group(1)
+        if module_name in included:
+            return ""
+        included.add(module_name)
+
+        if module_name not in modules:
+            with open(include_dir+"/"+module_name, 'r') as file:
+                modules[module_name] = file.read()
+
+        return preprocess(modules[module_name], include_dir, modules, included)
+
+    return INCLUDE_PATTERN.sub(include, source)
+
+def load_shader_sources():
+    dir = get_dir()
+    modules = {}
+    for name, (file_name, coords, indices) in SHADER_PROGRAMS.items():
+        with open(dir+"/shaders/vertex_shaders/"+file_name+".vert", 'r') as file:
+            vertex_shader = file.read()
+        with open(dir+"/shaders/fragment_shaders/"+file_name+".frag", 'r') as file:
+            fragment_shader = file.read()
+        fragment_shader = preprocess(fragment_shader, dir+"/shaders/include", modules)
+        globals.SHADER_SOURCE[name] = (vertex_shader, fragment_shader)
+    _keys.clear()
+
+# (name, defines) -> source hash, so the sources aren't hashed on every draw.
+_keys = {}
+
+def _defines_source(defines):
+    return "".join("#define "+key+" "+str(value)+"\n" for key, value in sorted(defines.items()))
+
+def get_shader(name, defines=None):
+    if name not in globals.SHADER_SOURCE:
+        load_shader_sources()
+
+    vertex_shader, fragment_shader = globals.SHADER_SOURCE[name]
+    defines_source = _defines_source(defines or {})
+
+    key = _keys.get((name, defines_source))
+    if key is None:
+        key = hashlib.sha1((vertex_shader + "\0" + fragment_shader + "\0" + defines_source).encode()).hexdigest()
+        _keys[(name, defines_source)] = key
+
+    shader = globals.SHADER.get(key)
+    if shader is None:
+        start_time = time.perf_counter()
+        shader = gpu.types.GPUShader(vertex_shader, fragment_shader, defines=defines_source)
+        print("STRATUS: compiled "+name+" shader in "+'{:.2f}'.format(time.perf_counter() - start_time)+"s")
+        globals.SHADER[key] = shader
+
+    if name not in globals.BATCH:
+        file_name, coords, indices = SHADER_PROGRAMS[name]
+        globals.BATCH[name] = batch_for_shader(shader, 'TRIS', {"position": coords}, indices=indices)
+
+    return shader
+
+def get_batch(name):
+    # Every variant of a program has the same vertex input, they share a batch.
+    return globals.BATCH[name]
+
+def set_optional_uniform(shader, setter, name, value):
+    # Uniforms only read by compiled out features are removed by the GLSL
+    # compiler, and setting a missing uniform raises.
+    try:
+        getattr(shader, setter)(name, value)
+    except ValueError:
+        pass
+
+# Cloud march settings per quality, see "March Quality" in
+# stratus_sky_render.glsl. REFERENCE defines none of them and gets the
+# evenly spaced march.
+#   CLD_COARSE_STRIDE: fine steps per stride through empty sky
+#   CLD_EMPTY_STEPS: empty fine steps before going back to strides
+#   CLD_NEAR_STEP, CLD_FAR_STEP: step length at the start and end of the
+#       march, relative to the evenly spaced one
+#   CLD_MIN_TRANSMITTANCE: the march stops once the cloud is this opaque
+CLOUD_QUALITY = {
+    'LOW': {
+        "CLD_COARSE_STRIDE": "8.0",
+        "CLD_EMPTY_STEPS": "2",
+        "CLD_NEAR_STEP": "1.0",
+        "CLD_FAR_STEP": "1.5",
+        "CLD_MIN_TRANSMITTANCE": "0.01",
+    },
+    'MEDIUM': {
+        "CLD_COARSE_STRIDE": "6.0",
+        "CLD_EMPTY_STEPS": "3",
+        "CLD_NEAR_STEP": "0.75",
+        "CLD_FAR_STEP": "1.25",
+        "CLD_MIN_TRANSMITTANCE": "0.003",
+    },
+    'HIGH': {
+        "CLD_COARSE_STRIDE": "4.0",
+        "CLD_EMPTY_STEPS": "4",
+        "CLD_NEAR_STEP": "0.5",
+        "CLD_FAR_STEP": "1.0",
+        "CLD_MIN_TRANSMITTANCE": "0.001",
+    },
+    'REFERENCE': {},
+}
 
+def feature_defines(flags, use_spectral, cld_quality='REFERENCE', use_shadow_volume=False):
+    # Defines for the env_img and viewport shaders, see the feature switches
+    # at the top of their atmosphere section.
+    defines = {name.upper(): ("true" if value else "false") for name, value in flags.items()}
+    defines["USE_SPECTRAL"] = "true" if use_spectral else "false"
+    defines.update(CLOUD_QUALITY[cld_quality])
+    if use_shadow_volume:
+        defines["CLD_SHADOW_VOLUME"] = "1"
+    return defines
@@ -0,0 +1,61 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+from .general_utils import new_offscreen_fbo
+
+# Has to match shadow_volume_size in the shaders, see "Shadow Volume".
+# (width, height, heights through the layer)
+SHADOW_VOLUME_SIZE = (256, 256, 16)
+
+class ShadowVolume:
+    # Optical depth from the cloud layers towards the sun and moon, baked by
+    # stratus_cloud_shadow.frag (see draw_utils.update_shadow_volume). The
+    # cloud march looks it up instead of marching towards the lights at every
+    # sample in the cloud. One atlas per layer, the heights are laid out as
+    # slices along x.
+
+    def __init__(self):
+        width, height, slices = SHADOW_VOLUME_SIZE
+        self._volumes = [new_offscreen_fbo(slices * width, height) for layer in range(2)]
+        self._keys = [None, None]
+
+    def __del__(self):
+        self.free()
+
+    def free(self):
+        for fbo in self._volumes:
+            if fbo is not None:
+                fbo.free()
+        self._volumes = [None, None]
+        self._keys = [None, None]
+
+    def is_valid(self):
+        return all(self._volumes)
+
+    def needs_update(self, layer, key):
+        return key != self._keys[layer]
+
+    def set_key(self, layer, key):
+        self._keys[layer] = key
+
+    def get_offscreen(self, layer):
+        return self._volumes[layer]
+
+    def get_texture(self, layer):
+        return self._volumes[layer].color_texture
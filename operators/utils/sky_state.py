@@ -0,0 +1,406 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import bpy
+import math
+
+from mathutils import Matrix, Vector
+from bl_math import lerp
+
+from ... import globals
+from .general_utils import compute_dir, look_at
+from .spectral import rgb_coefficients
+from .shader_utils import feature_defines
+
+PROP_GROUPS = (
+    "main_props",
+    "cloud_props",
+    "atmo_props",
+    "sun_props",
+    "stars_props",
+    "moon_props",
+    "render_props",
+)
+
+def snapshot_prop_group(group):
+    values = {}
+    for prop in group.bl_rna.properties:
+        name = prop.identifier
+        if name == "rna_type":
+            continue
+        value = getattr(group, name)
+        if prop.type in {'FLOAT', 'INT', 'BOOLEAN'} and prop.is_array:
+            value = tuple(value)
+        values[name] = value
+    return values
+
+def memoized(func):
+    name = func.__name__
+    def wrapper(self, *args):
+        key = (name,) + args
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = func(self, *args)
+            self._derived[key] = value
+            return value
+    return wrapper
+
+class SkyGroup:
+    # Read-only stand-in for one PropertyGroup, e.g. state.cloud_props.cld_0_density
+
+    __slots__ = ("_values",)
+
+    def __init__(self, values):
+        object.__setattr__(self, "_values", values)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SkyState is immutable.")
+
+class SkyState:
+    # Immutable, hashable snapshot of the seven Stratus PropertyGroups. Anything
+    # derived from it (matrices, scaled noise frequencies, ...) is computed once
+    # per snapshot and memoized, so repeated draws only do dictionary lookups.
+
+    def __init__(self, frame, groups):
+        self._frame = frame
+        self._groups = {name: SkyGroup(values) for name, values in groups.items()}
+        self._key = (frame,) + tuple(tuple(sorted(groups[name].items())) for name in PROP_GROUPS)
+        self._hash = hash(self._key)
+        self._derived = {}
+
+    @classmethod
+    def from_scene(cls, scene):
+        groups = {name: snapshot_prop_group(getattr(scene, name)) for name in PROP_GROUPS}
+        return cls(scene.frame_current, groups)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._groups[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return isinstance(other, SkyState) and self._key == other._key
+
+    def get_frame(self):
+        return self._frame
+
+    # ------------------------------- Derived ------------------------------- #
+
+    @memoized
+    def max_steps(self, render_context):
+        render_prop = self.render_props
+        suffix = "_viewport" if render_context == 'VIEWPORT' else "_render"
+        p = lambda name: getattr(render_prop, name+suffix)
+
+        if p("enable_separate_steps"):
+            cld_0_max_steps = p("cld_0_max_steps")
+            cld_1_max_steps = p("cld_1_max_steps")
+        else:
+            cld_0_max_steps = p("max_steps")
+            cld_1_max_steps = p("max_steps")
+
+        if p("enable_separate_light_steps"):
+            cld_0_max_light_steps = p("cld_0_max_light_steps")
+            cld_1_max_light_steps = p("cld_1_max_light_steps")
+        else:
+            cld_0_max_light_steps = p("max_light_steps")
+            cld_1_max_light_steps = p("max_light_steps")
+
+        return (cld_0_max_steps, cld_1_max_steps, cld_0_max_light_steps, cld_1_max_light_steps)
+
+    @memoized
+    def enable_flags(self, render_context):
+        suffix = "_show_viewport" if render_context == 'VIEWPORT' else "_show_render"
+
+        return {
+            "enable_atm":   getattr(self.atmo_props, "atm"+suffix),
+            "enable_cld_0": getattr(self.cloud_props, "cld_0"+suffix),
+            "enable_cld_1": getattr(self.cloud_props, "cld_1"+suffix),
+            "enable_moon":  getattr(self.moon_props, "moon"+suffix),
+            "enable_sun":   getattr(self.sun_props, "sun"+suffix),
+            "enable_stars": getattr(self.stars_props, "stars"+suffix),
+        }
+
+    @memoized
+    def use_spectral(self, render_context):
+        if render_context == 'VIEWPORT':
+            return self.render_props.enable_spectral_viewport
+        return self.render_props.enable_spectral_render
+
+    @memoized
+    def cld_quality(self, render_context):
+        if render_context == 'VIEWPORT':
+            return self.render_props.cld_quality_viewport
+        return self.render_props.cld_quality_render
+
+    @memoized
+    def use_shadow_volume(self, render_context):
+        if render_context == 'VIEWPORT':
+            return self.render_props.enable_shadow_volume_viewport
+        return self.render_props.enable_shadow_volume_render
+
+    @memoized
+    def shader_defines(self, render_context, cld_quality=None):
+        # cld_quality overrides the context's preset, e.g. for the env image
+        # previews.
+        return feature_defines(
+            self.enable_flags(render_context),
+            self.use_spectral(render_context),
+            cld_quality or self.cld_quality(render_context),
+            self.use_shadow_volume(render_context))
+
+    @memoized
+    def rgb_coefficients(self):
+        prop = self.atmo_props
+        return rgb_coefficients(prop.prop_air, prop.prop_ozone)
+
+    @memoized
+    def cld_domain(self):
+        d = 60000.0#prop.scale_0#60000.0 # (m) # 10000.0
+        h = 1000.0#prop.scale_1#1000.0 # (m)  # 100.0
+        cld_domain_radius = math.pow((2.0*d),2.0) / (8.0 * h) + h * 0.5
+        cld_domain_center = Vector((0.0, 0.0, h-cld_domain_radius)).freeze()
+        return cld_domain_radius, cld_domain_center
+
+    @memoized
+    def cloud_params(self, layer):
+        # Values of the shader's Cloud struct, minus the step counts.
+        prop = self.cloud_props
+        p = lambda name: getattr(prop, "cld_"+str(layer)+"_"+name)
+
+        cld_domain_radius, cld_domain_center = self.cld_domain()
+
+        scale = lerp(0.1, 7.5, p("size"))
+
+        if layer == 0:
+            detail_scale = (0.0003 * p("detail_scale"))
+            shape_scale = (0.00013 * p("shape_scale")) / scale
+            coverage_scale = (0.00001 * p("coverage_scale")) / scale
+            shell_thickness = 500.0 * scale
+            detail_intsty = 0.6 * p("detail_intsty")
+            shape_shape = p("shape_shape")
+            detail_shape = p("detail_shape")
+            shape_inverse = p("shape_inverse")
+            detail_inverse = p("detail_inverse")
+        else:
+            # The cumulus layer does not expose these, the shader sees zero.
+            detail_scale = (0.0019 * p("detail_scale"))
+            shape_scale = (0.0015 * p("shape_scale")) / scale
+            coverage_scale = (0.000035 * p("coverage_scale")) / scale
+            shell_thickness = 1000 * scale
+            detail_intsty = p("detail_intsty")
+            shape_shape = 0.0
+            detail_shape = 0.0
+            shape_inverse = 0.0
+            detail_inverse = 0.0
+
+        sigma_a = Vector((0.0, 0.0, 0.0))
+        sigma_t = max(Vector(p("sigma_s")) + sigma_a, Vector((0.000000001,0.000000001,0.000000001)))
+
+        trans = Matrix.Translation(cld_domain_center + Vector((0,0,6360e3)))
+        rot = Matrix.Rotation(p("rotation"), 4, 'Z')
+
+        transform = rot @ trans
+        transform.invert()
+
+        # The layer's weather map has to reach as far as the layer is above
+        # the ground, which in the layer's space is at z = -cld_domain_center.z.
+        outer_radius = p("height") + cld_domain_radius + shell_thickness
+        ground = -cld_domain_center.z
+        weather_extent = 1.1 * math.sqrt(max(outer_radius * outer_radius - ground * ground, 0.0))
+
+        return {
+            "top_roundness":    p("top_roundness"),
+            "btm_roundness":    p("bottom_roundness"),
+            "radius":           p("height") + cld_domain_radius,
+            "density":          p("density"),
+            "density_height":   p("density_height"),
+            "thickness":        p("thickness"),
+            "shell_thickness":  shell_thickness,
+            "sigma_s":          Vector(p("sigma_s")).freeze(),
+            "sigma_t":          sigma_t.freeze(),
+            "ap_intsty":        500000.0 * lerp(0.5, 0.04175, p("ap_intsty")),
+            "ambient_intsty":   p("ambient_intsty"),
+            "atten":            p("atten"),
+            "contr":            p("contr"),
+            "eccen":            p("eccen"),
+            "coverage_shape":   p("coverage_shape"),
+            "shape_shape":      shape_shape,
+            "detail_shape":     detail_shape,
+            "shape_inverse":    shape_inverse,
+            "detail_inverse":   detail_inverse,
+            "coverage_scale":   coverage_scale,
+            "shape_scale":      shape_scale,
+            "detail_scale":     detail_scale,
+            "curl_octaves":     p("curl_octaves"),
+            "coverage_intsty":  p("coverage_intsty"),
+            "shape_intsty":     0.6 * p("shape_intsty"),
+            "detail_intsty":    detail_intsty,
+            "pos_offset":       (Vector(p("pos_offset")) * 100.0).freeze(),
+            "coverage_offset":  (Vector(p("coverage_offset")) * 100.0).freeze(),
+            "shape_offset":     (Vector(p("shape_offset")) * 100.0).freeze(),
+            "detail_offset":    (Vector(p("detail_offset")) * 100.0).freeze(),
+            "transform":        transform.freeze(),
+            "layer":            layer,
+            "weather_extent":   weather_extent,
+        }
+
+    @memoized
+    def weather_map_key(self, layer):
+        # Everything a layer's weather map depends on.
+        cloud = self.cloud_params(layer)
+        return (
+            tuple(cloud["pos_offset"]),
+            cloud["coverage_scale"],
+            cloud["curl_octaves"],
+            cloud["weather_extent"],
+        )
+
+    @memoized
+    def curl_map_key(self):
+        # The curl map only depends on the octaves of both layers.
+        return (self.cloud_params(0)["curl_octaves"], self.cloud_params(1)["curl_octaves"])
+
+    @memoized
+    def shadow_volume_key(self, layer, render_context):
+        # Everything a layer's shadow volume depends on.
+        return (
+            tuple(sorted(self.cloud_params(layer).items())),
+            self.max_steps(render_context)[2 + layer],
+            tuple(self.sun_dir()),
+            tuple(self.moon_dir()),
+        )
+
+    @memoized
+    def sun_dir(self):
+        prop = self.sun_props
+        return compute_dir(prop.sun_elevation, prop.sun_rotation).freeze()
+
+    @memoized
+    def moon_dir(self):
+        prop = self.moon_props
+        return compute_dir(prop.moon_elevation, prop.moon_rotation).freeze()
+
+    @memoized
+    def moon_params(self):
+        moon_prop = self.moon_props
+
+        moon_dir = self.moon_dir()
+
+        # Rotate Moon so that it always faces the origin
+        inv_lookat_mat = look_at(moon_dir, Vector((0,0,0)), Vector((0,0,1)))
+        inv_lookat_mat.invert()
+
+        # Flip the x,y values when Moon goes over the zenith i.e theta > 90d
+        if (math.cos(moon_prop.moon_elevation) < 0.0):
+            a = -inv_lookat_mat.row[0]
+            b = -inv_lookat_mat.row[1]
+            c =  inv_lookat_mat.row[2]
+            d =  inv_lookat_mat.row[3]
+
+            inv_lookat_mat = Matrix((a,b,c,d))
+            moon_up = Vector((moon_dir[1],-moon_dir[0],0))
+        else:
+            moon_up = Vector((-moon_dir[1],moon_dir[0],0))
+
+        moon_up.normalize()
+
+        # Offset Moon rotation s.t. it has proper orientation
+        rot_offset_mat = Matrix((
+            (0.0000, 0.0000, -1.0000, 0.0000),
+            (0.0000, 1.0000,  0.0000, 0.0000),
+            (1.0000, 0.0000,  0.0000, 0.0000),
+            (0.0000, 0.0000,  0.0000, 1.0000)
+        ))
+
+        # Rotate Moon face
+        rot_moon_face_mat = Matrix.Rotation(moon_prop.moon_face_rotation, 4, moon_dir)
+
+        # Combine rotations
+        moon_rot_mat = rot_offset_mat @ inv_lookat_mat @ rot_moon_face_mat
+
+        if (moon_prop.moon_use_sun_dir):
+            moon_phase_dir = self.sun_dir().copy()
+        else:
+            inv_moon_dir = -moon_dir
+            rot_mat = Matrix.Rotation(moon_prop.moon_phase_rotation, 4, inv_moon_dir)
+
+            moon_up = rot_mat @ moon_up
+            moon_up.normalize()
+
+            rot_mat = Matrix.Rotation(moon_prop.moon_phase, 4, moon_up)
+            moon_phase_dir = rot_mat @ inv_moon_dir
+            moon_phase_dir.normalize()
+
+        return moon_rot_mat.freeze(), moon_phase_dir.freeze()
+
+    @memoized
+    def atmo_lut_key(self):
+        # Everything the atmosphere lookup tables depend on.
+        prop = self.atmo_props
+        return (
+            prop.prop_sky_altitude,
+            prop.prop_air,
+            prop.prop_dust,
+            prop.prop_ozone,
+            tuple(self.sun_dir()),
+            tuple(self.moon_dir()),
+        )
+
+    @memoized
+    def pole_dir(self):
+        prop = self.stars_props
+        return compute_dir(prop.stars_pole_elevation, prop.stars_pole_rotation).freeze()
+
+    @memoized
+    def stars_rot_mat(self):
+        return Matrix.Rotation(self.stars_props.stars_rotation, 4, self.pole_dir()).freeze()
+
+_sky_state = None
+_sky_state_key = None
+
+def get_sky_state(scene=None):
+    # update_prop bumps SKY_STATE_VERSION, which invalidates the snapshot. The
+    # frame is part of the key since keyframed values never call update_prop.
+    global _sky_state, _sky_state_key
+
+    if scene is None:
+        scene = bpy.context.scene
+
+    key = (globals.SKY_STATE_VERSION, scene.name, scene.frame_current)
+    if _sky_state is None or _sky_state_key != key:
+        _sky_state = SkyState.from_scene(scene)
+        _sky_state_key = key
+
+    return _sky_state
@@ -0,0 +1,187 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+# Spectral data of the atmosphere and its reduction to RGB.
+#
+# The shaders integrate the atmosphere over 21 wavelengths and project the
+# spectrum to RGB at the end. Light that went through optical depths
+# (t_r, t_m, t_o) of rayleigh, mie and ozone arrives as
+#
+#   rgb = SPEC_TO_RGB @ (w * exp(-(rayleigh_coeff*t_r + mie_coeff*t_m + ozone_coeff*t_o)))
+#
+# with w the spectral weight of the lobe, i.e. irradiance*rayleigh_coeff for
+# rayleigh in-scattering and irradiance for mie in-scattering and direct
+# light. The RGB path replaces this, per channel c, by
+#
+#   rgb_c = weight_c * exp(-(rayleigh_c*t_r + mie_coeff*t_m + ozone_c*t_o))
+#
+# weight_c is exact (it is the projection at zero optical depth). rayleigh_c
+# and ozone_c are least-squares fits of the attenuation over the range of
+# optical depths the atmosphere produces, so they depend on the rayleigh and
+# ozone density. Mie extinction is grey and stays exact.
+#
+# Error bound: fit_extinction reports the largest error over the fitted range,
+# as a fraction of the unattenuated channel. With the default densities it is
+# below 5% (red channel, rayleigh lobe, low sun), below 2.5% for green and
+# below 2% for blue, and the error goes to zero as the optical depth does.
+# Measured over the density range of the panel it stays below 6% for
+# densities up to 2, 7% up to 5 and 18% up to 10, the extremes are better off
+# with the spectral path.
+#
+# Nothing in here needs bpy, so it can be used outside of Blender as well.
+
+import numpy as np
+
+from functools import lru_cache
+from collections import namedtuple
+
+MIN_WAVELENGTH = 380
+MAX_WAVELENGTH = 780
+NUM_WAVELENGTHS = 21
+
+STEP_LAMBDA = float((MAX_WAVELENGTH - MIN_WAVELENGTH) // (NUM_WAVELENGTHS - 1))
+
+MIE_COEFF = 21e-6
+
+# Sun irradiance on top of the atmosphere (W*m^-2*nm^-1)
+IRRADIANCE = np.array((
+    1.45756829855592995315, 1.56596305559738380175, 1.65148449067670455293,
+    1.71496242737209314555, 1.75797983805020541226, 1.78256407885924539336,
+    1.79095108475838560302, 1.78541550133410664714, 1.76815554864306845317,
+    1.74122069647250410362, 1.70647127164943679389, 1.66556087452739887134,
+    1.61993437242451854274, 1.57083597368892080581, 1.51932335059305478886,
+    1.46628494965214395407, 1.41245852740172450623, 1.35844961970384092709,
+    1.30474913844739281998, 1.25174963272610817455, 1.19975998755420620867))
+
+# Rayleigh scattering coefficient (m^-1)
+RAYLEIGH_COEFF = np.array((
+    0.00005424820087636473, 0.00004418549866505454, 0.00003635151910165377,
+    0.00003017929012024763, 0.00002526320226989157, 0.00002130859310621843,
+    0.00001809838025320633, 0.00001547057129129042, 0.00001330284977336850,
+    0.00001150184784075764, 0.00000999557429990163, 0.00000872799973630707,
+    0.00000765513700977967, 0.00000674217203751443, 0.00000596134125832052,
+    0.00000529034598065810, 0.00000471115687557433, 0.00000420910481110487,
+    0.00000377218381260133, 0.00000339051255477280, 0.00000305591531679811))
+
+# Ozone absorption coefficient (m^-1)
+OZONE_COEFF = np.array((
+    0.00000000325126849861, 0.00000000585395365047, 0.00000001977191155085,
+    0.00000007309568762914, 0.00000020084561514287, 0.00000040383958096161,
+    0.00000063551335912363, 0.00000096707041180970, 0.00000154797400424410,
+    0.00000209038647223331, 0.00000246128056164565, 0.00000273551299461512,
+    0.00000215125863128643, 0.00000159051840791988, 0.00000112356197979857,
+    0.00000073527551487574, 0.00000046450130357806, 0.00000033096079921048,
+    0.00000022512612292678, 0.00000014879129266490, 0.00000016828623364192))
+
+# CIE XYZ color matching functions
+CMF_XYZ = np.array((
+    (0.00136800000, 0.00003900000, 0.00645000100),
+    (0.01431000000, 0.00039600000, 0.06785001000),
+    (0.13438000000, 0.00400000000, 0.64560000000),
+    (0.34828000000, 0.02300000000, 1.74706000000),
+    (0.29080000000, 0.06000000000, 1.66920000000),
+    (0.09564000000, 0.13902000000, 0.81295010000),
+    (0.00490000000, 0.32300000000, 0.27200000000),
+    (0.06327000000, 0.71000000000, 0.07824999000),
+    (0.29040000000, 0.95400000000, 0.02030000000),
+    (0.59450000000, 0.99500000000, 0.00390000000),
+    (0.91630000000, 0.87000000000, 0.00165000100),
+    (1.06220000000, 0.63100000000, 0.00080000000),
+    (0.85444990000, 0.38100000000, 0.00019000000),
+    (0.44790000000, 0.17500000000, 0.00002000000),
+    (0.16490000000, 0.06100000000, 0.00000000000),
+    (0.04677000000, 0.01700000000, 0.00000000000),
+    (0.01135916000, 0.00410200000, 0.00000000000),
+    (0.00289932700, 0.00104700000, 0.00000000000),
+    (0.00069007860, 0.00024920000, 0.00000000000),
+    (0.00016615050, 0.00006000000, 0.00000000000),
+    (0.00004150994, 0.00001499000, 0.00000000000)))
+
+XYZ_TO_RGB = np.array((
+    ( 3.2404542, -1.5371385, -0.4985314),
+    (-0.9692660,  1.8760108,  0.0415560),
+    ( 0.0556434, -0.2040259,  1.0572252)))
+
+# Same as spec_to_rgb in the shaders, as a (3, NUM_WAVELENGTHS) matrix.
+SPEC_TO_RGB = (XYZ_TO_RGB @ CMF_XYZ.T) * STEP_LAMBDA
+
+# Largest unscaled optical depths (m) the fit has to cover. Rayleigh is about
+# the depth along the horizon at sea level, sqrt(pi*R*H/2), ozone the depth of
+# a horizontal path through the ozone layer.
+MAX_RAYLEIGH_DEPTH = 3.0e5
+MAX_OZONE_DEPTH = 4.0e5
+
+FIT_SAMPLES = 48
+FIT_ITERATIONS = 50
+
+ExtinctionFit = namedtuple("ExtinctionFit", ("weight", "rayleigh", "ozone", "max_error"))
+RGBCoefficients = namedtuple("RGBCoefficients", ("rayleigh_scatter", "mie_scatter"))
+
+def spec_to_rgb(spectrum):
+    return SPEC_TO_RGB @ spectrum
+
+def fit_extinction(weight, max_rayleigh_depth, max_ozone_depth):
+    # Fits exp(-(rayleigh_c*t_r + ozone_c*t_o)) to the projected attenuation of
+    # the spectral weight, per channel, with Gauss-Newton. Starts from the
+    # weighted mean coefficients, which is the exact fit for small depths.
+    t_r, t_o = np.meshgrid(
+        np.linspace(0.0, max_rayleigh_depth, FIT_SAMPLES),
+        np.linspace(0.0, max_ozone_depth, FIT_SAMPLES),
+        indexing='ij')
+    t_r = t_r.ravel()
+    t_o = t_o.ravel()
+
+    spectral = np.exp(-np.outer(t_r, RAYLEIGH_COEFF) - np.outer(t_o, OZONE_COEFF))
+
+    channel_weight = SPEC_TO_RGB * weight
+    rgb_weight = channel_weight.sum(axis=1)
+
+    rayleigh = np.zeros(3)
+    ozone = np.zeros(3)
+    max_error = np.zeros(3)
+
+    for c in range(3):
+        target = (spectral @ channel_weight[c]) / rgb_weight[c]
+
+        x = np.array((
+            (channel_weight[c] * RAYLEIGH_COEFF).sum() / rgb_weight[c],
+            (channel_weight[c] * OZONE_COEFF).sum() / rgb_weight[c]))
+
+        for _ in range(FIT_ITERATIONS):
+            model = np.exp(-x[0] * t_r - x[1] * t_o)
+            jacobian = np.stack((-t_r * model, -t_o * model), axis=1)
+            step = np.linalg.lstsq(jacobian, target - model, rcond=None)[0]
+            x += step
+            if np.abs(step).max() < 1e-14:
+                break
+
+        rayleigh[c], ozone[c] = x
+        max_error[c] = np.abs(np.exp(-x[0] * t_r - x[1] * t_o) - target).max()
+
+    return ExtinctionFit(rgb_weight, rayleigh, ozone, max_error)
+
+@lru_cache(maxsize=16)
+def rgb_coefficients(rayleigh_density, ozone_density):
+    # One set of coefficients per lobe, see the top of this file.
+    max_rayleigh_depth = MAX_RAYLEIGH_DEPTH * max(rayleigh_density, 0.0)
+    max_ozone_depth = MAX_OZONE_DEPTH * max(ozone_density, 0.0)
+
+    return RGBCoefficients(
+        fit_extinction(IRRADIANCE * RAYLEIGH_COEFF, max_rayleigh_depth, max_ozone_depth),
+        fit_extinction(IRRADIANCE, max_rayleigh_depth, max_ozone_depth))
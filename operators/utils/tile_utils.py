@@ -0,0 +1,66 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import bgl
+import time
+
+class TileScheduler:
+    # Decides how many tiles fit into one redraw. Each tile is timed by waiting
+    # on the GPU (bgl has no timer queries), and the next tile is only started
+    # if the running estimate of a tile's cost still fits into the budget.
+
+    _smoothing = 0.5
+
+    def __init__(self, budget_ms):
+        self._budget = budget_ms / 1000.0
+        self._tile_time = 0.0
+        self._start_time = 0.0
+        self._last_time = 0.0
+        self._tiles = 0
+
+    def set_budget(self, budget_ms):
+        self._budget = budget_ms / 1000.0
+
+    def begin(self):
+        bgl.glFinish()
+        self._start_time = time.perf_counter()
+        self._last_time = self._start_time
+        self._tiles = 0
+
+    def tile_done(self):
+        # Returns True if another tile fits into this redraw.
+        bgl.glFinish()
+        now = time.perf_counter()
+
+        tile_time = now - self._last_time
+        if self._tile_time == 0.0:
+            self._tile_time = tile_time
+        else:
+            self._tile_time += (tile_time - self._tile_time) * self._smoothing
+
+        self._last_time = now
+        self._tiles += 1
+
+        return (now - self._start_time) + self._tile_time <= self._budget
+
+    def get_tile_count(self):
+        return self._tiles
+
+    def get_tile_time(self):
+        return self._tile_time
@@ -0,0 +1,192 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import gpu
+import struct
+
+class Std140Buffer:
+    # Minimal std140 packer. Scalars align to 4 bytes, vec2 to 8, vec3/vec4,
+    # mat4 columns and structs to 16. Structs are padded to a multiple of 16.
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def _align(self, alignment):
+        padding = (-len(self._data)) % alignment
+        self._data += bytes(padding)
+
+    def float(self, value):
+        self._align(4)
+        self._data += struct.pack('<f', value)
+
+    def int(self, value):
+        self._align(4)
+        self._data += struct.pack('<i', value)
+
+    def vec2(self, value):
+        self._align(8)
+        self._data += struct.pack('<2f', value[0], value[1])
+
+    def vec3(self, value):
+        self._align(16)
+        self._data += struct.pack('<3f', value[0], value[1], value[2])
+
+    def mat4(self, value):
+        # mathutils matrices are indexed by row, GLSL expects columns.
+        self._align(16)
+        for col in range(4):
+            self._data += struct.pack('<4f', *(value[row][col] for row in range(4)))
+
+    def begin_struct(self):
+        self._align(16)
+
+    def end_struct(self):
+        self._align(16)
+
+    def data(self):
+        self._align(16)
+        return bytes(self._data)
+
+def pack_cloud(buffer, cloud, max_steps, max_light_steps):
+    buffer.begin_struct()
+
+    buffer.float(cloud["top_roundness"])
+    buffer.float(cloud["btm_roundness"])
+
+    buffer.float(cloud["radius"])
+    buffer.float(cloud["density"])
+    buffer.float(cloud["density_height"])
+    buffer.float(cloud["thickness"])
+    buffer.float(cloud["shell_thickness"])
+
+    buffer.vec3(cloud["sigma_s"])
+    buffer.vec3(cloud["sigma_t"])
+
+    buffer.float(cloud["ap_intsty"])
+    buffer.float(cloud["ambient_intsty"])
+
+    buffer.float(cloud["atten"])
+    buffer.float(cloud["contr"])
+    buffer.float(cloud["eccen"])
+
+    buffer.float(cloud["coverage_shape"])
+    buffer.float(cloud["shape_shape"])
+    buffer.float(cloud["detail_shape"])
+
+    buffer.float(cloud["shape_inverse"])
+    buffer.float(cloud["detail_inverse"])
+
+    buffer.float(cloud["coverage_scale"])
+    buffer.float(cloud["shape_scale"])
+    buffer.float(cloud["detail_scale"])
+
+    buffer.int(cloud["curl_octaves"])
+
+    buffer.float(cloud["coverage_intsty"])
+    buffer.float(cloud["shape_intsty"])
+    buffer.float(cloud["detail_intsty"])
+
+    buffer.vec2(cloud["pos_offset"])
+
+    buffer.vec2(cloud["coverage_offset"])
+    buffer.vec2(cloud["shape_offset"])
+    buffer.vec2(cloud["detail_offset"])
+
+    buffer.mat4(cloud["transform"])
+
+    buffer.int(max_steps)
+    buffer.int(max_light_steps)
+
+    buffer.int(cloud["layer"])
+
+    buffer.float(cloud["weather_extent"])
+
+    buffer.end_struct()
+
+def pack_light(buffer, dir, intsty):
+    buffer.begin_struct()
+    buffer.vec3(dir)
+    buffer.float(intsty)
+    buffer.float(0.0) # silver_intsty
+    buffer.float(0.0) # silver_spread
+    buffer.end_struct()
+
+def pack_sky_params(state, render_context):
+    atmo_prop = state.atmo_props
+    sun_prop = state.sun_props
+    moon_prop = state.moon_props
+    stars_prop = state.stars_props
+
+    max_steps = state.max_steps(render_context)
+
+    _, cld_domain_center = state.cld_domain()
+    moon_rot_mat, moon_phase_dir = state.moon_params()
+
+    buffer = Std140Buffer()
+
+    pack_cloud(buffer, state.cloud_params(0), max_steps[0], max_steps[2])
+    pack_cloud(buffer, state.cloud_params(1), max_steps[1], max_steps[3])
+
+    pack_light(buffer, state.sun_dir(), sun_prop.sun_intsty)
+    pack_light(buffer, state.moon_dir(), moon_prop.moon_intsty)
+
+    buffer.mat4(moon_rot_mat)
+    buffer.mat4(state.stars_rot_mat())
+
+    buffer.vec3(cld_domain_center)
+    buffer.float(atmo_prop.prop_sky_altitude)
+
+    buffer.vec3(moon_phase_dir)
+    buffer.float(moon_prop.moon_ambient_intsty)
+
+    buffer.float(atmo_prop.prop_air)
+    buffer.float(atmo_prop.prop_dust)
+    buffer.float(atmo_prop.prop_ozone)
+
+    buffer.float(sun_prop.sun_size / 2.0)
+    buffer.float(moon_prop.moon_size / 2.0)
+
+    buffer.float(stars_prop.stars_intsty)
+
+    # Direct light goes through the same attenuation as mie in-scattering.
+    mie_fit = state.rgb_coefficients().mie_scatter
+
+    buffer.vec3(mie_fit.weight)
+    buffer.int(int(state.use_spectral(render_context)))
+    buffer.vec3(mie_fit.rayleigh)
+
+    return buffer.data()
+
+_sky_params_ubo = {}
+
+def get_sky_params_ubo(state, render_context):
+    cached = _sky_params_ubo.get(render_context)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
+    data = pack_sky_params(state, render_context)
+
+    if cached is not None:
+        ubo = cached[1]
+        ubo.update(data)
+    else:
+        ubo = gpu.types.GPUUniformBuf(data)
+
+    _sky_params_ubo[render_context] = (state, ubo)
+    return ubo
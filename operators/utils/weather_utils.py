@@ -0,0 +1,134 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+import gpu
+
+from ... import globals
+from .general_utils import bgl_uniform_sampler, new_offscreen_fbo
+from .shader_utils import get_shader, get_batch
+
+WEATHER_MAP_SIZE = 1024
+# One period of the curl noise, the size of the noise texture it's made from.
+CURL_MAP_SIZE = 2048
+
+class WeatherMap:
+    # Large scale coverage of both cloud layers, rendered by
+    # stratus_weather.frag, and their curl noise warp, rendered by
+    # stratus_curl.frag. The cloud march looks them up once per step instead
+    # of running the curl noise octaves for every sample. A map is re-rendered
+    # when the properties it depends on change, see SkyState.weather_map_key
+    # and SkyState.curl_map_key.
+    #
+    # The coverage maps cover the whole layer, the coverage is smooth enough
+    # for that. The curl warp isn't, but it repeats with the noise texture, so
+    # its map holds one period at the texture's resolution.
+    #
+    # The maps are in the layer's own space, so rotating the layer doesn't
+    # change them.
+
+    def __init__(self):
+        self._maps = [new_offscreen_fbo(WEATHER_MAP_SIZE, WEATHER_MAP_SIZE) for layer in range(2)]
+        self._keys = [None, None]
+        # Both layers' warp in one map, to save a texture slot.
+        self._curl_map = new_offscreen_fbo(CURL_MAP_SIZE, CURL_MAP_SIZE)
+        self._curl_key = None
+
+    def __del__(self):
+        self.free()
+
+    def free(self):
+        for fbo in self._maps + [self._curl_map]:
+            if fbo is not None:
+                fbo.free()
+        self._maps = [None, None]
+        self._keys = [None, None]
+        self._curl_map = None
+        self._curl_key = None
+
+    def is_valid(self):
+        return all(self._maps) and bool(self._curl_map)
+
+    def _draw_layer(self, layer, state):
+        cloud = state.cloud_params(layer)
+
+        with self._maps[layer].bind():
+            gpu.state.depth_test_set('NONE')
+
+            _shader = get_shader("weather")
+            _shader.bind()
+
+            _shader.uniform_float("img_size", (WEATHER_MAP_SIZE, WEATHER_MAP_SIZE))
+
+            _shader.uniform_float("pos_offset", cloud["pos_offset"])
+            _shader.uniform_float("coverage_scale", cloud["coverage_scale"])
+            _shader.uniform_int("curl_octaves", cloud["curl_octaves"])
+            _shader.uniform_float("weather_extent", cloud["weather_extent"])
+
+            bgl_uniform_sampler(_shader, "noise_tex_2D_2048", globals.NOISE_TEXTURES[2], dim=2, wrap='REPEAT', filter='LINEAR', slot=0)
+
+            get_batch("weather").draw(_shader)
+
+    def _draw_curl(self, state):
+        with self._curl_map.bind():
+            gpu.state.depth_test_set('NONE')
+
+            _shader = get_shader("curl")
+            _shader.bind()
+
+            _shader.uniform_float("img_size", (CURL_MAP_SIZE, CURL_MAP_SIZE))
+
+            _shader.uniform_int("curl_octaves_0", state.cloud_params(0)["curl_octaves"])
+            _shader.uniform_int("curl_octaves_1", state.cloud_params(1)["curl_octaves"])
+
+            bgl_uniform_sampler(_shader, "noise_tex_2D_2048", globals.NOISE_TEXTURES[2], dim=2, wrap='REPEAT', filter='LINEAR', slot=0)
+
+            get_batch("curl").draw(_shader)
+
+    def update(self, state):
+        updated = False
+        for layer in range(2):
+            key = state.weather_map_key(layer)
+            if key != self._keys[layer]:
+                self._draw_layer(layer, state)
+                self._keys[layer] = key
+                updated = True
+
+        key = state.curl_map_key()
+        if key != self._curl_key:
+            self._draw_curl(state)
+            self._curl_key = key
+            updated = True
+        return updated
+
+    def get_texture(self, layer):
+        return self._maps[layer].color_texture
+
+    def get_curl_texture(self):
+        return self._curl_map.color_texture
+
+def update_weather_map(state):
+    # None if the maps couldn't be allocated.
+    if globals.WEATHER_MAP is None or not globals.WEATHER_MAP.is_valid():
+        globals.WEATHER_MAP = WeatherMap()
+        if not globals.WEATHER_MAP.is_valid():
+            print("STRATUS: error initializing the weather maps.")
+            return None
+
+    globals.WEATHER_MAP.update(state)
+    return globals.WEATHER_MAP
@@ -0,0 +1,255 @@
+# ------------------------------------------------------------------------- #
+#
+#    Copyright (C) 2023 Jake Kurtz
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------------- #
+
+# Writes the baked image straight from the readback buffer to OpenEXR or
+# Radiance HDR, without going through bpy.data.images and save_render.
+#
+# Pixels are a flat RGBA float buffer, bottom row first, like
+# texture_color.read() returns them. Both formats store the top row first, the
+# rows are flipped while encoding. The file is written block by block, so only
+# one block of encoded rows is held in memory at a time.
+#
+# The EXR writer only does single part files with the NONE, ZIPS and ZIP
+# codecs, can_write_directly tells if the settings are covered. Nothing in here
+# needs bpy.
+
+import os
+import time
+import zlib
+import struct
+import threading
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------------- EXR ----------------------------------- #
+
+EXR_MAGIC = 20000630
+EXR_VERSION = 2
+
+EXR_HALF = 1
+EXR_FLOAT = 2
+
+# codec: (compression id, scanlines per block)
+EXR_CODECS = {
+    'NONE': (0, 1),
+    'ZIPS': (2, 1),
+    'ZIP':  (3, 16),
+}
+
+EXR_ZIP_LEVEL = 4
+
+def can_write_directly(file_format, exr_codec):
+    if file_format == 'HDR':
+        return True
+    return file_format == 'OPEN_EXR' and exr_codec in EXR_CODECS
+
+def _exr_attribute(name, type_name, value):
+    return name.encode() + b'\0' + type_name.encode() + b'\0' + struct.pack('<i', len(value)) + value
+
+def _exr_header(width, height, channels, pixel_type, compression):
+    chlist = b''.join(name.encode() + b'\0' + struct.pack('<iB3xii', pixel_type, 0, 1, 1) for name in channels) + b'\0'
+    window = struct.pack('<iiii', 0, 0, width - 1, height - 1)
+
+    return b''.join((
+        struct.pack('<ii', EXR_MAGIC, EXR_VERSION),
+        _exr_attribute('channels', 'chlist', chlist),
+        _exr_attribute('compression', 'compression', struct.pack('<B', compression)),
+        _exr_attribute('dataWindow', 'box2i', window),
+        _exr_attribute('displayWindow', 'box2i', window),
+        _exr_attribute('lineOrder', 'lineOrder', struct.pack('<B', 0)),
+        _exr_attribute('pixelAspectRatio', 'float', struct.pack('<f', 1.0)),
+        _exr_attribute('screenWindowCenter', 'v2f', struct.pack('<ff', 0.0, 0.0)),
+        _exr_attribute('screenWindowWidth', 'float', struct.pack('<f', 1.0)),
+        b'\0'))
+
+def _exr_zip(data):
+    # Same as OpenEXR's zip compressor: split the bytes into even and odd
+    # halves, delta encode them, then deflate. Blocks that don't get smaller
+    # are stored as is, which readers recognize by the size.
+    raw = np.frombuffer(data, dtype=np.uint8)
+    interleaved = np.concatenate((raw[0::2], raw[1::2]))
+
+    predicted = interleaved.copy()
+    predicted[1:] = (interleaved[1:].astype(np.int16) - interleaved[:-1] + 128) & 0xff
+
+    compressed = zlib.compress(predicted.tobytes(), EXR_ZIP_LEVEL)
+    return compressed if len(compressed) < len(data) else data
+
+def write_exr(filepath, pixels, width, height, color_mode='RGBA', exr_codec='ZIP', half=False):
+    compression, block_lines = EXR_CODECS[exr_codec]
+
+    # Channels are stored in alphabetical order.
+    channels = ('A', 'B', 'G', 'R') if color_mode == 'RGBA' else ('B', 'G', 'R')
+    channel_index = [3, 2, 1, 0] if color_mode == 'RGBA' else [2, 1, 0]
+
+    pixel_type = EXR_HALF if half else EXR_FLOAT
+    dtype = np.dtype('<f2') if half else np.dtype('<f4')
+
+    image = np.asarray(pixels, dtype=np.float32).reshape(height, width, 4)
+
+    header = _exr_header(width, height, channels, pixel_type, compression)
+    nmb_of_blocks = -(-height // block_lines)
+    offsets = np.zeros(nmb_of_blocks, dtype='<u8')
+
+    with open(filepath, 'wb') as f:
+        f.write(header)
+        table_pos = f.tell()
+        f.write(offsets.tobytes())
+
+        for block in range(nmb_of_blocks):
+            y = block * block_lines
+            lines = min(block_lines, height - y)
+
+            # Rows y..y+lines from the top, i.e. flipped.
+            rows = image[height - y - lines:height - y][::-1]
+            data = rows[:, :, channel_index].transpose(0, 2, 1).astype(dtype).tobytes()
+
+            if compression != 0:
+                data = _exr_zip(data)
+
+            offsets[block] = f.tell()
+            f.write(struct.pack('<ii', y, len(data)))
+            f.write(data)
+
+        f.seek(table_pos)
+        f.write(offsets.tobytes())
+
+# ---------------------------------- HDR ----------------------------------- #
+
+HDR_BLOCK_LINES = 64
+
+def _rgbe(rgb):
+    # Shared exponent encoding, see Radiance's float2rgbe.
+    rgb = np.maximum(rgb, 0.0)
+    brightest = rgb.max(axis=-1)
+
+    mantissa, exponent = np.frexp(brightest)
+    valid = brightest > 1e-32
+    scale = np.where(valid, mantissa * 256.0 / np.where(valid, brightest, 1.0), 0.0)
+
+    rgbe = np.empty(rgb.shape[:-1] + (4,), dtype=np.uint8)
+    rgbe[..., :3] = np.minimum(rgb * scale[..., None], 255.0)
+    rgbe[..., 3] = np.where(valid, exponent + 128, 0)
+    return rgbe
+
+def write_hdr(filepath, pixels, width, height):
+    # Flat (not run length encoded) scanlines, any Radiance reader takes those.
+    image = np.asarray(pixels, dtype=np.float32).reshape(height, width, 4)
+
+    with open(filepath, 'wb') as f:
+        f.write(b'#?RADIANCE\nFORMAT=32-bit_rle_rgbe\n\n')
+        f.write(('-Y '+str(height)+' +X '+str(width)+'\n').encode())
+
+        for y in range(0, height, HDR_BLOCK_LINES):
+            lines = min(HDR_BLOCK_LINES, height - y)
+            rows = image[height - y - lines:height - y][::-1]
+            f.write(_rgbe(rows[:, :, :3]).tobytes())
+
+# ------------------------------------------------------------------------- #
+
+def write_image(filepath, pixels, width, height, file_format, color_mode, exr_codec, color_depth='32'):
+    if file_format == 'HDR':
+        write_hdr(filepath, pixels, width, height)
+    else:
+        write_exr(filepath, pixels, width, height, color_mode, exr_codec, half=(color_depth == '16'))
+
+# ------------------------------ Async writer ------------------------------ #
+
+class AsyncImageWriter:
+    # Encodes and writes frames on background threads, so the next frame can
+    # render while the last one is compressed. zlib and numpy release the GIL,
+    # the encoding runs in parallel with Blender's main thread.
+    #
+    # At most queue_depth frames are held at once, queued or being written.
+    # submit blocks until a slot frees up, which caps the memory a bake of
+    # large images can take.
+
+    def __init__(self, queue_depth=2, threads=None):
+        self._queue_depth = max(1, queue_depth)
+        self._slots = threading.Semaphore(self._queue_depth)
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads or self._queue_depth,
+            thread_name_prefix="STRATUS_WRITER")
+        self._futures = []
+        # Frames written before an error poll raised, returned by the next call.
+        self._results = []
+
+    def get_queue_depth(self):
+        return self._queue_depth
+
+    def submit(self, filepath, pixels, width, height, file_format, color_mode, exr_codec, color_depth='32', remove_file=None):
+        # pixels must not be changed by the caller afterwards, the writer
+        # holds on to them until the frame is written. Memmaps are kept as they
+        # are, the writers only read them a block at a time. remove_file is
+        # deleted once the frame is written, e.g. the memmap's file.
+        self._slots.acquire()
+        try:
+            if not isinstance(pixels, np.memmap):
+                pixels = np.asarray(pixels, dtype=np.float32)
+            future = self._executor.submit(self._write, filepath, pixels, width, height, file_format, color_mode, exr_codec, color_depth, remove_file)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._futures.append(future)
+
+    def _write(self, filepath, pixels, width, height, file_format, color_mode, exr_codec, color_depth, remove_file):
+        try:
+            start_time = time.perf_counter()
+            write_image(filepath, pixels, width, height, file_format, color_mode, exr_codec, color_depth)
+            return filepath, time.perf_counter() - start_time
+        finally:
+            if remove_file is not None:
+                del pixels
+                try:
+                    os.remove(remove_file)
+                except OSError:
+                    # Still mapped on Windows, it's left in the temp directory.
+                    pass
+            self._slots.release()
+
+    def pending(self):
+        return sum(1 for future in self._futures if not future.done())
+
+    def poll(self):
+        # Returns (filepath, seconds) of the frames written since the last
+        # call, raises the first error a write ran into. Every finished frame
+        # is collected before that, the ones written fine are returned by the
+        # next call.
+        done = [future for future in self._futures if future.done()]
+        self._futures = [future for future in self._futures if not future.done()]
+
+        error = None
+        for future in done:
+            if future.exception() is None:
+                self._results.append(future.result())
+            elif error is None:
+                error = future.exception()
+
+        if error is not None:
+            raise error
+
+        results = self._results
+        self._results = []
+        return results
+
+    def close(self, wait=True):
+        # Returns what poll would, for the frames still in flight.
+        self._executor.shutdown(wait=wait)
+        return self.poll() if wait else []
@@ -23,17 +23,20 @@ from bpy.app.handlers import persistent
 from .. import globals
 from .utils.env_img_utils import ENVImage
 from .utils.init_utils import init_shaders, init_textures, init_world_node_tree
-from .utils.general_utils import new_offscreen_fbo, refresh_viewers
-from .utils.draw_utils import draw_env_img, draw_irra_map, pre_draw_viewport, post_draw_viewport, update_viewport_offscreen
+from .utils.general_utils import refresh_viewers
+from .utils.fbo_pool import acquire_offscreen, release_offscreen
+from .utils.sky_state import get_sky_state
+from .utils.edit_scheduler import get_edit_scheduler
+from .utils.draw_utils import draw_env_img, draw_env_img_preview, draw_irra_map, pre_draw_viewport, post_draw_viewport, update_viewport_offscreen
 
 @persistent
 def post_frame_change_callback(scene):
     globals.LAST_FRAME = globals.CURRENT_FRAME
     globals.CURRENT_FRAME = scene.frame_current
 
-    if abs(globals.CURRENT_FRAME-globals.LAST_FRAME) == 0:
-        globals.DRAW_ENV_IMG = True
-        globals.RESET_ENV_IMG = True
+    # Keyframed and driven props change without calling update_prop, playback
+    # and scrubbing are debounced like any other edit.
+    get_edit_scheduler().notify(scene.render_props.env_img_update_delay)
 
 class STRATUS_OT_kill_viewport_editor(bpy.types.Operator):
     bl_idname = "stratus.kill_viewport_editor"
@@ -52,12 +55,28 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
     _viewport_texture = None
 
     _offscreen_viewport = None
+    _offscreen_history = None
     _offscreen_sky = None
     _offscreen_irra = None
 
     _scr_width = 0
     _scr_height = 0
 
+    _tex_width = 0
+    _tex_height = 0
+
+    _history_state = None
+    _history_dir_mat = None
+    _accum_frames = 0
+    _frame_index = 0
+
+    # What the offscreens were last drawn with, nothing is drawn again until
+    # it changes.
+    _drawn_state = None
+    _irra_state = None
+    _viewport_key = None
+    _accumulating = False
+
     _draw_handles = []
     _handle_post_frame = None
 
@@ -82,6 +101,7 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
             return
 
         prop = context.scene.render_props
+        state = get_sky_state(context.scene)
 
         overlay_enabled = context.area.spaces[0].overlay.show_overlays
 
@@ -97,10 +117,14 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
             globals.RESET_ENV_IMG = False
             self._frame_rendered = -1
 
-        if ((globals.DRAW_ENV_IMG and not globals.BAKE_ENV_IMG) or overlay_enabled):
-            draw_irra_map(self._offscreen_sky, self._offscreen_irra, 'VIEWPORT')
+        if ((globals.DRAW_ENV_IMG and not globals.BAKE_ENV_IMG) or overlay_enabled) and self._irra_state != state:
+            draw_irra_map(self._offscreen_sky, self._offscreen_irra, 'VIEWPORT', state)
+            self._irra_state = state
 
-        if globals.DRAW_ENV_IMG and not globals.BAKE_ENV_IMG:
+        if globals.DRAW_ENV_IMG and not globals.BAKE_ENV_IMG and self._env_img.in_preview():
+            draw_env_img_preview(self._env_img, irra_tex, 'VIEWPORT', state)
+            globals.REFRESH_VIEWPORT = True
+        elif globals.DRAW_ENV_IMG and not globals.BAKE_ENV_IMG:
             draw_env_img(self._env_img, irra_tex, 'VIEWPORT')
             
             if self._env_img.completed():
@@ -111,7 +135,10 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
                 self._frame_rendered = globals.CURRENT_FRAME
 
         if overlay_enabled:
-            pre_draw_viewport(self, context, irra_tex)
+            if pre_draw_viewport(self, context, irra_tex):
+                context.area.tag_redraw()
+
+        self._drawn_state = state
 
     @staticmethod
     def _handle_add(self, context):
@@ -146,7 +173,9 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
         return context.area.type == 'VIEW_3D'
 
     def modal(self, context, event):
-        if context.area:
+        # View changes redraw the area on their own, only sky changes and the
+        # env image need a nudge.
+        if context.area and (globals.DRAW_ENV_IMG or get_sky_state(context.scene) != self._drawn_state):
             context.area.tag_redraw()
 
         if globals.REFRESH_VIEWPORT:
@@ -172,6 +201,7 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
 
             self._env_img = ENVImage(globals.IMG_NAME)
             self._env_img.set_size(size)
+            self._env_img.enable_previews()
 
             # Initialize, if you havent already
             init_textures(self)
@@ -180,10 +210,10 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
 
             update_viewport_offscreen(self, context)
         
-            self._offscreen_sky = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
-            self._offscreen_irra = new_offscreen_fbo(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            self._offscreen_sky = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
+            self._offscreen_irra = acquire_offscreen(globals.IRRA_WIDTH, globals.IRRA_HEIGHT)
             
-            if not (self._offscreen_viewport and self._offscreen_sky and self._offscreen_irra):
+            if not (self._offscreen_viewport and self._offscreen_history and self._offscreen_sky and self._offscreen_irra):
                 self.report({'ERROR'}, "STRATUS: error initializing offscreen buffer. More details in the console")
                 return {'CANCELLED'}
 
@@ -199,9 +229,10 @@ class STRATUS_OT_viewport_editor(bpy.types.Operator):
     def clean_up(self, context):
         STRATUS_OT_viewport_editor._is_enabled = False
 
-        self._offscreen_viewport.free()
-        self._offscreen_sky.free()
-        self._offscreen_irra.free()
+        release_offscreen(self._offscreen_viewport)
+        release_offscreen(self._offscreen_history)
+        release_offscreen(self._offscreen_sky)
+        release_offscreen(self._offscreen_irra)
 
         if context.area:
             context.area.tag_redraw()
\ No newline at end of file
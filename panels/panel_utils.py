@@ -20,12 +20,15 @@
 import bpy
 
 from .. import globals
+from ..operators.utils.edit_scheduler import get_edit_scheduler
 
 def update_prop(self, context):
-    if not globals.EDITING_PROP:
-        globals.EDITING_PROP = True
-        globals.RESET_ENV_IMG = True
-        bpy.ops.stratus.prop_observer('INVOKE_DEFAULT')
+    globals.SKY_STATE_VERSION += 1
+    get_edit_scheduler().notify(context.scene.render_props.env_img_update_delay)
+
+def update_state(self, context):
+    # For settings that feed the shaders but shouldn't redraw the env image.
+    globals.SKY_STATE_VERSION += 1
 
 def update_env_img_size(self, context):
     globals.RESIZE_ENV_IMG = True
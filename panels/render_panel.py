@@ -31,7 +31,7 @@ from bpy.types import (Panel,
                        )
 
 from .. import globals
-from .panel_utils import update_env_img_size, update_env_img_strength
+from .panel_utils import update_env_img_size, update_env_img_strength, update_state
 from .main_panel import (STRATUS_PT_main, STRATUS_main_Properties)
 from ..operators.render import STRATUS_OT_render_animation
 from ..operators.bake import STRATUS_OT_bake_env_img
@@ -52,6 +52,18 @@ class STRATUS_RenderProperties(PropertyGroup):
         ('RGBA', 'RGBA', '', '', 1)
     ]
 
+    color_depths = [
+        ('16', "Float (Half)", '', '', 0),
+        ('32', "Float (Full)", '', '', 1)
+    ]
+
+    cloud_qualities = [
+        ('LOW', "Low", 'Coarse steps, stops early in dense cloud', '', 0),
+        ('MEDIUM', "Medium", 'Skips empty sky in large strides, finer steps near the camera', '', 1),
+        ('HIGH', "High", 'Smaller strides and steps, marches on through dense cloud', '', 2),
+        ('REFERENCE', "Reference", 'Evenly spaced steps across the whole cloud layer', '', 3),
+    ]
+
     color_spaces = [
         ('Filmic Log', 'Filmic Log', '', '', 0),
         ('Filmic sRGB', 'Filmic sRGB', '', '', 1),
@@ -92,8 +104,8 @@ class STRATUS_RenderProperties(PropertyGroup):
     ) 
 
     env_img_render_size: EnumProperty(
-        items=globals.ENV_IMG_SIZE,
-        description="(1024 x 512) * size",
+        items=globals.ENV_IMG_RENDER_SIZE,
+        description="(1024 x 512) * size. Sizes larger than the GPU's texture limit are baked a tile at a time into a temporary file",
         default="4",
         update=update_env_img_size
     )
@@ -105,25 +117,38 @@ class STRATUS_RenderProperties(PropertyGroup):
         update=update_env_img_size
     )
 
+    env_img_update_delay: FloatProperty(
+        name = "Update Delay",
+        description="Seconds without edits before the environment texture is drawn again",
+        subtype='TIME_ABSOLUTE',
+        default=0.1,
+        min=0.0,
+        soft_max=1.0
+    )
+
     enable_separate_steps_viewport: BoolProperty(
         name = "Use Separate Steps",
         description="",
         default = False,
+        update=update_state
     )
     enable_separate_light_steps_viewport: BoolProperty(
         name = "Use Separate Light Steps",
         description="",
         default = False,
+        update=update_state
     )
     enable_separate_steps_render: BoolProperty(
         name = "Use Separate Steps",
         description="",
         default = False,
+        update=update_state
     )
     enable_separate_light_steps_render: BoolProperty(
         name = "Use Separate Light Steps",
         description="",
         default = False,
+        update=update_state
     )
 
     max_steps_render: IntProperty(
@@ -131,21 +156,24 @@ class STRATUS_RenderProperties(PropertyGroup):
         description="Maximum number of steps before giving up.",
         default=300,
         min= 2,
-        max=5000
+        max=5000,
+        update=update_state
     )
     cld_0_max_steps_render: IntProperty(
         name = "Cirrius Steps",
         description="Maximum number of steps before giving up.",
         default=300,
         min= 2,
-        max=5000
+        max=5000,
+        update=update_state
     )
     cld_1_max_steps_render: IntProperty(
         name = "Cumulus Steps",
         description="Maximum number of steps before giving up.",
         default=300,
         min= 2,
-        max=5000
+        max=5000,
+        update=update_state
     )
 
     max_light_steps_render: IntProperty(
@@ -153,21 +181,24 @@ class STRATUS_RenderProperties(PropertyGroup):
         description="Maximum number of steps before giving up.",
         default=64,
         min= 2,
-        max=1000
+        max=1000,
+        update=update_state
     )
     cld_0_max_light_steps_render: IntProperty(
         name = "Cirrius Light Steps",
         description="Maximum number of steps before giving up.",
         default=64,
         min= 2,
-        max=1000
+        max=1000,
+        update=update_state
     )
     cld_1_max_light_steps_render: IntProperty(
         name = "Cumulus Light Steps",
         description="Maximum number of steps before giving up.",
         default=64,
         min= 2,
-        max=1000
+        max=1000,
+        update=update_state
     ) 
 
     max_steps_viewport: IntProperty(
@@ -175,21 +206,24 @@ class STRATUS_RenderProperties(PropertyGroup):
         description="Maximum number of steps before giving up.",
         default=150,
         min= 2,
-        max=5000
+        max=5000,
+        update=update_state
     )
     cld_0_max_steps_viewport: IntProperty(
         name = "Cirrius Steps",
         description="Maximum number of steps before giving up.",
         default=150,
         min= 2,
-        max=5000
+        max=5000,
+        update=update_state
     )
     cld_1_max_steps_viewport: IntProperty(
         name = "Cumulus Steps",
         description="Maximum number of steps before giving up.",
         default=150,
         min= 2,
-        max=5000
+        max=5000,
+        update=update_state
     )   
     
     max_light_steps_viewport: IntProperty(
@@ -197,34 +231,104 @@ class STRATUS_RenderProperties(PropertyGroup):
         description="Maximum number of steps before giving up.",
         default=16,
         min= 2,
-        max=1000
+        max=1000,
+        update=update_state
     )
     cld_0_max_light_steps_viewport: IntProperty(
         name = "Cirrius Light Steps",
         description="Maximum number of steps before giving up.",
         default=16,
         min= 2,
-        max=1000
+        max=1000,
+        update=update_state
     )
     cld_1_max_light_steps_viewport: IntProperty(
         name = "Cumulus Light Steps",
         description="Maximum number of steps before giving up.",
         default=16,
         min= 2,
-        max=1000
+        max=1000,
+        update=update_state
+    )
+
+    viewport_interleaves = [
+        ('1', "Off", 'Render every pixel on every redraw', '', 1),
+        ('2', "Checkerboard", 'Render half of the pixels per redraw, reproject the rest from the last one', '', 2),
+        ('4', "1/4", 'Render a quarter of the pixels per redraw, reproject the rest from the last one', '', 4),
+    ]
+
+    enable_viewport_accumulation: BoolProperty(
+        name = "Temporal Accumulation",
+        description="Blend each redraw with the previous ones, reprojected, so the viewport converges to a noise-free image while the view is still",
+        default = True,
+        update=update_state
+    )
+
+    viewport_interleave: EnumProperty(
+        name = "Interleave",
+        items=viewport_interleaves,
+        description="Part of the pixels rendered per redraw while accumulating",
+        default="2",
+        update=update_state
     )
 
     viewport_pixel_size: EnumProperty(
         name = "Pixel Size",
         items=pixel_size,
         description="Pixel size for viewport rendering.",
-        default="4"
+        default="4",
+        update=update_state
     )
 
     enable_bicubic: BoolProperty(
         name = "Use Bicubic Sampling",
         description="Preserves fine details when magnifying textures. Requires 8x more samples than bilinear sampling.",
         default = False,
+        update=update_state
+    )
+
+    cld_quality_viewport: EnumProperty(
+        name = "Cloud Quality",
+        items=cloud_qualities,
+        description="How the cloud march spends its steps",
+        default='MEDIUM',
+        update=update_state
+    )
+
+    cld_quality_render: EnumProperty(
+        name = "Cloud Quality",
+        items=cloud_qualities,
+        description="How the cloud march spends its steps",
+        default='HIGH',
+        update=update_state
+    )
+
+    enable_shadow_volume_viewport: BoolProperty(
+        name = "Cached Cloud Shadows",
+        description="Look up how much cloud is between each sample and the sun or moon in a low resolution volume, baked when the clouds or lights change, instead of marching towards the light at every sample. Much faster, the self-shadowing is softer.",
+        default = True,
+        update=update_state
+    )
+
+    enable_shadow_volume_render: BoolProperty(
+        name = "Cached Cloud Shadows",
+        description="Look up how much cloud is between each sample and the sun or moon in a low resolution volume, baked when the clouds or lights change, instead of marching towards the light at every sample. Much faster, the self-shadowing is softer.",
+        default = False,
+        update=update_state
+    )
+
+    enable_spectral_viewport: BoolProperty(
+        name = "Spectral Atmosphere",
+        description="Integrate the atmosphere over 21 wavelengths instead of 3 fitted RGB channels. Slower, and only differs noticeably with dense atmospheres or a low sun.",
+        default = False,
+        update=update_state
+    )
+
+    enable_spectral_render: BoolProperty(
+        name = "Spectral Atmosphere",
+        description="Integrate the atmosphere over 21 wavelengths instead of 3 fitted RGB channels. Slower, and only differs noticeably with dense atmospheres or a low sun.",
+        default = True,
+        update=update_state
     )
 
     enable_tiling: BoolProperty(
@@ -240,6 +344,17 @@ class STRATUS_RenderProperties(PropertyGroup):
         default="3"
     )
 
+    tile_time_budget: FloatProperty(
+        name = "Time Budget",
+        description="Time (ms) spent rendering tiles between redraws while baking. Higher values bake faster, lower values keep the interface responsive.",
+        min = 1.0,
+        soft_max = 250.0,
+        max = 2000.0,
+        default = 50.0,
+        precision = 0,
+        update=update_state
+    )
+
     file_path: StringProperty(
         subtype="FILE_PATH",
         default='/tmp\\'
@@ -273,6 +388,28 @@ class STRATUS_RenderProperties(PropertyGroup):
         default="RGBA"
     )
 
+    color_depth: EnumProperty(
+        name="Color Depth",
+        items=color_depths,
+        description="",
+        default="32"
+    )
+
+    use_disk_canvas: BoolProperty(
+        name="Keep Image On Disk",
+        description="Keep the baked image in a memory mapped temporary file instead of in memory. Slower, but needed for 16K and 24K images on machines with little memory.",
+        default=False
+    )
+
+    write_queue_depth: IntProperty(
+        name="Write Queue",
+        description="Frames that can be waiting to be written while the next one renders. Each holds a full image in memory, lower this for large images.",
+        min=1,
+        soft_max=8,
+        max=32,
+        default=2
+    )
+
     viewport_pinned: BoolProperty(
         default=False
     )
@@ -352,9 +489,15 @@ class STRATUS_PT_render_performance(Panel):
         layout.prop(prop, "enable_tiling")
         col_1 = layout.column()
         col_1.prop(prop, "render_tile_size", text="Tile Size")
+        col_1.prop(prop, "tile_time_budget")
         col_1.enabled = prop.enable_tiling
 
+        layout.prop(prop, "enable_spectral_render")
+        layout.prop(prop, "use_disk_canvas")
+
         layout.label(text="Steps")
+        layout.prop(prop, "cld_quality_render")
+        layout.prop(prop, "enable_shadow_volume_render")
 
         row = layout.row()
 
@@ -406,8 +549,13 @@ class STRATUS_PT_render_output(Panel):
                 col_row = layout.row(align=True)
                 col_row.label(text="Color")
                 col_row.prop(prop, "color_mode", expand=True)
+                depth_row = layout.row(align=True)
+                depth_row.label(text="Color Depth")
+                depth_row.prop(prop, "color_depth", expand=True)
             layout.prop(prop, "exr_codec")
 
+        layout.prop(prop, "write_queue_depth")
+
 class STRATUS_PT_viewport(Panel):
     bl_label = "Viewport"
     bl_category = "Stratus"
@@ -442,12 +590,19 @@ class STRATUS_PT_viewport(Panel):
         layout.separator()
 
         layout.prop(prop, "viewport_pixel_size")
+        layout.prop(prop, "enable_spectral_viewport")
+
+        layout.prop(prop, "enable_viewport_accumulation")
+        row = layout.row()
+        row.prop(prop, "viewport_interleave")
+        row.enabled = prop.enable_viewport_accumulation
 
         layout.separator()
 
         col = layout.column()
         col.label(text="Environment Texture Size")
         col.prop(prop, "env_img_viewport_size", text="")
+        col.prop(prop, "env_img_update_delay")
 class STRATUS_PT_viewport_steps(Panel):
     bl_parent_id = "STRATUS_PT_viewport"
     bl_label = "Steps"
@@ -460,6 +615,9 @@ class STRATUS_PT_viewport_steps(Panel):
         layout = self.layout
         prop = context.scene.render_props
 
+        layout.prop(prop, "cld_quality_viewport")
+        layout.prop(prop, "enable_shadow_volume_viewport")
+
         row = layout.row()
 
         sub_col = row.column()
@@ -0,0 +1,176 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* -------------------------------- Textures -------------------------------- */
+
+uniform sampler2D optical_depth_lut;
+
+#include "stratus_utility.glsl"
+
+/* ------------------------------- Atmosphere ------------------------------- */
+
+uniform int lut_mode; // 0: optical depth   1: sky view   2: aerial perspective
+
+uniform vec3 sun_dir;
+uniform vec3 moon_dir;
+
+uniform float altitude;
+
+uniform float rayleigh_density;
+uniform float mie_density;
+uniform float ozone_density;
+
+#include "stratus_atmo_constants.glsl"
+#include "stratus_atmosphere.glsl"
+#include "stratus_atmo_lut.glsl"
+#include "stratus_atmo_scatter.glsl"
+
+/* -------------------------------------------------------------------------- */
+/*                                    LUTs                                    */
+/* -------------------------------------------------------------------------- */
+
+const int quadrature_steps = 8;
+
+uniform float quadrature_nodes[8] = float[8] (
+    0.006811185292,
+    0.03614807107,
+    0.09004346519,
+    0.1706680068,
+    0.2818362161,
+    0.4303406404,
+    0.6296271457,
+    0.9145252695);
+
+uniform float quadrature_weights[8] = float[8] (
+    0.01750893642,
+    0.04135477391,
+    0.06678839063,
+    0.09507698807,
+    0.1283416365,
+    0.1707430204,
+    0.2327233347,
+    0.3562490486);
+
+vec3 ray_optical_depth(Ray ray)
+{
+    vec3 ray_end = atmosphere_intersection(ray, true);
+    float ray_length = distance(ray.pos, ray_end);
+
+    vec3 segment = ray_length * ray.dir;
+
+    vec3 optical_depth = vec3(0.0, 0.0, 0.0);
+
+    for (int i = 0; i < quadrature_steps; i++) {
+        vec3 pos = ray.pos + quadrature_nodes[i] * segment;
+
+        float height = get_height(pos);
+        vec3 density = vec3(density_rayleigh(height), density_mie(height), density_ozone(height));
+
+        optical_depth += density * quadrature_weights[i];
+    }
+    return optical_depth * ray_length;
+}
+
+/* Inverse of sky_view_lut_param, for a light at azimuth 0. */
+vec3 sky_view_lut_dir(vec2 x, vec3 light_dir)
+{
+    float horizon = horizon_elevation();
+
+    float elevation = (x.y >= 0.5) ? horizon + (0.5 * M_PI - horizon) * pow(2.0 * x.y - 1.0, 2.0)
+                                   : horizon - (0.5 * M_PI + horizon) * pow(1.0 - 2.0 * x.y, 2.0);
+
+    float light_azimuth = (length(light_dir.xy) > 1e-6) ? atan(light_dir.y, light_dir.x) : 0.0;
+    float azimuth = light_azimuth + x.x * M_PI;
+
+    return vec3(cos(elevation) * cos(azimuth), cos(elevation) * sin(azimuth), sin(elevation));
+}
+
+vec4 optical_depth_pass(vec2 texel)
+{
+    vec2 x = texel / (optical_depth_lut_size - 1.0);
+
+    float r = earth_radius + x.y * x.y * (atmosphere_radius - earth_radius);
+    float mu_h = horizon_mu(r);
+
+    float mu = (x.x >= 0.5) ? mu_h + (1.0 - mu_h) * pow(2.0 * x.x - 1.0, 2.0)
+                            : mu_h - (1.0 + mu_h) * pow(1.0 - 2.0 * x.x, 2.0);
+
+    Ray ray = Ray(vec3(0.0, 0.0, r), vec3(sqrt(max(1.0 - mu*mu, 0.0)), 0.0, mu));
+
+    return vec4(ray_optical_depth(ray), 1.0);
+}
+
+vec4 sky_view_pass(vec2 texel)
+{
+    vec2 region = floor(texel / sky_view_lut_size);
+    vec2 x = (texel - region * sky_view_lut_size) / (sky_view_lut_size - 1.0);
+
+    vec3 light_dir = (region.y < 0.5) ? sun_dir : moon_dir;
+
+    Ray ray;
+    ray.pos = vec3(0.0, 0.0, earth_radius + atmo_camera_offset);
+    ray.dir = sky_view_lut_dir(x, light_dir);
+
+    float ray_length = distance(ray.pos, atmosphere_intersection(ray));
+
+    vec3 rayleigh_color, mie_color;
+    atmo_raymarch(ray, light_dir, ray_length, rayleigh_color, mie_color);
+
+    return vec4((region.x < 0.5) ? rayleigh_color : mie_color, 1.0);
+}
+
+vec4 aerial_perspective_pass(vec2 texel)
+{
+    vec2 slice_size = aerial_perspective_lut_size.xy;
+
+    vec2 region = floor(texel / slice_size);
+    vec2 x = (texel - region * slice_size) / (slice_size - 1.0);
+
+    /* rows: sun rayleigh, sun mie, moon rayleigh, moon mie */
+    vec3 light_dir = (region.y < 1.5) ? sun_dir : moon_dir;
+    bool rayleigh = (mod(region.y, 2.0) < 0.5);
+
+    Ray ray;
+    ray.pos = vec3(0.0, 0.0, earth_radius + atmo_camera_offset);
+    ray.dir = sky_view_lut_dir(x, light_dir);
+
+    /* slices are spaced quadratically along the ray */
+    float w = (region.x + 1.0) / aerial_perspective_lut_size.z;
+    float ray_length = w * w * distance(ray.pos, atmosphere_intersection(ray));
+
+    vec3 rayleigh_color, mie_color;
+    atmo_raymarch(ray, light_dir, ray_length, rayleigh_color, mie_color);
+
+    return vec4(rayleigh ? rayleigh_color : mie_color, 1.0);
+}
+
+out vec4 fragColor;
+
+void main()
+{
+    vec2 texel = floor(gl_FragCoord.xy);
+
+    if (lut_mode == 0) {
+        fragColor = optical_depth_pass(texel);
+    } else if (lut_mode == 1) {
+        fragColor = sky_view_pass(texel);
+    } else {
+        fragColor = aerial_perspective_pass(texel);
+    }
+}
\ No newline at end of file
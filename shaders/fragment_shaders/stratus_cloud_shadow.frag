@@ -0,0 +1,75 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* Bakes the shadow volume of one cloud layer: the optical depth from points
+*  in the layer towards the sun (r) and the moon (g), marched the same way
+*  direct_light_sample does without a volume. See "Shadow Volume" in
+*  stratus_sky_render.glsl for the layout. */
+
+/* -------------------------------- Textures -------------------------------- */
+
+uniform sampler3D noise_tex_3D_64;
+uniform sampler3D noise_tex_3D_128;
+uniform sampler2D noise_tex_2D_2048;
+uniform sampler2D blue_noise;
+uniform sampler2D moon_albedo_tex;
+uniform sampler2D moon_normal_tex;
+uniform sampler2D irra_tex;
+uniform sampler2D optical_depth_lut;
+uniform sampler2D sky_view_lut;
+uniform sampler2D aerial_perspective_lut;
+
+#include "stratus_utility.glsl"
+#include "stratus_sky_params.glsl"
+#include "stratus_atmosphere.glsl"
+#include "stratus_sky_render.glsl"
+
+uniform int shadow_layer;
+
+out vec4 fragColor;
+
+float light_optical_depth(Cloud cloud, vec3 pos, Light light)
+{
+    Ray light_ray;
+    light_ray.pos = vec3(inverse(cloud.transform) * vec4(pos, 1.0));
+    light_ray.dir = light.dir;
+    return ray_optical_depth(cloud, light_ray);
+}
+
+void main()
+{
+    Cloud cloud = (shadow_layer == 0) ? cloud_0 : cloud_1;
+
+    /* Inverse of lut_region_uv, texel centers map to [0, 1]. */
+    vec2 slice_size = shadow_volume_size.xy;
+    float slice = floor(gl_FragCoord.x / slice_size.x);
+    vec2 x = (mod(gl_FragCoord.xy, slice_size) - 0.5) / (slice_size - 1.0);
+    float h_p = slice / (shadow_volume_size.z - 1.0);
+
+    /* Point on the layer's sphere at that height, in the layer's space. */
+    vec2 pos_xy = (2.0 * x - 1.0) * cloud.weather_extent;
+    float r = cloud.radius + h_p * cloud.shell_thickness;
+    vec3 pos = vec3(pos_xy, sqrt(max(r * r - dot(pos_xy, pos_xy), 0.0)));
+
+    fragColor = vec4(
+        light_optical_depth(cloud, pos, sun), 
+        light_optical_depth(cloud, pos, moon), 
+        0.0, 
+        1.0);
+}
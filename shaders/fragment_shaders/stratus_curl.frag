@@ -0,0 +1,52 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* One period of the curl noise warp of both cloud layers, see weather_utils.py.
+*  The warp tiles like the noise texture it's made from, so the map has the
+*  texture's resolution and the cloud march wraps around it at any distance.
+*
+*  rg: layer 0 warp, the offset from pos.xy to pos_curl.xy (m)
+*  ba: layer 1 warp */
+
+/* -------------------------------- Textures -------------------------------- */
+
+uniform sampler2D noise_tex_2D_2048;
+
+/* --------------------------------- Layers --------------------------------- */
+
+uniform vec2 img_size;
+
+uniform int curl_octaves_0;
+uniform int curl_octaves_1;
+
+#include "stratus_curl.glsl"
+
+/* -------------------------------------------------------------------------- */
+
+out vec4 fragColor;
+
+void main()
+{
+    vec2 pos = gl_FragCoord.xy / img_size;
+
+    vec2 warp_0 = curl_noise(pos, curl_octaves_0) * curl_strength;
+    vec2 warp_1 = curl_noise(pos, curl_octaves_1) * curl_strength;
+
+    fragColor = vec4(warp_0, warp_1);
+}
@@ -19,6 +19,8 @@
 
 out vec4 fragColor;
 
+/* The viewport at 1/pixel_size of the screen resolution, the alpha is the
+   cloud depth (see stratus_viewport.frag). */
 uniform sampler2D tex;
 
 uniform vec2 scr_size;
@@ -40,12 +42,39 @@ vec3 reinhard(vec3 x)
     return col;
 }
 
-void main() 
+/* Joint bilateral upsampling. The four texels around the pixel are weighted
+   bilinearly and by how close their cloud depth is to the nearest texel's,
+   so the clouds' edges against the sky stay sharp while the rest is
+   smoothly interpolated. */
+vec3 upsample(vec2 frag_coord)
 {
-    vec2 uv = gl_FragCoord.xy / scr_size;   
-    uv *= tex_size / scr_size;
+    vec2 p = frag_coord * tex_size / scr_size - 0.5;
+    ivec2 p0 = ivec2(floor(p));
+    vec2 f = p - vec2(p0);
+
+    ivec2 max_texel = ivec2(tex_size) - 1;
+    float ref_depth = texelFetch(tex, clamp(ivec2(floor(p + 0.5)), ivec2(0), max_texel), 0).a;
+
+    vec3 color = vec3(0.0);
+    float weight_sum = 0.0;
+    for (int i = 0; i < 4; i++)
+    {
+        ivec2 offset = ivec2(i & 1, i >> 1);
+        vec4 texel = texelFetch(tex, clamp(p0 + offset, ivec2(0), max_texel), 0);
+
+        vec2 w = mix(1.0 - f, f, vec2(offset));
+        float spatial_weight = w.x * w.y;
+        float depth_weight = 1.0 / (1e-3 + abs(texel.a - ref_depth) / max(ref_depth, 1.0));
 
-    vec3 tex_color = texture(tex, uv).rgb;
+        color += texel.rgb * spatial_weight * depth_weight;
+        weight_sum += spatial_weight * depth_weight;
+    }
+    return color / max(weight_sum, 1e-6);
+}
+
+void main() 
+{
+    vec3 tex_color = upsample(gl_FragCoord.xy);
 
     vec3 color = vec3(1.0) - exp(-tex_color * env_img_strength);
 
@@ -0,0 +1,58 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* Weather map of one cloud layer, see weather_utils.py. Covers the layer's
+*  local xy plane from -weather_extent to weather_extent.
+*
+*  r: large scale coverage, without coverage_intsty
+*
+*  The coverage noise is sampled far coarser than the map's texels, so it
+*  keeps its detail here. The curl warp doesn't and has its own map, see
+*  stratus_curl.frag. Only depends on the layer's position offset, coverage
+*  scale and curl octaves, so it's re-rendered when one of those changes. */
+
+/* -------------------------------- Textures -------------------------------- */
+
+uniform sampler2D noise_tex_2D_2048;
+
+/* --------------------------------- Layer ---------------------------------- */
+
+uniform vec2 img_size;
+
+uniform vec2 pos_offset;
+uniform float coverage_scale;
+uniform int curl_octaves;
+uniform float weather_extent;
+
+#include "stratus_curl.glsl"
+
+/* -------------------------------------------------------------------------- */
+
+out vec4 fragColor;
+
+void main()
+{
+    vec2 pos = (2.0 * gl_FragCoord.xy / img_size - 1.0) * weather_extent;
+
+    vec2 warp = curl_noise((pos + pos_offset) * coverage_scale * curl_scale, curl_octaves) * curl_strength;
+
+    float coverage_area = texture(noise_tex_2D_2048, (pos + warp + pos_offset) * 0.000001).y;
+
+    fragColor = vec4(coverage_area, 0.0, 0.0, 1.0);
+}
@@ -0,0 +1,98 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* Physical constants and spectral tables of the atmosphere, shared by every
+*  shader that models it, the lookup table writer included. */
+
+const float earth_radius = 6360e3;
+const float atmosphere_radius = 6420e3;
+const float mie_coeff = 21e-6;
+
+const float rayleigh_scale_height = 8.0e3;
+const float mie_scale_height = 1.2e3;
+
+const float atmo_camera_offset = 1000.0;
+
+const float mie_G = 0.75;
+
+const int num_wavelengths = 21;          
+const int min_wavelength = 380;
+const int max_wavelength = 780;
+
+const float step_lambda = (max_wavelength - min_wavelength) / (num_wavelengths - 1);
+
+// Sun irradiance on top of the atmosphere (W*m^-2*nm^-1)
+uniform float irradiance[21] = float[] (
+    1.45756829855592995315f, 1.56596305559738380175f, 1.65148449067670455293f,
+    1.71496242737209314555f, 1.75797983805020541226f, 1.78256407885924539336f,
+    1.79095108475838560302f, 1.78541550133410664714f, 1.76815554864306845317f,
+    1.74122069647250410362f, 1.70647127164943679389f, 1.66556087452739887134f,
+    1.61993437242451854274f, 1.57083597368892080581f, 1.51932335059305478886f,
+    1.46628494965214395407f, 1.41245852740172450623f, 1.35844961970384092709f,
+    1.30474913844739281998f, 1.25174963272610817455f, 1.19975998755420620867f);
+
+// Rayleigh scattering coefficient (m^-1) 
+uniform float rayleigh_coeff[21] = float[] (
+    0.00005424820087636473f, 0.00004418549866505454f, 0.00003635151910165377f,
+    0.00003017929012024763f, 0.00002526320226989157f, 0.00002130859310621843f,
+    0.00001809838025320633f, 0.00001547057129129042f, 0.00001330284977336850f,
+    0.00001150184784075764f, 0.00000999557429990163f, 0.00000872799973630707f,
+    0.00000765513700977967f, 0.00000674217203751443f, 0.00000596134125832052f,
+    0.00000529034598065810f, 0.00000471115687557433f, 0.00000420910481110487f,
+    0.00000377218381260133f, 0.00000339051255477280f, 0.00000305591531679811f);
+
+// Ozone absorption coefficient (m^-1) 
+uniform float ozone_coeff[21] = float[] (
+    0.00000000325126849861f, 0.00000000585395365047f, 0.00000001977191155085f,
+    0.00000007309568762914f, 0.00000020084561514287f, 0.00000040383958096161f,
+    0.00000063551335912363f, 0.00000096707041180970f, 0.00000154797400424410f,
+    0.00000209038647223331f, 0.00000246128056164565f, 0.00000273551299461512f,
+    0.00000215125863128643f, 0.00000159051840791988f, 0.00000112356197979857f,
+    0.00000073527551487574f, 0.00000046450130357806f, 0.00000033096079921048f,
+    0.00000022512612292678f, 0.00000014879129266490f, 0.00000016828623364192f);
+
+// CIE XYZ color matching functions
+uniform vec3 cmf_xyz[21] = vec3[](
+        vec3(0.00136800000f, 0.00003900000f, 0.00645000100f),
+        vec3(0.01431000000f, 0.00039600000f, 0.06785001000f),
+        vec3(0.13438000000f, 0.00400000000f, 0.64560000000f),
+        vec3(0.34828000000f, 0.02300000000f, 1.74706000000f),
+        vec3(0.29080000000f, 0.06000000000f, 1.66920000000f),
+        vec3(0.09564000000f, 0.13902000000f, 0.81295010000f),
+        vec3(0.00490000000f, 0.32300000000f, 0.27200000000f),
+        vec3(0.06327000000f, 0.71000000000f, 0.07824999000f),
+        vec3(0.29040000000f, 0.95400000000f, 0.02030000000f),
+        vec3(0.59450000000f, 0.99500000000f, 0.00390000000f),
+        vec3(0.91630000000f, 0.87000000000f, 0.00165000100f),
+        vec3(1.06220000000f, 0.63100000000f, 0.00080000000f),
+        vec3(0.85444990000f, 0.38100000000f, 0.00019000000f),
+        vec3(0.44790000000f, 0.17500000000f, 0.00002000000f),
+        vec3(0.16490000000f, 0.06100000000f, 0.00000000000f),
+        vec3(0.04677000000f, 0.01700000000f, 0.00000000000f),
+        vec3(0.01135916000f, 0.00410200000f, 0.00000000000f),
+        vec3(0.00289932700f, 0.00104700000f, 0.00000000000f),
+        vec3(0.00069007860f, 0.00024920000f, 0.00000000000f),
+        vec3(0.00016615050f, 0.00006000000f, 0.00000000000f),
+        vec3(0.00004150994f, 0.00001499000f, 0.00000000000f));
+
+const mat3 xyz_to_rgb = mat3(
+     3.2404542, -0.9692660,  0.0556434,
+    -1.5371385,  1.8760108, -0.2040259,
+    -0.4985314,  0.0415560,  1.0572252
+);
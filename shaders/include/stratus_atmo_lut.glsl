@@ -0,0 +1,96 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* ------------------------ Atmosphere Lookup Tables ------------------------ */
+
+/* The LUTs are rendered by stratus_atmo_lut.frag whenever the atmosphere or
+*  the light directions change (see lut_utils.py, the sizes must match). 
+*
+*  optical_depth_lut:       unscaled rayleigh/mie/ozone optical depth from a
+*                           point at radius r towards the atmosphere boundary,
+*                           indexed by (mu, r). The earth is ignored.
+*  sky_view_lut:            single-scattered light along a view ray from the
+*                           camera, without the phase functions. Indexed by the
+*                           azimuth to the light and the view elevation. Four
+*                           regions: (rayleigh, mie) x (sun, moon).
+*  aerial_perspective_lut:  same as the sky view, but only up to a fraction of
+*                           the ray length. Slices are laid out along x, the
+*                           (rayleigh, mie) x (sun, moon) rows along y.
+*
+*  Shaders including this declare the optical_depth_lut sampler. */
+
+const vec2 optical_depth_lut_size = vec2(256.0, 64.0);
+const vec2 sky_view_lut_size = vec2(192.0, 128.0);
+const vec3 aerial_perspective_lut_size = vec3(64.0, 64.0, 32.0);
+
+float horizon_mu(float r)
+{
+    return -sqrt(max(1.0 - (earth_radius*earth_radius) / (r*r), 0.0));
+}
+
+float horizon_elevation()
+{
+    return -acos(earth_radius / (earth_radius + atmo_camera_offset));
+}
+
+/* Both LUT parameters are non-linear, most texels go to the horizon where the
+*  optical depth and the in-scattering change the fastest. */
+vec2 optical_depth_lut_param(float r, float mu)
+{
+    r = clamp(r, earth_radius, atmosphere_radius);
+    float mu_h = horizon_mu(r);
+
+    float x_mu = (mu >= mu_h) ? 0.5 + 0.5 * sqrt(saturate((mu - mu_h) / (1.0 - mu_h)))
+                              : 0.5 - 0.5 * sqrt(saturate((mu_h - mu) / (1.0 + mu_h)));
+    float x_r = sqrt((r - earth_radius) / (atmosphere_radius - earth_radius));
+
+    return vec2(x_mu, x_r);
+}
+
+vec2 sky_view_lut_param(vec3 dir, vec3 light_dir)
+{
+    float elevation = asin(clamp(dir.z, -1.0, 1.0));
+    float horizon = horizon_elevation();
+    float l = elevation - horizon;
+
+    float x_elevation = (l >= 0.0) ? 0.5 + 0.5 * sqrt(saturate(l / (0.5 * M_PI - horizon)))
+                                   : 0.5 - 0.5 * sqrt(saturate(-l / (0.5 * M_PI + horizon)));
+
+    /* the in-scattering is symmetric about the light's vertical plane */
+    float azimuth = 0.0;
+    if (length(dir.xy) * length(light_dir.xy) > 1e-6) {
+        azimuth = abs(atan(dir.x * light_dir.y - dir.y * light_dir.x, dot(dir.xy, light_dir.xy)));
+    }
+
+    return vec2(azimuth * M_1_PI, x_elevation);
+}
+
+/* Maps a parameter in [0, 1] to the texel centers of a region in the LUT, so
+*  bilinear filtering never bleeds into the neighbouring region. */
+vec2 lut_region_uv(vec2 x, vec2 region_size, vec2 region_offset, vec2 lut_size)
+{
+    return (region_offset + saturate(x) * (region_size - 1.0) + 0.5) / lut_size;
+}
+
+vec3 lut_optical_depth(vec3 pos, vec3 dir)
+{
+    float r = length(pos);
+    vec2 x = optical_depth_lut_param(r, dot(pos / r, dir));
+    return texture(optical_depth_lut, lut_region_uv(x, optical_depth_lut_size, vec2(0.0), optical_depth_lut_size)).rgb;
+}
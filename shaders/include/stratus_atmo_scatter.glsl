@@ -0,0 +1,100 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* RGB approximation of the spectral path, see operators/utils/spectral.py.
+*  Columns are the channel weight, the rayleigh and the ozone extinction. */
+uniform bool use_spectral;
+uniform mat3 rgb_rayleigh_scatter;
+uniform mat3 rgb_mie_scatter;
+
+/* Single in-scattering along a ray through the atmosphere, split into the
+*  rayleigh and mie parts so the phase functions can be applied per pixel.
+*  Used by the lookup table writer and the irradiance map, the density scales
+*  are uniforms of those shaders. */
+void atmo_raymarch(Ray ray, vec3 light_dir, float ray_length, out vec3 rayleigh_color, out vec3 mie_color)
+{
+    float segment_length = ray_length / 64.0;
+
+    vec3 optical_depth = vec3(0.0, 0.0, 0.0);
+
+    /* zero out light accumulation */
+    float r_spectrum[num_wavelengths];
+    float m_spectrum[num_wavelengths];
+    for (int wl = 0; wl < num_wavelengths; wl++) {
+        r_spectrum[wl] = 0.0;
+        m_spectrum[wl] = 0.0;
+    }
+    vec3 rgb_rayleigh = vec3(0.0);
+    vec3 rgb_mie = vec3(0.0);
+
+    vec3 density_scale = vec3(rayleigh_density, mie_density, ozone_density);
+
+    vec3 pos = ray.pos; float march_dst = 0.0;
+    for (int i = 0; i < 64; i++)
+    {
+        pos = ray.pos + march_dst * ray.dir;
+
+        /* height above sea level */
+        float height = get_height(pos);
+
+        /* evaluate and accumulate optical depth along the ray */
+        vec3 density = density_scale * vec3(density_rayleigh(height),
+                                            density_mie(height),
+                                            density_ozone(height));
+
+        optical_depth += segment_length * density;
+
+        /* if the Earth isn't in the way, evaluate inscattering from the light */
+        Ray light_ray = Ray(pos, light_dir);
+        if (!surface_intersection(light_ray)) {
+            vec3 light_optical_depth = density_scale * lut_optical_depth(pos, light_dir);
+            vec3 total_optical_depth = optical_depth + light_optical_depth;
+
+            if (use_spectral) {
+                for (int wl = 0; wl < num_wavelengths; wl++) {
+
+                    vec3 extinction_density = total_optical_depth * vec3(rayleigh_coeff[wl],
+                                                                         mie_coeff,
+                                                                         ozone_coeff[wl]);
+
+                    float attenuation = exp(-reduce_add(extinction_density)) * irradiance[wl] * segment_length;
+
+                    r_spectrum[wl] += attenuation * density.x * rayleigh_coeff[wl];
+                    m_spectrum[wl] += attenuation * density.y * mie_coeff;
+                }
+            } else {
+                vec3 t = total_optical_depth;
+
+                vec3 r_attenuation = exp(-(t.x * rgb_rayleigh_scatter[1] + t.y * mie_coeff + t.z * rgb_rayleigh_scatter[2]));
+                vec3 m_attenuation = exp(-(t.x * rgb_mie_scatter[1] + t.y * mie_coeff + t.z * rgb_mie_scatter[2]));
+
+                rgb_rayleigh += r_attenuation * rgb_rayleigh_scatter[0] * density.x * segment_length;
+                rgb_mie += m_attenuation * rgb_mie_scatter[0] * density.y * mie_coeff * segment_length;
+            }
+        }
+        march_dst += segment_length;
+    }
+    if (use_spectral) {
+        rayleigh_color = spec_to_rgb(r_spectrum);
+        mie_color = spec_to_rgb(m_spectrum);
+    } else {
+        rayleigh_color = rgb_rayleigh;
+        mie_color = rgb_mie;
+    }
+}
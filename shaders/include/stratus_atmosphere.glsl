@@ -0,0 +1,143 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* -------------------------------------------------------------------------- */
+/*                                 ATMOSPHERE                                 */
+/* -------------------------------------------------------------------------- */
+
+vec3 spec_to_rgb(float spec[num_wavelengths])
+{
+    vec3 xyz = vec3(0.0, 0.0, 0.0);
+    for (int i = 0; i < num_wavelengths; i++) {
+        xyz.x += cmf_xyz[i].x * spec[i];
+        xyz.y += cmf_xyz[i].y * spec[i];
+        xyz.z += cmf_xyz[i].z * spec[i];
+    }
+    vec3 rgb = xyz_to_rgb * (xyz * step_lambda);
+    return rgb;
+}
+
+float get_height(vec3 p)
+{
+    float min_altitude = 0.0;
+    float max_altitude = atmosphere_radius-earth_radius;
+    return clamp((length(p) - atmo_camera_offset + altitude) - earth_radius, min_altitude, max_altitude);
+}
+
+/* ----------------------------- Phase Functions ---------------------------- */
+
+float phase_rayleigh(float mu)
+{
+    return M_3_16PI * (1.0 + (mu*mu));
+}
+
+float phase_mie(float mu, float G)
+{
+    float sqr_G = G*G;
+    return (3.0 * (1.0 - sqr_G) * (1.0 + (mu*mu))) / (8.0 * M_PI * (2.0 + sqr_G) * pow((1.0 + sqr_G - 2.0 * G * mu), 1.5));
+}
+
+float phase_hg(float mu, float G)
+{
+    float sqr_G = G*G;
+    return M_1_4PI  * ((1.0 - sqr_G) / pow(1.0 + sqr_G - 2.0 * G * mu, 1.5));
+}
+
+/* https://www.shadertoy.com/view/4sjBDG */
+float phase_mie_numerical(float mu)
+{
+    // This function was optimized to minimize (delta*delta)/reference in order to capture
+    // the low intensity behavior.
+    float bestParams[10];
+    bestParams[0]=9.805233e-06;
+    bestParams[1]=-6.500000e+01;
+    bestParams[2]=-5.500000e+01;
+    bestParams[3]=8.194068e-01;
+    bestParams[4]=1.388198e-01;
+    bestParams[5]=-8.370334e+01;
+    bestParams[6]=7.810083e+00;
+    bestParams[7]=2.054747e-03;
+    bestParams[8]=2.600563e-02;
+    bestParams[9]=-4.552125e-12;
+    
+    float p1 = mu + bestParams[3];
+    vec4 expValues = exp(vec4(bestParams[1] *mu+bestParams[2], bestParams[5] *p1*p1, bestParams[6] *mu, bestParams[9] *mu));
+    vec4 expValWeight= vec4(bestParams[0], bestParams[4], bestParams[7], bestParams[8]);
+    return dot(expValues, expValWeight) * 0.25;
+}
+
+/* ------------------------ Atmosphere volume models ------------------------ */
+
+float density_rayleigh(float height)
+{
+  return exp(-height / rayleigh_scale_height);
+}
+
+float density_mie(float height)
+{
+  return exp(-height / mie_scale_height);
+}
+
+float density_ozone(float height)
+{
+  float den = 0.0;
+  if (height >= 10000.0 && height < 25000.0) {
+    den = 1.0 / 15000.0 * height - 2.0 / 3.0;
+  }
+  else if (height >= 25000 && height < 40000) {
+    den = -(1.0 / 15000.0 * height - 8.0 / 3.0);
+  }
+  return den;
+}
+
+/* ------------------------- Atmosphere Intersection ------------------------ */
+
+bool surface_intersection(Ray ray)
+{
+    float t0, t1;
+
+    bool hit = sphere_intersect(ray, vec3(0.0), earth_radius, t0, t1);
+    bool front = (t0 >= 0 && t1 >= 0);
+
+    return (hit && front);
+}
+
+vec3 atmosphere_intersection(Ray ray, bool ignore_earth = false)
+{
+    
+    float t0, t1;
+	bool hit_atmosphere = sphere_intersect(ray, vec3(0.0), atmosphere_radius, t0, t1);
+
+    if (!ignore_earth) {
+        float s0, s1;
+        bool hit_earth = sphere_intersect(ray, vec3(0.0), earth_radius, s0, s1);
+
+        bool earth_front = (s0 > 0 && s1 > 0);
+
+        float t = 0.0;
+        if (hit_earth && earth_front) {
+            t = s0; 
+        } else {
+            t = t1;
+        }
+        return ray.pos + ray.dir * t;
+    } else {
+        return ray.pos + ray.dir * t1;
+    }
+}
@@ -0,0 +1,59 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* ------------------------------- Curl Noise ------------------------------- */
+
+/* Curl noise warp of the clouds' xy positions. Made from the REPEAT wrapped
+*  noise_tex_2D_2048, which the shader including this declares, so it tiles
+*  with a period of one in the noise coordinates. The layer's position is
+*  scaled into them by coverage_scale * curl_scale. */
+
+const float curl_scale = 0.75; // Just a "magic number" that looks good.
+const float curl_strength = 100000.0; // noise coordinates to meters
+
+float sample_curl_tex(vec2 p)
+{
+   return texture(noise_tex_2D_2048, p).b;
+   //return perlinfbm(vec3(p,0.), 2.0, 3);
+}
+
+vec2 curl(vec2 pos)
+{ 
+    pos *= 1.0;
+    vec2 e = vec2(0.15, 0);
+    
+    float p = sample_curl_tex(pos);
+    
+    float dx = (sample_curl_tex(pos + e.xy) - p) / (e.x);
+    float dy = (sample_curl_tex(pos + e.yx) - p) / (e.x);
+       
+   	return vec2(-dy, dx);
+}
+
+vec2 curl_noise(vec2 pos, int octaves)
+{
+    vec2 dir = vec2(0.70710678118); // norm(vec2(1.))
+	for (int i = 0; i < octaves; i++)
+	{
+		vec2 new_pos = curl(pos) * .00625;
+		pos += new_pos;
+        dir += new_pos;
+	}
+    return dir;
+}
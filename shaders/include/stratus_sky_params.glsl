@@ -0,0 +1,197 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* ------------------------------- Atmosphere ------------------------------- */
+
+/* The shader cache compiles variants with the feature switches defined,
+   disabled features are then compiled out instead of branched over. */
+#ifdef ENABLE_ATM
+const bool enable_atm = ENABLE_ATM;
+#else
+uniform bool enable_atm;
+#endif
+#ifdef ENABLE_MOON
+const bool enable_moon = ENABLE_MOON;
+#else
+uniform bool enable_moon;
+#endif
+#ifdef ENABLE_SUN
+const bool enable_sun = ENABLE_SUN;
+#else
+uniform bool enable_sun;
+#endif
+
+uniform bool enable_moon_as_light;
+uniform bool enable_sun_as_light;
+
+#include "stratus_atmo_constants.glsl"
+uniform mat4 moon_face_rot_mat;
+
+#ifdef ENABLE_STARS
+const bool enable_stars = ENABLE_STARS;
+#else
+uniform bool enable_stars;
+#endif
+uniform bool enable_pole_visualizer;
+
+uniform vec3 pole_dir;
+
+#define MAX_RADIATION 2e31
+
+#define LIGHT_YEAR 9.4607e+15 // One light year in meters.
+#define STELLAR_RADIUS 6.957e+8 // Radius of the sun in meters.
+#define SIGMA 5.670367e-8 // Stefan-Boltzmann constant.
+
+#define RATIO 3.066257e-22       // (STELLAR_RADIUS^2 * SIGMA) / LIGHT_YEAR^2
+/* --------------------------------- Clouds --------------------------------- */
+
+#ifdef ENABLE_CLD_0
+const bool enable_cld_0 = ENABLE_CLD_0;
+#else
+uniform bool enable_cld_0;
+#endif
+#ifdef ENABLE_CLD_1
+const bool enable_cld_1 = ENABLE_CLD_1;
+#else
+uniform bool enable_cld_1;
+#endif
+
+/*
+*   cloud domain height at zenith (m): h
+*   cloud domain horizon view distance (m): d
+*   cloud domain radius (m): r
+*   cloud domain center (m): c
+*
+*   r = (2d)^2 / (8h) + h/2
+*   c = <0, 0, h - r>
+*/
+
+uniform int cld_max_steps;
+uniform int cld_max_light_steps;
+
+uniform float cld_G;
+
+//const float cld_top_roundness = 0.05;
+//const float cld_btm_roundness = 0.40;
+
+const float cld_top_density = 1.0;
+//const float cld_btm_density = 0.45;
+
+uniform bool enable_bicubic;
+
+struct Cloud {
+    float   top_roundness;
+    float   btm_roundness;
+
+    float   radius;
+    float   density;
+    float   density_height;
+    float   thickness;
+    float   shell_thickness;
+
+    vec3    sigma_s;
+    vec3    sigma_t;
+
+    float   ap_intsty;
+    float   ambient_intsty;
+
+    float   atten;
+    float   contr;
+    float   eccen;
+
+    float   coverage_shape;
+    float   shape_shape;
+    float   detail_shape;
+
+    float   shape_inverse;
+    float   detail_inverse;
+
+    float   coverage_scale;
+    float   shape_scale;
+    float   detail_scale;
+
+    int     curl_octaves;
+
+    float   coverage_intsty;
+    float   shape_intsty;
+    float   detail_intsty;
+
+    vec2    pos_offset;
+
+    vec2    coverage_offset;
+    vec2    shape_offset;
+    vec2    detail_offset;
+
+    mat4    transform;
+
+    int     max_steps;
+    int     max_light_steps;
+
+    int     layer; // 0: Cirrus     1: Cumulus 
+
+    float   weather_extent; // half the width of the weather map (m)
+};
+
+/* Everything derived from the PropertyGroups lives in one std140 block that
+*  is packed once per scene state on the CPU (see ubo_utils.py). The member
+*  order here must match the packing order there. */
+layout(std140) uniform sky_params
+{
+    Cloud   cloud_0;
+    Cloud   cloud_1;
+
+    Light   sun;
+    Light   moon;
+
+    mat4    moon_rot_mat;
+    mat4    stars_rot_mat;
+
+    vec3    cld_domain_center;
+    float   altitude;
+
+    vec3    moon_phase_dir;
+    float   moon_ambient_intsty;
+
+    float   rayleigh_density;
+    float   mie_density;
+    float   ozone_density;
+
+    float   sun_half_angular;
+    float   moon_half_angular;
+
+    float   stars_intsty;
+
+    /* RGB approximation of the direct light, see spectral.py */
+    vec3    rgb_irradiance;
+    int     use_spectral;
+    vec3    rgb_rayleigh_coeff;
+};
+
+#ifndef USE_SPECTRAL
+#define USE_SPECTRAL (use_spectral != 0)
+#endif
+
+//uniform float scale_0;
+//uniform float scale_1;
+//uniform float scale_2;
+//uniform float scale_3;
+
+//uniform vec3 sigma_s;
+//const vec3 sigma_a = vec3(0.0);
+//const vec3 sigma_t = max(sigma_s + sigma_a, vec3(0.000000001));
@@ -0,0 +1,949 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* Everything the baked image and the viewport share: the lookup tables, the
+*  atmosphere, sun, moon, stars and the cloud march. Only the way the view
+*  ray is set up differs between the two.
+*
+*  FRAG_COORD is the pixel being shaded in image coordinates, shaders that
+*  render part of the image define it before including this. */
+
+#ifndef FRAG_COORD
+#define FRAG_COORD gl_FragCoord.xy
+#endif
+
+
+#include "stratus_atmo_lut.glsl"
+
+/* ----------------------------- Atmosphere Main ---------------------------- */
+
+vec4 atmo_sky_view(Ray ray, Light light, int light_id)
+{
+    vec2 x = sky_view_lut_param(ray.dir, light.dir);
+    vec2 lut_size = 2.0 * sky_view_lut_size;
+
+    vec3 rayleigh_color = texture(sky_view_lut, lut_region_uv(x, sky_view_lut_size, vec2(0.0, light_id) * sky_view_lut_size, lut_size)).rgb;
+    vec3 mie_color = texture(sky_view_lut, lut_region_uv(x, sky_view_lut_size, vec2(1.0, light_id) * sky_view_lut_size, lut_size)).rgb;
+
+    float mu = dot(ray.dir, light.dir);
+    return vec4(phase_rayleigh(mu) * rayleigh_color + phase_mie(mu, mie_G) * mie_color, 1.0);
+}
+
+vec3 aerial_perspective_slice(vec2 x, float slice, float row)
+{
+    vec2 slice_size = aerial_perspective_lut_size.xy;
+    vec2 lut_size = vec2(aerial_perspective_lut_size.z, 4.0) * slice_size;
+    return texture(aerial_perspective_lut, lut_region_uv(x, slice_size, vec2(slice, row) * slice_size, lut_size)).rgb;
+}
+
+vec3 aerial_perspective_sample(vec2 x, float w, float row)
+{
+    /* slice i holds the in-scattering up to w = i + 1, at w = 0 there is none */
+    float s = w - 1.0;
+    if (s < 0.0) {
+        return aerial_perspective_slice(x, 0.0, row) * w;
+    }
+
+    float last_slice = aerial_perspective_lut_size.z - 1.0;
+    float s0 = min(floor(s), last_slice);
+    float s1 = min(s0 + 1.0, last_slice);
+    return mix(aerial_perspective_slice(x, s0, row), aerial_perspective_slice(x, s1, row), s - s0);
+}
+
+vec4 atmo_aerial_perspective(Ray ray, Light light, int light_id, vec3 ray_end)
+{
+    float ray_length = distance(ray.pos, atmosphere_intersection(ray));
+    float w = sqrt(saturate(distance(ray.pos, ray_end) / ray_length)) * aerial_perspective_lut_size.z;
+
+    vec2 x = sky_view_lut_param(ray.dir, light.dir);
+    float row = float(2 * light_id);
+
+    vec3 rayleigh_color = aerial_perspective_sample(x, w, row);
+    vec3 mie_color = aerial_perspective_sample(x, w, row + 1.0);
+
+    float mu = dot(ray.dir, light.dir);
+    return vec4(phase_rayleigh(mu) * rayleigh_color + phase_mie(mu, mie_G) * mie_color, 1.0);
+}
+
+vec3 sun_radiation(Ray ray, float solid_angle, bool ignore_earth = false)
+{
+    bool hit_surface = false;
+    if (!ignore_earth) {
+        hit_surface = surface_intersection(ray);
+    }
+
+    if (!hit_surface) {
+        vec3 optical_depth = lut_optical_depth(ray.pos, ray.dir);
+
+        if (!USE_SPECTRAL) {
+            vec3 transmittance = rgb_rayleigh_coeff * optical_depth.x * rayleigh_density +
+                                    1.11f * mie_coeff * optical_depth.y * mie_density;
+            return rgb_irradiance * exp(-transmittance) / solid_angle;
+        }
+
+        float r_spectrum[num_wavelengths];
+        for (int wl = 0; wl < num_wavelengths; wl++) {
+            r_spectrum[wl] = 0.0;
+        }
+
+        /* compute final spectrum */
+        for (int i = 0; i < num_wavelengths; i++) {
+            /* combine spectra and the optical depth into transmittance */
+            float transmittance = rayleigh_coeff[i] * optical_depth.x * rayleigh_density +
+                                    1.11f * mie_coeff * optical_depth.y * mie_density;
+            r_spectrum[i] = irradiance[i] * exp(-transmittance) / solid_angle;
+        }
+
+        return spec_to_rgb(r_spectrum);
+    } else {
+        return vec3(0.0);
+    }
+}
+/* ---------------------------- Celestial Objects --------------------------- */
+
+const float moon_dist = 500.0;
+
+bool hit_moon(vec3 dir)
+{
+    Ray ray = Ray(vec3(0.0), dir);
+
+    vec3 moon_pos = moon.dir * moon_dist;
+
+    float moon_solid_angle = M_2PI * (1.0 - cos(moon_half_angular * 1.05));
+    float moon_radius = sqrt(moon_solid_angle * moon_dist*moon_dist * M_1_PI);
+
+    //float moon_radius = (moon_half_angular * 1.05) * moon_dist;
+
+    float t0, t1;
+    return sphere_intersect(ray, moon_pos, moon_radius, t0, t1);
+}
+
+vec4 draw_moon(Ray ray) 
+{
+    vec3 color = vec3(0.0);
+    float opacity = 0.0;
+
+    if (surface_intersection(ray)) return vec4(color, opacity);
+
+    Ray moon_ray = Ray(vec3(0.0), ray.dir);
+
+    vec3 moon_pos = moon.dir * moon_dist;
+
+    float moon_solid_angle = M_2PI * (1.0 - cos(moon_half_angular));
+    float moon_radius = sqrt(moon_solid_angle * moon_dist*moon_dist * M_1_PI);
+
+    float t0, t1;
+    if (sphere_intersect(moon_ray, moon_pos, moon_radius, t0, t1)) 
+    {
+        vec3 sphere_pos = moon_ray.pos + moon_ray.dir * t0;
+        vec3 sphere_norm = normalize(sphere_pos-moon_pos);
+
+        vec3 sp = normalize(vec3(moon_rot_mat * vec4(sphere_norm, 0.0)));
+        vec2 uv = sample_spherical_map(sp);
+
+        vec3 norm = texture(moon_normal_tex, uv).rgb;
+        norm = (norm * 2.0 - 1.0);
+
+        vec3 T = normalize(tangent(sp));
+        vec3 B = normalize(cross(sp, T));
+
+        mat3 TBN = mat3(T,B,sp);
+        norm = TBN*norm;
+
+        vec3 L = min(sun_radiation(ray, moon_solid_angle) * 0.000025 * moon.intsty, MAX_RADIATION);
+
+        vec3 trans_moon_phase_dir = normalize(vec3(moon_rot_mat * vec4(moon_phase_dir, 0.0)));
+
+        float diff = max(dot(trans_moon_phase_dir, norm), 0.0);
+        color = (L * (diff + moon_ambient_intsty) * texture(moon_albedo_tex, uv).rgb);
+        opacity = 1.0;
+    }
+
+    return vec4(color, opacity);
+}
+
+vec4 draw_sun(Ray ray) 
+{
+  vec3 color = vec3(0.0);
+  float opacity = 0.0;
+
+  if (surface_intersection(ray)) return vec4(color, opacity);
+
+  float min_cos_theta = cos(sun_half_angular);
+
+  float cos_theta = dot(ray.dir, sun.dir);
+  if (cos_theta >= min_cos_theta) {
+    color = vec3(1.0);
+    opacity = 1.0;
+  } else {
+    float offset = min_cos_theta - cos_theta;
+    float scale_factor = 3000.0 / (sun_half_angular*2.0);
+    float gaussian_bloom = exp(-offset*scale_factor);
+    color = vec3(gaussian_bloom);
+    opacity = gaussian_bloom;
+  }
+
+  if (length(color) > 0.00001) {
+    float sun_solid_angle = M_2PI * (1.0 - cos(sun_half_angular));
+    vec3 L = min(sun_radiation(ray, sun_solid_angle) * sun.intsty, MAX_RADIATION);
+    color.rgb *= L;
+  }
+
+  return vec4(color, opacity);
+}
+
+vec3 star_color(float temp) {
+  float pt = pow(temp,-1.5)*1e5,
+        lt = log(temp);
+  return clamp(vec3(
+    561. * pt + 148.,
+    temp > 6500. ? 352. * pt + 184. : 100.04 * lt - 623.6,
+    194.18 * lt - 1448.6)/255., 0., 1.);
+}
+
+vec4 draw_stars(Ray ray) 
+{
+  vec3 L = vec3(0.0);
+  float opacity = 0.0;
+
+  if (surface_intersection(ray)) return vec4(L, opacity);
+
+  vec3 rd = normalize(vec3(stars_rot_mat * vec4(ray.dir, 0.0)));
+
+  /* ------------------------------- Blue Stars ------------------------------- */
+  {
+    vec4 n = worley(rd*150.);
+    
+    float t = mix(8000.0, 10000.0, n.y); // Absolute Temperature (K)
+    float d = mix(1.0, 50., n.z);        // Light Years (m)
+    float r = mix(1.0, 50.0, n.w);      // Stellar Radius (m)
+
+    // radiant_flux = 4pi * sigma * t^4 * r^2 (W)
+    // radiant_intensity = radiant_flux / (4pi * d^2) (W * sr^-1)
+
+    float I = (t*t*t*t) * (r*r) * RATIO / (d*d);
+    L += vec3(exp(-n.x * mix(20., 40., n.y))) * star_color(t) * I;
+    opacity = exp(-n.x * mix(20., 40., n.y));
+  }
+
+  /* -------------------------------- Red Stars ------------------------------- */
+  {
+    vec4 n = worley(rd*150.);
+    
+    float t = mix(2000.0, 6000.0, n.y);
+    float d = mix(1.0, 10., n.z);
+    float r = mix(1000.0, 1800.0, n.w);
+
+    float I = (t*t*t*t) * (r*r) * RATIO / (d*d);
+    L += vec3(exp(-n.x * mix(20., 35., n.y))) * star_color(t) * I;
+    opacity = exp(-n.x * mix(20., 40., n.y));
+  }
+
+  if (ray.dir.z < 0.0) {
+      opacity = 0.0;
+  }
+
+  return vec4(L * stars_intsty, opacity);
+}
+
+vec4 draw_pole_visualizer(Ray ray)
+{
+  vec4 color = vec4(0.0);
+  float min_cos_theta = cos(0.00872665);
+
+  float cos_theta_0 = dot(ray.dir, pole_dir);
+  float cos_theta_1 = dot(ray.dir, -pole_dir);
+  if (cos_theta_0 >= min_cos_theta || cos_theta_1 >= min_cos_theta) {
+      color = vec4(1.0,0.0,0.0,1.0);
+  }
+
+  return color;
+}
+/* -------------------------------------------------------------------------- */
+/*                                   CLOUDS                                   */
+/* -------------------------------------------------------------------------- */
+
+/* Per layer weather maps, rendered by stratus_weather.frag. */
+uniform sampler2D weather_map_0;
+uniform sampler2D weather_map_1;
+
+/* One period of both layers' curl warp, rendered by stratus_curl.frag. */
+uniform sampler2D curl_map;
+
+#include "stratus_curl.glsl"
+
+/* Large scale coverage at pos, in the layer's local space. */
+float sample_weather_map(Cloud cloud, vec3 pos)
+{
+    vec2 uv = pos.xy / (2.0 * cloud.weather_extent) + 0.5;
+    return (cloud.layer == 0) ? texture(weather_map_0, uv).r : texture(weather_map_1, uv).r;
+}
+
+/* Curl noise warp of pos.xy (m), the curl map repeats. */
+vec2 sample_curl_map(Cloud cloud, vec3 pos)
+{
+    vec2 uv = (pos.xy + cloud.pos_offset) * cloud.coverage_scale * curl_scale;
+    vec4 warp = texture(curl_map, uv);
+    return (cloud.layer == 0) ? warp.xy : warp.zw;
+}
+
+float sample_blue_noise()
+{
+    vec2 uv = FRAG_COORD / img_size.xy;
+    return 2.0 * texture(blue_noise, uv*128.0).r - 1.0;
+}
+
+void shell_intersection(Ray ray, vec3 center, float radius_inner, float radius_outer, out float t_start, out float t_end) 
+{
+    t_start = 0.0;
+    t_end = 0.0;
+
+    float t0, t1;
+    bool hit_outer = sphere_intersect(ray, center, radius_outer, t0, t1);
+
+    float s0, s1;
+    bool hit_inner = sphere_intersect(ray, center, radius_inner, s0, s1);
+
+    t_start = (hit_inner) ? s1 : 0.0;
+    t_end = (hit_outer) ? t1 : 0.0;
+}
+
+/* The 2D part of cld_sample: the weather map and coverage lookups and the
+*  shape-height function. Cheap next to the 3D noise, the coarse march only
+*  runs this. */
+float cld_coverage_sample( 
+    Cloud cloud,
+    vec3 pos,
+    float cld_shell,
+    out vec3 pos_curl,
+    out float CN,
+    out float coverage_area,
+    out float SA,
+    out float h_p)
+{
+    h_p = saturate(clamp(length(pos) - cloud.radius, 0.0, cloud.shell_thickness) / (cloud.shell_thickness));
+
+    float weather = sample_weather_map(cloud, pos);
+    pos_curl = pos + vec3(sample_curl_map(cloud, pos), 0.0);
+
+    vec2 c_sp = (pos_curl.xy + cloud.pos_offset + cloud.coverage_offset) * cloud.coverage_scale;
+    vec4 cns = texture(noise_tex_2D_2048, c_sp);
+
+    coverage_area = weather * cloud.coverage_intsty;
+    CN = mix(cns.x, cns.y, cloud.coverage_shape);
+    float wh = CN * cloud.thickness;
+
+    /* ------------------------- Shape-Height Functions ------------------------- */
+
+    float SR_t = saturate(1.0 - pow(h_p, (wh - h_p) / (wh - wh*cloud.top_roundness)));
+    float SR_b = saturate(1.0 - (pow(1.0 - h_p, 1.0 / cloud.btm_roundness)));
+    SA = SR_t * SR_b;
+
+    /* -------------------------------------------------------------------------- */
+
+    /* Positive means no cloud at pos, whatever the shape and detail noise do. */
+    float cld_coverage = remap(CN * coverage_area * SA * 1.33, 0.0, 1.0, -1.0, 1.0);
+    return sdf_op_sub(cld_coverage, cld_shell);
+}
+
+bool cld_sample( 
+    Cloud cloud,
+    vec3 pos,
+    out float ds, 
+    out float dist, 
+    out float h_p) 
+{
+    float inner_shell = sdf_sphere(pos, cloud.radius);
+    float outer_shell = sdf_sphere(pos, cloud.radius + cloud.shell_thickness);
+    float cld_shell = sdf_op_sub(inner_shell, outer_shell);
+
+    ds = 0.0;
+    dist = 0.0;
+    h_p = 0.0;
+
+    bool hit = false;
+
+    if (cld_shell < 0.0) 
+    {
+        vec3 pos_curl;
+        float CN, coverage_area, SA;
+        float _cld_shell = cld_coverage_sample(cloud, pos, cld_shell, pos_curl, CN, coverage_area, SA, h_p);
+
+        /* -------------------------- Sample Noise Textures ------------------------- */
+
+        vec3 s_sp = (pos_curl + vec3(cloud.pos_offset + cloud.coverage_offset + cloud.shape_offset, 0.0)) * cloud.shape_scale;
+        vec4 sns = texture(noise_tex_3D_128, s_sp);
+        
+        vec3 d_sp = (pos + vec3(cloud.pos_offset + cloud.coverage_offset + cloud.detail_offset, 0.0)) * cloud.detail_scale;
+        vec4 dns = texture(noise_tex_3D_64, d_sp);
+
+        /* ------------------------ Density-Height Functions ------------------------ */
+
+        float DR_t = 1.0;
+        float DR_b = saturate(pow(h_p, 1.0 / (1.0 - cloud.density_height)));
+        float DA = DR_t * DR_b;
+
+        /* -------------------------------------------------------------------------- */
+
+        float cld_coverage;
+
+        if (_cld_shell < 0.0) 
+        {
+            float tst_0 = 1.0;  float tst_1 = 1.0;
+            float SN    = 1.0;  float DN    = 1.0;
+
+            if (cloud.layer == 0) 
+            {
+                float c = clamp(1.66667*cloud.shape_intsty, 0.0, 1.0);
+                float d = clamp(1.66667*cloud.detail_intsty, 0.0, 1.0);
+
+                tst_0 = mix(1.0, mix(.8, .7, cloud.shape_inverse), c);
+
+                float a = mix(0.9, 0.6, cloud.detail_shape);
+                float b = mix(0.7, 0.75, cloud.detail_shape);
+                tst_1 = mix(1.0, mix(a, b, cloud.detail_inverse), d);
+
+                SN = mix(mix(1.0-sns.r, sns.r, cloud.shape_inverse), mix(1.0-sns.g, sns.g, cloud.shape_inverse), cloud.shape_shape);
+                DN = mix(mix(1.0-dns.r, dns.r, cloud.detail_inverse), mix(1.0-dns.a, dns.a, cloud.detail_inverse), cloud.detail_shape);
+            } 
+            else if (cloud.layer == 1) 
+            {
+                float h1 = 7.0;
+                float h2 = 4.0;
+                
+                tst_0 = mix(1.0, mix(.35, .35, saturate(h_p * h1)), cloud.shape_intsty);
+                tst_1 = mix(1.0, mix(0.4, 0.12, saturate(h_p * h2)), cloud.detail_intsty);
+
+                float SN_t = sns.r;
+                float SN_b = 1.0 - sns.g;
+                SN = mix(SN_b, SN_t, saturate(h_p * h1));
+
+                float DN_t = dns.r;
+                float DN_b = 1.0 - dns.a;
+                DN = mix(DN_b, DN_t, saturate(h_p * h2));
+            }
+
+            float cld_shape = SN * -abs(cloud.shape_intsty) * tst_1;
+            float cld_detail = DN * -abs(cloud.detail_intsty);
+
+            cld_coverage = remap(CN * coverage_area * SA * tst_0 * tst_1, 0.0, 1.0, -1.0, 1.0);
+            cld_shell = sdf_op_sub(cld_coverage, cld_shell);
+            cld_shell = clamp((cld_detail + cld_shape), -1.0, 1.0) + cld_shell;
+        } 
+        else 
+        {
+            cld_coverage = remap(CN * coverage_area * SA, 0.0, 1.0, -1.0, 1.0);
+            cld_shell = sdf_op_sub(cld_coverage, cld_shell);
+        }
+
+        if (cld_shell < 0.f) 
+        {
+            ds = cloud.density * min(abs(cld_shell), 1.0) * DA;
+            dist = cld_shell;
+            hit = true;
+        } 
+        else 
+        {
+            ds = 0.0;
+            dist = cld_shell;
+            hit = false;
+        }
+    }
+    return hit;
+}
+
+bool cloud_density(
+    Cloud cloud,
+    vec3 pos, 
+    out float ds, 
+    out float dist, 
+    out float h_p) 
+{
+    dist = 0.0;
+    h_p = 0.0;
+    ds = 0.0;
+
+    vec3 t_pos = vec3(cloud.transform * vec4(pos, 1.0));
+    bool hit = cld_sample(cloud, t_pos, ds, dist, h_p);
+
+    ds = max(ds, 0.000000001);
+
+    return hit;
+}
+
+/* True if pos may be inside the cloud, i.e. it's inside the layer and its
+*  coverage. */
+bool cloud_coverage(Cloud cloud, vec3 pos)
+{
+    vec3 t_pos = vec3(cloud.transform * vec4(pos, 1.0));
+
+    float inner_shell = sdf_sphere(t_pos, cloud.radius);
+    float outer_shell = sdf_sphere(t_pos, cloud.radius + cloud.shell_thickness);
+    float cld_shell = sdf_op_sub(inner_shell, outer_shell);
+
+    if (cld_shell >= 0.0) return false;
+
+    vec3 pos_curl;
+    float CN, coverage_area, SA, h_p;
+    return cld_coverage_sample(cloud, t_pos, cld_shell, pos_curl, CN, coverage_area, SA, h_p) < 0.0;
+}
+
+float ray_optical_depth(Cloud cloud, Ray ray)
+{
+    float t_start, t_end;
+    shell_intersection(
+        ray, 
+        cld_domain_center + vec3(0, 0, earth_radius), 
+        cloud.radius, 
+        cloud.radius + cloud.shell_thickness, 
+        t_start, 
+        t_end);
+
+    float optical_depth = 0.0;
+
+    vec3 start_pos = ray.pos;
+    vec3 end_pos = (ray.pos + ray.dir * t_end);
+    float ray_length = distance(start_pos, end_pos);
+
+    ray_length = min(ray_length, 5000.0);
+
+    float segment_length = ray_length / cloud.max_light_steps;
+    float segment = segment_length;
+
+    float noise_offset = sample_blue_noise();
+    noise_offset *= segment;
+
+    float march_dst = noise_offset;
+    for (int i = 0; i < cloud.max_light_steps; i++)
+    {
+        vec3 pos = start_pos + ray.dir * march_dst;
+
+        float ds, dist, h_p;
+        bool in_cloud = cloud_density(cloud, pos, ds, dist, h_p);
+        if (in_cloud) {
+            optical_depth += ds * segment;
+        }
+
+        segment = in_cloud ? segment_length : max(dist, segment_length);
+        march_dst += segment;
+    }
+    return optical_depth;
+}
+
+vec3 ambient_light_sample(Cloud cloud, float h_p, Ray ray) 
+{
+
+    float remap_hp = saturate(remap(h_p, cloud.btm_roundness, 1.0, 0.0, 1.0));
+
+    vec3 top_color = texture(irra_tex, sample_spherical_map2(ray.dir)).rgb;
+    vec3 bottom_color = texture(irra_tex, clamp(vec2(0.5, remap_hp), vec2(0.01), vec2(0.1))).rgb;
+
+    float t = 1.0 - (pow(1.0 - remap_hp, 5.0));
+    vec3 ambient_color = mix(bottom_color, top_color, t) * cloud.ambient_intsty;
+
+    return ambient_color;
+}
+
+/* Multiple scattering approximation: */
+/* Oz: the great and volumetric       */
+/* DOI: 10.1145/2504459.2504518       */
+vec3 multi_scatter(Cloud cloud, Light light, float optical_depth, float mu)
+{
+    float _ai = 1.0; /* attenuation */
+    float _bi = 1.0; /* contribution */
+    float _ci = 1.0; /* eccentricity attenuation */
+
+    vec3 L = vec3(0.0);
+    for (int i = 0; i < 8; i++) 
+    {
+        float _phase = mix(phase_hg(mu, -0.1 * _ci), phase_hg(mu, 0.8 * _ci), 0.5);
+        L += _bi * _phase * exp(-_ai * optical_depth * cloud.sigma_t);
+
+        _ai *= cloud.atten;
+        _bi *= cloud.contr;
+        _ci *= cloud.eccen;
+    }
+    return L;
+}
+
+/* ------------------------------ Shadow Volume ----------------------------- */
+/* With CLD_SHADOW_VOLUME defined, the optical depth towards the lights is
+*  looked up instead of marched. stratus_cloud_shadow.frag bakes it once per
+*  light direction and cloud change (see shadow_utils.py, the size must
+*  match) over the same xy as the weather map, at shadow_volume_size.z
+*  heights through the layer. Slices are laid out along x, r holds the
+*  sun's optical depth, g the moon's. */
+
+const vec3 shadow_volume_size = vec3(256.0, 256.0, 16.0);
+
+#ifdef CLD_SHADOW_VOLUME
+
+uniform sampler2D shadow_volume_0;
+uniform sampler2D shadow_volume_1;
+
+vec2 shadow_volume_slice(Cloud cloud, vec2 x, float slice)
+{
+    vec2 slice_size = shadow_volume_size.xy;
+    vec2 volume_size = vec2(shadow_volume_size.z, 1.0) * slice_size;
+    vec2 uv = lut_region_uv(x, slice_size, vec2(slice, 0.0) * slice_size, volume_size);
+    return (cloud.layer == 0) ? texture(shadow_volume_0, uv).rg : texture(shadow_volume_1, uv).rg;
+}
+
+float shadow_volume_optical_depth(Cloud cloud, vec3 pos, int light_id)
+{
+    vec3 t_pos = vec3(cloud.transform * vec4(pos, 1.0));
+
+    vec2 x = t_pos.xy / (2.0 * cloud.weather_extent) + 0.5;
+    float h_p = saturate((length(t_pos) - cloud.radius) / cloud.shell_thickness);
+
+    float last_slice = shadow_volume_size.z - 1.0;
+    float s = h_p * last_slice;
+    float s0 = floor(s);
+    float s1 = min(s0 + 1.0, last_slice);
+
+    vec2 optical_depth = mix(shadow_volume_slice(cloud, x, s0), shadow_volume_slice(cloud, x, s1), s - s0);
+    return (light_id == 0) ? optical_depth.r : optical_depth.g;
+}
+
+#endif
+
+/* -------------------------------------------------------------------------- */
+
+vec3 direct_light_sample(Cloud cloud, Ray ray, Light light, int light_id)
+{
+    Ray light_ray;
+    light_ray.pos = ray.pos;
+    light_ray.dir = light.dir;
+
+    vec3 L_light = sun_radiation(light_ray, 0.1, true);
+
+    if (length(L_light) > 1e-3) {
+        float mu = dot(light.dir, ray.dir);
+        float phase = mix(phase_hg(mu, -0.1), phase_hg(mu, 0.8), 0.5);
+
+#ifdef CLD_SHADOW_VOLUME
+        float optical_depth = shadow_volume_optical_depth(cloud, light_ray.pos, light_id);
+#else
+        float optical_depth = ray_optical_depth(cloud, light_ray);
+#endif
+        vec3 L_scatter = multi_scatter(cloud, light, optical_depth, mu);
+
+        vec3 powder = 2.0 * (1.0 - (exp(-optical_depth * 2.0 * cloud.sigma_t)));
+        return mix(L_scatter, L_scatter * powder, 0.5 + 0.5 * mu) * L_light * phase;
+    } else {
+        return vec3(0.0);
+    }
+
+}
+
+/* Light scattered towards the camera over one step through the cloud. */
+void cloud_scatter_step(
+    Cloud cloud,
+    Ray ray,
+    float ds,
+    float h_p,
+    float segment,
+    inout vec3 scattered_light,
+    inout vec3 transmittance,
+    inout float tt)
+{
+    vec3 s_sigma_s = cloud.sigma_s * ds;
+    vec3 s_sigma_t = cloud.sigma_t * ds;
+
+    vec3 direct_light = vec3(0.0);
+    direct_light += (enable_sun && enable_sun_as_light) ? direct_light_sample(cloud, ray, sun, 0) : vec3(0.0);
+    direct_light += (enable_moon && enable_moon_as_light) ? direct_light_sample(cloud, ray, moon, 1) * 0.000025 : vec3(0.0);
+    vec3 ambient_light = ambient_light_sample(cloud, h_p, ray);
+
+    vec3 Li = (direct_light + ambient_light) * s_sigma_s;
+    scattered_light += transmittance * (Li - Li * exp(-s_sigma_t * segment)) / s_sigma_t;
+    transmittance *= exp(-s_sigma_t * segment);
+    tt *= exp(-segment * ds);
+}
+
+/* ------------------------------ March Quality ----------------------------- */
+/* The cloud quality presets (CLOUD_QUALITY in shader_utils.py) define these.
+*  Without them the march takes max_steps even steps across the layer.
+*
+*  With them the march is coarse-to-fine. Through empty sky it strides
+*  CLD_COARSE_STRIDE steps at a time and only looks at the coverage. When a
+*  stride lands in coverage it backs up and continues with full samples,
+*  until CLD_EMPTY_STEPS of them in a row past that point come up empty.
+*  Steps grow from CLD_NEAR_STEP to CLD_FAR_STEP times the even step length
+*  along the ray, so nearby cloud gets the finer steps. */
+
+#ifdef CLD_COARSE_STRIDE
+
+/* depth is where the ray enters the layer, hit_depth the distance to the
+*  cloud it went through, weighted by how much each step added to the
+*  opacity. */
+vec4 cloud_raymarch(Cloud cloud, Ray ray, out float depth, out float hit_depth) 
+{
+    depth = 0.0;
+    hit_depth = 0.0;
+    float hit_dst = 0.0;
+    
+    float opacity = 0.0;
+    float tt = 1.0;
+    vec3 transmittance = vec3(1.0);
+    vec3 scattered_light = vec3(0.0, 0.0, 0.0);
+
+    if (surface_intersection(ray)) return vec4(scattered_light, opacity);
+
+    float t_start, t_end;
+    shell_intersection(
+        ray, 
+        cld_domain_center + vec3(0, 0, earth_radius), 
+        cloud.radius, 
+        cloud.radius + cloud.shell_thickness, 
+        t_start, 
+        t_end);
+
+    vec3 start_pos = (ray.pos + ray.dir * t_start);
+    vec3 end_pos = (ray.pos + ray.dir * t_end);
+    float ray_length = distance(start_pos, end_pos);
+
+    depth = distance(ray.pos, start_pos);
+
+    float segment_length = ray_length / float(cloud.max_steps);
+
+    float noise_offset = sample_blue_noise();
+    noise_offset *= segment_length;
+
+    bool coarse = true;
+    int empty_steps = 0;
+    float refine_start = 0.0;
+
+    /* Where the fine samples left off, backing up never goes behind it so
+    *  no part of the ray is integrated twice. */
+    float fine_end = noise_offset;
+
+    /* Only the fine samples count against max_steps. Strides cross the ray
+    *  in max_steps / (CLD_NEAR_STEP * CLD_COARSE_STRIDE) at most, and every
+    *  back-up but the first comes after CLD_EMPTY_STEPS fine samples and
+    *  undoes at most one stride. */
+    int fine_steps = 0;
+    int max_backups = cloud.max_steps / CLD_EMPTY_STEPS + 1;
+    int max_iterations = cloud.max_steps + 2 * max_backups
+                       + int(ceil(float(cloud.max_steps) / (CLD_NEAR_STEP * CLD_COARSE_STRIDE)));
+
+    float march_dst = noise_offset;
+    for (int i = 0; i < max_iterations; i++) {
+        if (march_dst >= ray_length) break;
+
+        ray.pos = start_pos + march_dst * ray.dir;
+        float segment = segment_length * mix(CLD_NEAR_STEP, CLD_FAR_STEP, saturate(march_dst / ray_length));
+
+        if (coarse) {
+            if (cloud_coverage(cloud, ray.pos)) {
+                /* The cloud starts somewhere within the last stride. */
+                coarse = false;
+                empty_steps = 0;
+                refine_start = march_dst;
+                march_dst = max(march_dst - segment * CLD_COARSE_STRIDE, fine_end);
+            } else {
+                march_dst += segment * CLD_COARSE_STRIDE;
+            }
+            continue;
+        }
+
+        if (fine_steps >= cloud.max_steps) break;
+        fine_steps++;
+
+        float ds, dist, h_p;
+        bool in_cloud = cloud_density(cloud, ray.pos, ds, dist, h_p);
+
+        if (in_cloud) 
+        {
+            float tt_prev = tt;
+            cloud_scatter_step(cloud, ray, ds, h_p, segment, scattered_light, transmittance, tt);
+            hit_dst += (tt_prev - tt) * march_dst;
+            empty_steps = 0;
+        }
+        else if (march_dst > refine_start)
+        {
+            empty_steps++;
+        }
+
+        if (tt < CLD_MIN_TRANSMITTANCE) {
+            tt = 0.0;
+            break;
+        }
+
+        coarse = (empty_steps >= CLD_EMPTY_STEPS);
+        march_dst += in_cloud ? segment : max(dist, segment);
+        fine_end = march_dst;
+    }
+
+    opacity = 1.0 - tt;
+    hit_depth = depth + hit_dst / max(opacity, 1e-6);
+
+    return vec4(scattered_light, opacity);
+}
+
+#else
+
+/* depth is where the ray enters the layer, hit_depth the distance to the
+*  cloud it went through, weighted by how much each step added to the
+*  opacity. */
+vec4 cloud_raymarch(Cloud cloud, Ray ray, out float depth, out float hit_depth) 
+{
+    depth = 0.0;
+    hit_depth = 0.0;
+    float hit_dst = 0.0;
+    
+    float opacity = 0.0;
+    float tt = 1.0;
+    vec3 transmittance = vec3(1.0);
+    vec3 scattered_light = vec3(0.0, 0.0, 0.0);
+
+    if (surface_intersection(ray)) return vec4(scattered_light, opacity);
+
+    float t_start, t_end;
+    shell_intersection(
+        ray, 
+        cld_domain_center + vec3(0, 0, earth_radius), 
+        cloud.radius, 
+        cloud.radius + cloud.shell_thickness, 
+        t_start, 
+        t_end);
+
+    vec3 start_pos = (ray.pos + ray.dir * t_start);
+    vec3 end_pos = (ray.pos + ray.dir * t_end);
+    float ray_length = distance(start_pos, end_pos);
+
+    depth = distance(ray.pos, start_pos);
+
+    float segment_length = ray_length / float(cloud.max_steps);
+    float segment = segment_length;
+
+    float noise_offset = sample_blue_noise();
+    noise_offset *= segment;
+
+    float march_dst = noise_offset;
+    for (int i = 0; i < cloud.max_steps; i++) {
+        ray.pos = start_pos + march_dst * ray.dir;
+
+        float ds, dist, h_p;
+        bool in_cloud = cloud_density(cloud, ray.pos, ds, dist, h_p);
+
+        if (in_cloud) 
+        {
+            float tt_prev = tt;
+            cloud_scatter_step(cloud, ray, ds, h_p, segment, scattered_light, transmittance, tt);
+            hit_dst += (tt_prev - tt) * march_dst;
+        }
+
+        if (tt < 0.0001) {
+            tt = 0.0;
+            break;
+        }
+
+        segment = in_cloud ? segment_length : max(dist, segment_length);
+        march_dst += segment;
+    }
+
+    opacity = 1.0 - tt;
+    hit_depth = depth + hit_dst / max(opacity, 1e-6);
+
+    return vec4(scattered_light, opacity);
+}
+
+#endif
+
+vec4 compute_cld(Cloud cloud, Ray ray, out float hit_depth)
+{
+    float   cld_depth     = 0.0;
+    vec4    cld_color     = vec4(0.0);
+    cld_color = cloud_raymarch(cloud, ray, cld_depth, hit_depth);
+
+    vec3 cld_point = ray.pos + ray.dir * cld_depth;
+
+    vec4 cld_ap = vec4(0.0);
+    cld_ap += (enable_atm && enable_sun && enable_sun_as_light) ? atmo_aerial_perspective(ray, sun, 0, cld_point) : vec4(0.0);
+    cld_ap += (enable_atm && enable_moon && enable_moon_as_light) ? atmo_aerial_perspective(ray, moon, 1, cld_point) * 0.000025 : vec4(0.0); 
+
+    float ap_clouds = exp(-cld_depth / cloud.ap_intsty);
+    cld_color.rgb = _mix(cld_ap.rgb * cld_color.a, cld_color.rgb, ap_clouds);
+
+    return cld_color;
+}
+
+/* ------------------------------- Sky Shading ------------------------------ */
+
+/* cld_depth where there are no clouds. */
+const float sky_depth = 1e7;
+
+/* Shades a view ray, moon_color is sampled by the caller. The baked image
+   clamps the alpha of the sky behind the clouds, the viewport doesn't.
+   cld_depth is the distance to the clouds, weighted by their opacity, the
+   viewport upsamples with it. */
+vec4 shade_sky(Ray ray, vec4 moon_color, bool clamp_alpha, out float cld_depth)
+{
+    cld_depth = sky_depth;
+
+    /* ---------------------------- Render Atmosphere --------------------------- */
+
+    vec4 atmo_color = vec4(0.0);
+    atmo_color += (enable_atm && enable_sun && enable_sun_as_light) ? atmo_sky_view(ray, sun, 0) : vec4(0.0);
+    atmo_color += (enable_atm && enable_moon && enable_moon_as_light) ? atmo_sky_view(ray, moon, 1) * 0.000025 : vec4(0.0);
+
+    vec4 stars_color = (enable_stars) ? draw_stars(ray) : vec4(0.0);
+
+    precise vec4 sun_color = (enable_sun) ? draw_sun(ray) : vec4(0.0);
+
+    sun_color = _mix(stars_color, sun_color, sun_color.a);
+
+    precise vec4 moon_sun_color = _mix(sun_color, moon_color, moon_color.a);
+
+    /* ------------------------------ Render Clouds ----------------------------- */
+
+    precise vec4 sky_color = vec4(0.0);
+
+    if (enable_cld_0 || enable_cld_1) {
+
+        vec4 cld_0_color = vec4(0.0);
+        vec4 cld_1_color = vec4(0.0);
+
+        float cld_0_depth = sky_depth;
+        float cld_1_depth = sky_depth;
+
+        if (enable_cld_0) cld_0_color = compute_cld(cloud_0, ray, cld_0_depth);
+        if (enable_cld_1) cld_1_color = compute_cld(cloud_1, ray, cld_1_depth);
+
+        /* Layer 1 is composited over layer 0. */
+        float cld_0_weight = (1.0 - cld_1_color.a) * cld_0_color.a;
+        float cld_weight = cld_1_color.a + cld_0_weight;
+        if (cld_weight > 0.01) {
+            cld_depth = (cld_1_color.a * cld_1_depth + cld_0_weight * cld_0_depth) / cld_weight;
+        }
+
+        atmo_color += moon_sun_color;
+        if (clamp_alpha) atmo_color.a = clamp(atmo_color.a, 0.0, 1.0);
+
+        sky_color = atmo_color*(1.0 - cld_0_color.a) + cld_0_color;
+        sky_color = sky_color*(1.0 - cld_1_color.a) + cld_1_color;
+
+    } else {
+        sky_color = atmo_color + moon_sun_color;
+        if (clamp_alpha) sky_color.a = clamp(sky_color.a, 0.0, 1.0);
+    }
+
+    return sky_color;
+}
@@ -0,0 +1,393 @@
+/* ------------------------------------------------------------------------- *
+*
+*    Copyright (C) 2023 Jake Kurtz
+*
+*    This program is free software: you can redistribute it and/or modify
+*    it under the terms of the GNU General Public License as published by
+*    the Free Software Foundation, either version 3 of the License, or
+*    (at your option) any later version.
+*
+*    This program is distributed in the hope that it will be useful,
+*    but WITHOUT ANY WARRANTY; without even the implied warranty of
+*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+*    GNU General Public License for more details.
+*
+*    You should have received a copy of the GNU General Public License
+*    along with this program. If not, see <https://www.gnu.org/licenses/>.
+*
+* ------------------------------------------------------------------------- */
+
+/* -------------------------------------------------------------------------- */
+/*                                   UTILITY                                  */
+/* -------------------------------------------------------------------------- */
+
+uniform vec2 img_size;
+
+#define M_PI        3.1415926535897932
+#define M_3_16PI    0.0596831036594607 // 3 / (16pi)
+#define M_1_PI      0.3183098861837906 // 1 / pi
+#define M_1_2PI     0.1591549430918953 // 1 / (2pi)
+#define M_1_4PI     0.0795774715459476 // 1 / (4pi)
+#define M_PI_180    0.0174532925199432 // pi / 180
+#define M_180_PI    57.295779513082320 // 180 / pi
+#define M_2PI       6.2831853071795864 // 2pi
+
+struct Ray
+{
+    vec3 pos;
+    vec3 dir;
+};
+
+struct Light
+{
+    vec3 dir;
+    float intsty;
+    float silver_intsty;
+    float silver_spread;
+};
+
+float saturate(float x)
+{
+    return clamp(x, 0.0, 1.0);
+}
+
+float remap(float v, float l1, float h1, float l2, float h2)
+{
+    return l2 + (v - l1) * (h2 - l2) / (h1 - l1);
+}
+
+/* Using big numbers causes weird issues with normal mix for some reason.*/
+vec3 _mix(vec3 a, vec3 b, float t) {
+    return saturate(1.0 - t) * a + saturate(t) * b;
+}
+
+vec4 _mix(vec4 a, vec4 b, float t) {
+    return saturate(1.0 - t) * a + saturate(t) * b;
+}
+
+vec4 tex_sample(sampler2D tex, vec2 uv)
+{
+    return texture(tex, mod(uv, vec2(1.0)));
+}
+
+vec4 bicubic_sample(sampler2D tex, vec2 uv, vec2 size) 
+{
+    vec2 tex_size = size;
+    vec2 inv_tex_size = 1.0 / tex_size;
+
+    vec2 tc = uv * tex_size - 0.5;
+    vec2 f = fract(tc);
+    tc -= f;
+ 
+    // we'll need the second and third powers
+    // of f to compute our filter weights
+    vec2 f2 = f * f;
+    vec2 f3 = f2 * f;
+ 
+    //compute the filter weights
+    vec2 w0 = f2 - 0.5 * (f3 + f);
+    vec2 w1 = 1.5 * f3 - 2.5 * f2 + 1.0;
+    vec2 w3 = 0.5 * (f3 - f2);
+    vec2 w2 = 1.0 - w0 - w1 - w3;
+
+    vec2 s0 = w0 + w1;
+    vec2 s1 = w2 + w3;
+ 
+    vec2 f0 = w1 / (w0 + w1);
+    vec2 f1 = w3 / (w2 + w3);
+ 
+    vec2 t0 = tc - 1.0 + f0;
+    vec2 t1 = tc + 1.0 + f1;
+
+    t0 *= inv_tex_size;
+    t1 *= inv_tex_size;
+
+    return
+        (texture( tex, vec2( t0.x, t0.y ) ) * s0.x
+      +  texture( tex, vec2( t1.x, t0.y ) ) * s1.x) * s0.y
+      + (texture( tex, vec2( t0.x, t1.y ) ) * s0.x
+      +  texture( tex, vec2( t1.x, t1.y ) ) * s1.x) * s1.y;
+}
+
+vec4 bicubic_sample(sampler3D tex, vec3 uvw, vec3 size) 
+{
+    vec3 tex_size = size;
+    vec3 inv_tex_size = 1.0 / tex_size;
+
+    vec3 tc = mod(uvw, vec3(1.0)) * tex_size - 0.5;
+    vec3 f = fract(tc);
+    tc -= f;
+ 
+    // we'll need the second and third powers
+    // of f to compute our filter weights
+    vec3 f2 = f * f;
+    vec3 f3 = f2 * f;
+ 
+    //compute the filter weights
+    vec3 w0 = f2 - 0.5 * (f3 + f);
+    vec3 w1 = 1.5 * f3 - 2.5 * f2 + 1.0;
+    vec3 w3 = 0.5 * (f3 - f2);
+    vec3 w2 = 1.0 - w0 - w1 - w3;
+
+    vec3 s0 = w0 + w1;
+    vec3 s1 = w2 + w3;
+ 
+    vec3 f0 = w1 / (w0 + w1);
+    vec3 f1 = w3 / (w2 + w3);
+ 
+    vec3 t0 = tc - 1.0 + f0;
+    vec3 t1 = tc + 1.0 + f1;
+
+    t0 *= inv_tex_size;
+    t1 *= inv_tex_size;
+
+    return
+        texture( tex, vec3( t0.x, t0.y, t0.z ) ) * s0.x * s0.y * s0.z
+      + texture( tex, vec3( t1.x, t0.y, t0.z ) ) * s1.x * s0.y * s0.z
+      + texture( tex, vec3( t0.x, t1.y, t0.z ) ) * s0.x * s1.y * s0.z
+      + texture( tex, vec3( t1.x, t1.y, t0.z ) ) * s1.x * s1.y * s0.z
+      + texture( tex, vec3( t0.x, t0.y, t1.z ) ) * s0.x * s0.y * s1.z
+      + texture( tex, vec3( t1.x, t0.y, t1.z ) ) * s1.x * s0.y * s1.z
+      + texture( tex, vec3( t0.x, t1.y, t1.z ) ) * s0.x * s1.y * s1.z
+      + texture( tex, vec3( t1.x, t1.y, t1.z ) ) * s1.x * s1.y * s1.z;
+}
+
+float reduce_add(vec3 f)
+{
+  return f.x + f.y + f.z;
+}
+
+vec3 sample_spherical_direction(vec2 uv)
+{
+    float phi = M_2PI * (uv.x - 0.5);
+    float theta = M_PI * uv.y;
+
+    vec3 n;
+    n.x = cos(phi) * sin(theta);
+    n.y = -sin(phi) * sin(theta);
+    n.z = -cos(theta);
+
+    return n;
+}
+
+vec2 sample_spherical_map(vec3 d)
+{
+    vec2 uv = vec2(0.5 - atan(d.z, d.x) * M_1_2PI, 0.5 + asin(d.y) * M_1_PI);
+    return uv;
+}
+
+vec2 sample_spherical_map2(const vec3 d)
+{
+    vec2 uv = vec2(0.5 - atan(d.y, d.x) * M_1_2PI, 0.5 + asin(d.z) * M_1_PI);
+    return uv;
+}
+
+vec3 orthogonal(vec3 v)
+{
+    return abs(v.x) > abs(v.z) ? vec3(-v.y, v.x, 0.0) : vec3(0.0, -v.z, v.y);
+}
+
+vec3 tangent(vec3 N) 
+{
+  vec3 T, B;
+  if(N.x == .0 && N.z == .0) T = vec3(0.,0.,.1);
+  if(N.z == .0) T = vec3(0.,0.,-1.);
+  else 
+  {
+    float l = sqrt(N.x*N.x+N.z*N.z);
+    T.x = N.z/l;
+    T.y = .0;
+    T.z = -N.x/l;
+  }
+  return T;
+}
+
+/* ------------------------------ SDF Functions ----------------------------- */
+
+float sdf_sphere( vec3 p, float s ) 
+{
+  return length(p)-s;
+}
+
+float sdf_op_sub(float d1, float d2) 
+{ 
+    return max(-d1,d2); 
+}
+
+float sdf_op_smooth_sub( float d1, float d2, float k ) 
+{
+    float h = clamp( 0.5 - 0.5*(d2+d1)/k, 0.0, 1.0 );
+    return mix( d2, -d1, h ) + k*h*(1.0-h); 
+}
+
+/* ------------------------- Intersection Functions ------------------------- */
+
+bool sphere_intersect(Ray ray, vec3 center, float radius, out float t0, out float t1)
+{
+    precise vec3 l = (ray.pos - center);
+    precise float b = dot(ray.dir, l);
+    precise vec3 qc = l - b*ray.dir;
+    precise float h = radius*radius - dot(qc,qc);
+
+    if (h < 0.0) {
+        t0 = -1.0;
+        t1 = -1.0;
+        return false;
+    }
+
+    h = sqrt(h);
+
+    t0 = -b-h;
+    t1 = -b+h;
+
+    bool behind = (t0 < 0.0 && t1 < 0.0);
+
+    return !behind;
+}
+
+/* ---------------------------------- Hash ---------------------------------- */
+
+#define UI0 1597334673U
+#define UI1 3812015801U
+#define UI2 uvec2(UI0, UI1)
+#define UI3 uvec3(UI0, UI1, 2798796415U)
+#define UIF (1.0 / float(0xffffffffU))
+
+float hash11(float n) 
+{ 
+    return fract(sin(n)*43758.5453); 
+}
+
+vec2 hash22(vec2 p) 
+{ 
+    p = vec2( dot(p,vec2(127.1,311.7)), dot(p,vec2(269.5,183.3)) ); 
+    return -1. + 2. * fract(sin(p)*43758.5453); 
+}
+
+float hash12(vec2 p)
+{
+	vec3 p3  = fract(vec3(p.xyx) * .1031);
+    p3 += dot(p3, p3.yzx + 33.33);
+    return fract((p3.x + p3.y) * p3.z);
+}
+
+vec3 hash33(vec3 p)
+{
+    uvec3 q = uvec3(ivec3(p)) * UI3;
+    q = (q.x ^ q.y ^ q.z)*UI3;
+    return vec3(q) * UIF;
+}
+
+/* ---------------------------------- Noise --------------------------------- */
+
+vec4 worley(vec3 uv)
+{    
+    vec3 id = floor(uv);
+    vec3 p = fract(uv);
+    vec4 v = vec4(10000.0, 0.0, 0.0, 0.0);
+
+    for (float x = -1.; x <= 1.; ++x)
+    {
+        for(float y = -1.; y <= 1.; ++y)
+        {
+            for(float z = -1.; z <= 1.; ++z)
+            {
+              vec3 offset = vec3(x, y, z);
+              vec3 h = hash33((id + offset));
+              vec3 d = p - (h + offset);
+
+              float s = smoothstep(-1.0, 1.0, (v.x-length(d))/0.3);
+              v.yzw = mix(v.yzw, h, s);
+              v.x = min(v.x, length(d));
+            }
+        }
+    }
+    return v;
+}
+
+float gradientNoise(vec3 x, float freq)
+{
+    // grid
+    vec3 p = floor(x);
+    vec3 w = fract(x);
+    
+    // quintic interpolant
+    vec3 u = w * w * w * (w * (w * 6. - 15.) + 10.);
+    
+    // gradients
+    vec3 ga = hash33(mod(p + vec3(0., 0., 0.), freq));
+    vec3 gb = hash33(mod(p + vec3(1., 0., 0.), freq));
+    vec3 gc = hash33(mod(p + vec3(0., 1., 0.), freq));
+    vec3 gd = hash33(mod(p + vec3(1., 1., 0.), freq));
+    vec3 ge = hash33(mod(p + vec3(0., 0., 1.), freq));
+    vec3 gf = hash33(mod(p + vec3(1., 0., 1.), freq));
+    vec3 gg = hash33(mod(p + vec3(0., 1., 1.), freq));
+    vec3 gh = hash33(mod(p + vec3(1., 1., 1.), freq));
+    
+    // projections
+    float va = dot(ga, w - vec3(0., 0., 0.));
+    float vb = dot(gb, w - vec3(1., 0., 0.));
+    float vc = dot(gc, w - vec3(0., 1., 0.));
+    float vd = dot(gd, w - vec3(1., 1., 0.));
+    float ve = dot(ge, w - vec3(0., 0., 1.));
+    float vf = dot(gf, w - vec3(1., 0., 1.));
+    float vg = dot(gg, w - vec3(0., 1., 1.));
+    float vh = dot(gh, w - vec3(1., 1., 1.));
+	
+    // interpolation
+    return va + 
+           u.x * (vb - va) + 
+           u.y * (vc - va) + 
+           u.z * (ve - va) + 
+           u.x * u.y * (va - vb - vc + vd) + 
+           u.y * u.z * (va - vc - ve + vg) + 
+           u.z * u.x * (va - vb - ve + vf) + 
+           u.x * u.y * u.z * (-va + vb + vc - vd + ve - vf - vg + vh);
+}
+
+float gradientNoise(vec2 x, float freq)
+{
+    // grid
+    vec2 p = floor(x);
+    vec2 w = fract(x);
+    
+    vec2 u = w*w*(3.0-2.0*w);
+
+    // gradients
+    vec2 ga = hash22(mod(p + vec2(0., 0.), freq));
+    vec2 gb = hash22(mod(p + vec2(1., 0.), freq));
+    vec2 gc = hash22(mod(p + vec2(0., 1.), freq));
+    vec2 gd = hash22(mod(p + vec2(1., 1.), freq));
+
+    // projections
+    float va = dot(ga, w - vec2(0., 0.));
+    float vb = dot(gb, w - vec2(1., 0.));
+    float vc = dot(gc, w - vec2(0., 1.));
+    float vd = dot(gd, w - vec2(1., 1.));
+	
+    // interpolation
+    
+    float a = mix( va, vb, u.x);
+    float b = mix( vc, vd, u.x);
+    return mix( a, b, u.y);
+    
+    return va + 
+           u.x * (vb - va) + 
+           u.y * (vc - va) + 
+           u.x * u.y * (va - vb - vc + vd);
+}
+
+float perlinfbm(vec3 p, float freq, int octaves)
+{
+    float G = exp2(-.85);
+    float amp = 1.;
+    float noise = 0.;
+    for (int i = 0; i < octaves; ++i)
+    {
+        noise += amp * gradientNoise(p.xy * freq, freq);
+        freq *= 2.;
+        amp *= G;
+    }
+    
+    return noise;
+}